@@ -1,14 +1,20 @@
 # app.py
 import re
-from collections import defaultdict
+import time
 import streamlit as st
 import google.generativeai as genai
 
 from logic import (
-    lataa_raamattu, luo_kanoninen_avain, lue_ladattu_tiedosto,
-    luo_hakusuunnitelma, validoi_avainsanat_ai, etsi_mekaanisesti,
-    suodata_semanttisesti, pisteyta_ja_jarjestele, hae_jae_viitteella
+    URL_BIBLE_JSON, URL_DICTIONARY_JSON, llm_valimuisti,
+    lataa_raamattu, lue_ladattu_tiedosto, luo_hakusuunnitelma,
+    KANDIDAATTIBUDJETTI, validoi_avainsanat, korjaa_avainsanat, keraa_jakeet, keraa_jakeet_vektoreilla,
+    pisteyta_ja_jarjestele, hae_osion_teema, KASKADIPISTEYTYS
 )
+from fuzzy_match import SymSpell
+from keyword_expansion import PrefixExpander
+from query_planner import QueryPlanner, lataa_sanatilastot
+from section_memo import OsioMuisti
+from vector_index import TfidfIndex
 
 # Poistetaan vanhentuneet asetukset (MAX_HITS, jne.)
 
@@ -44,8 +50,93 @@ def laske_kustannus_arvio(token_counts):
     return f"~${total_cost:.4f} (Groq + Gemini)"
 
 
+@st.cache_resource(show_spinner="Ladataan Raamattua ja sanakirjaa...")
+def hae_raamattu_resurssit():
+    """
+    Lataa Raamatun kerran prosessia kohden. Tulos jaetaan kaikkien
+    istuntojen kesken, eikä sitä saa muokata.
+    """
+    resurssit = lataa_raamattu(URL_BIBLE_JSON, URL_DICTIONARY_JSON)
+    if not resurssit:
+        # Poikkeusta ei tallenneta välimuistiin, joten seuraava ajo yrittää
+        # latausta uudelleen.
+        raise RuntimeError("Raamatun tai sanakirjan lataus epäonnistui.")
+    return resurssit
+
+
+def hae_sanakirja_ja_indeksi():
+    """Palauttaa (raamattu_sanakirja, sanaindeksi) ladatuista resursseista."""
+    (
+        _, _, _, _, _, _, raamattu_sanakirja, _, sanaindeksi
+    ) = hae_raamattu_resurssit()
+    return raamattu_sanakirja, sanaindeksi
+
+
+@st.cache_resource(show_spinner="Rakennetaan paikallista vektori-indeksiä...")
+def hae_vektori_indeksi():
+    """Rakentaa TF-IDF-indeksin kerran prosessia kohden tarvittaessa."""
+    _, sanaindeksi = hae_sanakirja_ja_indeksi()
+    return TfidfIndex(sanaindeksi)
+
+
+@st.cache_resource
+def hae_laajentaja():
+    """Avainsanojen taivutusmuotojen laajentaja sanakirjan pohjalta."""
+    return PrefixExpander(*hae_sanakirja_ja_indeksi())
+
+
+@st.cache_resource(show_spinner="Rakennetaan sumeaa sanahakua...")
+def hae_sumea_haku():
+    """SymSpell-indeksi avainsanojen kirjoitusasujen korjaamiseen."""
+    raamattu_sanakirja, sanaindeksi = hae_sanakirja_ja_indeksi()
+    postings = sanaindeksi.postings
+    return SymSpell(
+        raamattu_sanakirja,
+        frekvenssi=lambda sana: len(postings[sana]) if sana in postings else 0
+    )
+
+
+@st.cache_resource
+def hae_suunnittelija():
+    """Hakusuunnittelija sanatilastoista (tai sanaindeksistä)."""
+    _, sanaindeksi = hae_sanakirja_ja_indeksi()
+    return QueryPlanner(sanaindeksi, lataa_sanatilastot())
+
+
+def hae_osiomuisti():
+    """
+    Istunnon osiokohtainen muisti: sisällysluettelon muokkauksen jälkeen
+    vain muuttuneet osiot haetaan ja pisteytetään uudelleen.
+    """
+    if "osiomuisti" not in st.session_state:
+        st.session_state.osiomuisti = OsioMuisti()
+    return st.session_state.osiomuisti
+
+
+def muotoile_osio(osio_nro, data, sisallysluettelo):
+    """Muotoilee yhden osion jakeet raportin markdown-muotoon."""
+    otsikko_match = re.search(
+        r"^{}\.?\s*(.*)".format(re.escape(osio_nro.strip('.'))),
+        sisallysluettelo, re.MULTILINE)
+    otsikko = otsikko_match.group(1) if otsikko_match else f"Osio {osio_nro}"
+
+    taso = osio_nro.count('.') + 2
+    teksti = f"{'#' * taso} {osio_nro} {otsikko}\n\n"
+
+    rel = data.get("relevantimmat", [])
+    v_rel = data.get("vahemman_relevantit", [])
+
+    if not rel and not v_rel:
+        teksti += "*Ei löytynyt jakeita tähän osioon.*\n\n"
+    if rel:
+        teksti += "**Relevantimmat jakeet:**\n" + "".join(f"- {j}\n" for j in rel) + "\n"
+    if v_rel:
+        teksti += "**Vähemmän relevantit jakeet:**\n" + "".join(f"- {j}\n" for j in v_rel) + "\n"
+    return teksti
+
+
 def reset_session():
-    """Nollaa session ja palaa aloitussivulle."""
+    """Nollaa session (myös osiomuistin) ja palaa aloitussivulle."""
     st.session_state.clear()
     st.session_state.step = "input"
     st.rerun()
@@ -73,10 +164,6 @@ def main():
         page_title="Älykäs Raamattu-tutkija 2.5", layout="wide")
     st.title("📖 Älykäs Raamattu-tutkija v.2.5 (Älykäs Haku)")
 
-   # Määritellään tiedostojen raakalinkit GitHubissa
-    URL_BIBLE_JSON = "https://raw.githubusercontent.com/juhanorolampi-ship-it/raamattu-tutkija-2.0/version-2.5/bible.json"
-    URL_DICTIONARY_JSON = "https://raw.githubusercontent.com/juhanorolampi-ship-it/raamattu-tutkija-2.0/version-2.5/bible_dictionary.json"
-
     # Alustukset
     if "step" not in st.session_state:
         st.session_state.step = "input"
@@ -90,8 +177,9 @@ def main():
             "API-avainta (GEMINI_API_KEY) ei löydy Streamlitin secreteistä.")
         st.stop()
 
-    raamattu_resurssit = lataa_raamattu(URL_BIBLE_JSON, URL_DICTIONARY_JSON)
-    if not raamattu_resurssit:
+    try:
+        raamattu_resurssit = hae_raamattu_resurssit()
+    except RuntimeError:
         st.error(
             "KRIITTINEN VIRHE: Raamatun ja/tai sanakirjan lataus epäonnistui. "
             "Varmista, että tiedostot ovat saatavilla GitHubissa."
@@ -99,8 +187,7 @@ def main():
         st.stop()
 
     (
-        _, _, book_name_map, book_data_map, _,
-        book_name_to_id_map, raamattu_sanakirja
+        _, _, _, _, _, _, raamattu_sanakirja, jaevarasto, sanaindeksi
     ) = raamattu_resurssit
 
     # --- SIVUPALKKI ---
@@ -111,6 +198,20 @@ def main():
             value=f"{st.session_state.token_count['total']:,}",
             help=laske_kustannus_arvio(st.session_state.token_count)
         )
+        if llm_valimuisti:
+            tilastot = llm_valimuisti.tilastot()
+            st.caption(
+                f"Vastausvälimuisti: {tilastot['osumat']} osumaa, "
+                f"{tilastot['ohitukset']} ohitusta "
+                f"({tilastot['osumaprosentti']:.0f} %), säästetty "
+                f"{tilastot['saastetyt_tokenit']:,} tokenia (tämä prosessi)"
+            )
+        if "osiomuisti" in st.session_state:
+            tilastot = st.session_state.osiomuisti.tilastot()
+            st.caption(
+                f"Osiomuisti: {tilastot['osumat']} uudelleenkäyttöä, "
+                f"{tilastot['ohitukset']} uutta laskentaa"
+            )
         st.divider()
         st.button("Aloita uusi tutkimus", on_click=reset_session,
                   type="primary", use_container_width=True)
@@ -161,33 +262,107 @@ def main():
             height=250,
             key="final_sisallysluettelo"
         )
+        laajentaja = hae_laajentaja()
+        with st.expander("Avainsanojen taivutusmuodot korpuksessa"):
+            for osio, laajennukset in laajentaja.laajenna_hakukomennot(
+                plan["hakukomennot"]
+            ).items():
+                rivit = [
+                    f"**{sana}**: " + ", ".join(
+                        f"{muoto} ({maara})" for muoto, maara in muodot[:15]
+                    ) + (f" … (+{len(muodot) - 15})" if len(muodot) > 15 else "")
+                    for sana, muodot in laajennukset.items() if muodot
+                ]
+                if rivit:
+                    st.markdown(f"Osio {osio}  \n" + "  \n".join(rivit))
+
+        arviot = hae_suunnittelija().suunnittele(
+            plan["hakukomennot"], KANDIDAATTIBUDJETTI
+        )
+        laajoja = sum(len(a["pudotetut"]) for a in arviot.values())
+        with st.expander(
+            f"Hakusanojen osumamääräarviot ({laajoja} liian laajaa)",
+            expanded=laajoja > 0
+        ):
+            merkit = {"ok": "", "laaja": " ⚠️", "pudotettu": " ⛔"}
+            for osio, arvio in arviot.items():
+                sanat = ", ".join(
+                    f"{sana} (~{'?' if maara is None else maara}){merkit[tila]}"
+                    for sana, maara, tila in arvio["arviot"]
+                )
+                budjetti = " – yli kandidaattibudjetin, karsitaan BM25:llä" \
+                    if arvio["yli_budjetin"] else ""
+                st.markdown(
+                    f"**Osio {osio}** (~{arvio['yhteensa']} jaetta{budjetti}): "
+                    f"{sanat}"
+                )
+            st.caption("⚠️ laaja avainsana, ⛔ pudotetaan haun valikoivuuden vuoksi")
+        pudota_laajat = st.checkbox(
+            "Pudota liian laajat avainsanat", value=True,
+            help="Avainsanat, jotka osuvat yli 8 %:iin jakeista, jätetään pois, "
+                 "jos osiossa on muita avainsanoja."
+        )
         haku_tapa = st.radio(
             "Valitse jakeiden keräystapa:",
-            ["Yksinkertainen haku", "Älykäs haku (Suositus)"],
+            ["Yksinkertainen haku", "Älykäs haku (Suositus)",
+             "Semanttinen haku (paikallinen)"],
             index=1,
             help=(
                 "**Yksinkertainen haku:** Tekee nopean mekaanisen haun avainsanoilla. Laaja, mutta voi sisältää epärelevantteja osumia.\n\n"
-                "**Älykäs haku:** Käyttää monivaiheista tekoälyprosessia (esihaku + suodatus) tuottaakseen laadukkaimman ja kohdennetuimman tuloksen."
+                "**Älykäs haku:** Käyttää monivaiheista tekoälyprosessia (esihaku + suodatus) tuottaakseen laadukkaimman ja kohdennetuimman tuloksen.\n\n"
+                "**Semanttinen haku:** Etsii osion teemaa lähimmät jakeet paikallisella vektorihaulla ilman tekoälykutsuja. Löytää myös jakeita, joissa avainsanat eivät esiinny sellaisenaan."
             )
         )
         if st.button("Kerää jakeet →", type="primary"):
             st.session_state.suunnitelma["vahvistettu_sisallysluettelo"] = \
                 st.session_state.final_sisallysluettelo
+            for vanha in ("jae_kartta", "kaskadi_tilastot"):
+                st.session_state.pop(vanha, None)
+            osiomuisti = hae_osiomuisti()
+            versio = jaevarasto.versio
 
-            osio_kohtaiset_jakeet = defaultdict(set)
             hakukomennot = st.session_state.suunnitelma["hakukomennot"]
+            if pudota_laajat:
+                hakukomennot = QueryPlanner.sovella(hakukomennot, arviot)
             p_bar = st.progress(0, text="Valmistellaan...")
 
-            # Vaihe 1.5: Älykäs avainsanojen validointi
+            # SymSpell rakennetaan vasta, jos jokin sana tarvitsee sumeaa
+            # korjausta
+            hakukomennot, korvaukset = korjaa_avainsanat(
+                hakukomennot, sanaindeksi, hae_sumea_haku,
+                laajentaja=laajentaja
+            )
+            if korvaukset:
+                st.info("Korjattiin avainsanoja, joita ei löydy KR33/38:sta:\n\n" + "\n".join(
+                    f"- Osio {osio}: {sana} → {', '.join(korvaavat)}"
+                    for osio, sana, korvaavat in korvaukset
+                ))
+
+            # Vaihe 1.5: Avainsanojen validointi (sanakirja, epäselvät AI:lla)
             p_bar.progress(0.1, text="Vaihe 1.5: Validoidaan avainsanoja...")
-            with st.spinner("Tarkistetaan avainsanojen raamatullisuutta (AI)..."):
-                kaikki_avainsanat = list(set(
+            with st.spinner("Tarkistetaan avainsanojen raamatullisuutta..."):
+                kaikki_avainsanat = sorted(set(
                     sana for avainsanalista in hakukomennot.values()
                     for sana in avainsanalista
                 ))
-                hyvaksytyt_sanat_setti = validoi_avainsanat_ai(
-                    kaikki_avainsanat, paivita_token_laskuri
-                )
+
+                def validoi(sanat):
+                    hyvaksytyt = validoi_avainsanat(
+                        sanat, raamattu_sanakirja, paivita_token_laskuri
+                    )
+                    return {sana: sana in hyvaksytyt for sana in sanat}
+
+                # Vain hyväksynnät muistetaan: tekoälyvalidoinnin virhe
+                # palauttaa tyhjän joukon, eikä se saa hylätä sanoja
+                # loppuistunnon ajaksi
+                hyvaksynnat, _ = osiomuisti.laske("avainsana", {
+                    sana: OsioMuisti.avain(sana, versio)
+                    for sana in kaikki_avainsanat
+                }, validoi, tallennettava=bool)
+                hyvaksytyt_sanat_setti = {
+                    sana for sana, hyvaksytty in hyvaksynnat.items()
+                    if hyvaksytty
+                }
                 puhdistetut_komennot = {}
                 for osio, avainsanat in hakukomennot.items():
                     puhdistetut_komennot[osio] = [
@@ -196,67 +371,48 @@ def main():
             hakukomennot = puhdistetut_komennot
 
             # Vaihe 2: Jakeiden keräys valitulla tavalla
-            p_bar.progress(0.3, text="Vaihe 2: Kerätään jakeita...")
-            total_sections = len(hakukomennot)
-            for i, (osio_nro, avainsanat) in enumerate(hakukomennot.items()):
-                progress_percent = 0.3 + (i / total_sections) * 0.7
-                teema_match = re.search(
-                    r"^{}\.?\s*(.*)".format(re.escape(osio_nro.strip('.'))),
-                    st.session_state.final_sisallysluettelo, re.MULTILINE
-                )
-                teema = teema_match.group(1).strip() if teema_match else ""
-                p_bar.progress(
-                    progress_percent,
-                    text=f"({i+1}/{total_sections}) Haetaan: {teema}..."
-                )
-                if not teema or not avainsanat:
-                    continue
+            p_bar.progress(0.3, text="Vaihe 2: Haetaan kandidaattijakeita...")
 
-                kandidaatit = etsi_mekaanisesti(
-                    avainsanat, book_data_map, book_name_map
-                )
+            def update_progress(percent, text):
+                p_bar.progress(0.3 + percent / 100.0 * 0.7, text=text)
+
+            sisallysluettelo = st.session_state.final_sisallysluettelo
 
-                if haku_tapa == "Älykäs haku (Suositus)" and kandidaatit:
-                    valinnat, (usage, _, _) = suodata_semanttisesti(
-                        kandidaatit, teema
+            def keraa(osiot):
+                muuttuneet = {osio: hakukomennot[osio] for osio in osiot}
+                if haku_tapa == "Semanttinen haku (paikallinen)":
+                    return keraa_jakeet_vektoreilla(
+                        muuttuneet, sisallysluettelo,
+                        hae_vektori_indeksi(), progress_callback=update_progress
                     )
-                    paivita_token_laskuri(usage)
-                    for valinta in valinnat:
-                        if not isinstance(valinta, dict):
-                            continue
-                        viite_str = valinta.get("viite")
-                        laajenna = valinta.get("laajenna_kontekstia", False)
-                        if not viite_str:
-                            continue
-
-                        jae = hae_jae_viitteella(
-                            viite_str, book_data_map, book_name_map
-                        )
-                        if jae:
-                            osio_kohtaiset_jakeet[osio_nro].add(jae)
-                            if laajenna:
-                                match = re.match(r'^(.*?)\s+(\d+):(\d+)', jae)
-                                if not match:
-                                    continue
-                                b_name, ch, v_num = match.groups()
-                                for j in range(1, 3):
-                                    next_v = hae_jae_viitteella(
-                                        f"{b_name} {ch}:{int(v_num) + j}",
-                                        book_data_map, book_name_map
-                                    )
-                                    if next_v:
-                                        osio_kohtaiset_jakeet[osio_nro].add(
-                                            next_v
-                                        )
-                elif kandidaatit:  # Yksinkertainen haku
-                    osio_kohtaiset_jakeet[osio_nro].update(kandidaatit)
+                return keraa_jakeet(
+                    muuttuneet, sisallysluettelo,
+                    jaevarasto, sanaindeksi,
+                    haku_tapa == "Älykäs haku (Suositus)",
+                    paivita_token_laskuri, progress_callback=update_progress,
+                    laajentaja=laajentaja
+                )
+
+            # Haun tulos riippuu osion teemasta, avainsanoista, hakutavasta
+            # ja korpuksesta; muuttumattomien osioiden jakeet käytetään
+            # edellisestä ajosta
+            osio_kohtaiset_jakeet, haetut = osiomuisti.laske("haku", {
+                osio: OsioMuisti.avain(
+                    hae_osion_teema(sisallysluettelo, osio),
+                    sorted(avainsanat), haku_tapa, versio
+                )
+                for osio, avainsanat in hakukomennot.items()
+            }, keraa, tallennettava=bool)
+            uudelleenkaytetyt = len(hakukomennot) - len(haetut)
+            if uudelleenkaytetyt:
+                st.toast(
+                    f"{uudelleenkaytetyt}/{len(hakukomennot)} osion jakeet "
+                    f"käytettiin edellisestä hausta."
+                )
 
             p_bar.progress(1.0, text="Jakeiden keräys valmis!")
             st.session_state.osio_kohtaiset_jakeet = {
-                k: sorted(
-                    list(v),
-                    key=lambda j: luo_kanoninen_avain(j, book_name_to_id_map)
-                )
+                k: [jaevarasto.muotoile(i) for i in sorted(v)]
                 for k, v in osio_kohtaiset_jakeet.items()
             }
             st.session_state.step = "review_verses"
@@ -271,12 +427,14 @@ def main():
 
         st.text_area(
             "Voit poistaa tai lisätä jakeita manuaalisesti ennen lopullista järjestelyä:",
-            value="\n".join(sorted(
-                list(kaikki_jakeet),
-                key=lambda j: luo_kanoninen_avain(j, book_name_to_id_map))),
+            value="\n".join(
+                sorted(kaikki_jakeet, key=jaevarasto.jarjestysavain)),
             height=400,
             key="final_verses_str"
         )
+        if st.button("← Muokkaa sisällysluetteloa"):
+            st.session_state.step = "review_plan"
+            st.rerun()
         if st.button("Järjestele ja viimeistele →", type="primary"):
             muokatut_jakeet_str = st.session_state.final_verses_str.strip()
             muokatut_jakeet = set(line for line in muokatut_jakeet_str.split('\n') if line.strip())
@@ -303,44 +461,82 @@ def main():
 
         if "jae_kartta" not in st.session_state:
             progress_bar = st.progress(0, "Valmistellaan...")
+            alustavat_paikka = st.empty()
+            valmiit_osiot = st.container()
+            sisallysluettelo = st.session_state.suunnitelma["vahvistettu_sisallysluettelo"]
+            alustavat = {}
+            naytetty = [0.0]
 
             def update_progress(percent, text):
                 progress_bar.progress(percent / 100.0, text=text)
 
-            with st.spinner("Vaihe 4/4: Järjestellään ja pisteytetään jakeita... (Groq)"):
-                jae_kartta = pisteyta_ja_jarjestele(
+            def nayta_alustava(osio_nro, viite, piste):
+                # Alustavat pisteet saapuvat virtana; näkymä päivitetään
+                # korkeintaan kahdesti sekunnissa
+                alustavat[(osio_nro, viite)] = piste
+                if time.monotonic() - naytetty[0] < 0.5:
+                    return
+                naytetty[0] = time.monotonic()
+                relevantteja = sum(1 for p in alustavat.values() if p >= 7)
+                alustavat_paikka.caption(
+                    f"Pisteitä saatu {len(alustavat)} jakeelle, joista "
+                    f"{relevantteja} alustavasti relevantimpia."
+                )
+
+            def nayta_valmis_osio(osio_nro, data):
+                valmiit_osiot.markdown(
+                    muotoile_osio(osio_nro, data, sisallysluettelo)
+                )
+
+            osio_kohtaiset_jakeet = st.session_state.osio_kohtaiset_jakeet
+
+            def pisteyta(osiot):
+                return pisteyta_ja_jarjestele(
                     st.session_state.pääaihe,
-                    st.session_state.suunnitelma["vahvistettu_sisallysluettelo"],
-                    st.session_state.osio_kohtaiset_jakeet,
+                    sisallysluettelo,
+                    {osio: osio_kohtaiset_jakeet[osio] for osio in osiot},
                     paivita_token_laskuri,
-                    progress_callback=update_progress
+                    progress_callback=update_progress,
+                    monta_teemaa=True,
+                    kaskadi_callback=lambda tilastot: st.session_state.update(
+                        kaskadi_tilastot=tilastot
+                    ),
+                    valitulos_callback=nayta_alustava,
+                    osio_valmis_callback=nayta_valmis_osio
                 )
+
+            with st.spinner("Vaihe 4/4: Järjestellään ja pisteytetään jakeita... (Groq)"):
+                # Muuttumattomien osioiden (sama aihe, teema ja jakeet)
+                # jaottelu näytetään heti ja käytetään sellaisenaan
+                jae_kartta, _ = hae_osiomuisti().laske("pisteytys", {
+                    osio: OsioMuisti.avain(
+                        st.session_state.pääaihe,
+                        hae_osion_teema(sisallysluettelo, osio),
+                        sorted(jakeet), jaevarasto.versio, KASKADIPISTEYTYS
+                    )
+                    for osio, jakeet in osio_kohtaiset_jakeet.items()
+                }, pisteyta, valmis_callback=nayta_valmis_osio,
+                    tallennettava=lambda data: any(data.values()))
                 st.session_state.jae_kartta = jae_kartta
                 st.rerun()
 
         jae_kartta = st.session_state.jae_kartta
+        if "kaskadi_tilastot" in st.session_state:
+            tilastot = st.session_state.kaskadi_tilastot
+            st.caption(
+                f"Kaskadipisteytys: {tilastot['eskaloituja']}/"
+                f"{tilastot['jae_osio_pareja']} jakeista "
+                f"({100 * tilastot['eskalaatioaste']:.0f} %) pisteytettiin "
+                f"uudelleen tarkalla mallilla."
+                + (f" Arvioitu aikasäästö {tilastot['saasto_arvio']:.0f} s."
+                   if tilastot['saasto_arvio'] is not None else "")
+            )
         lopputulos = f"# {st.session_state.pääaihe}\n\n"
         sisallysluettelo = st.session_state.suunnitelma["vahvistettu_sisallysluettelo"]
         sorted_osiot = sorted(jae_kartta.items(), key=lambda item: [int(p) for p in item[0].strip('.').split('.')])
 
         for osio_nro, data in sorted_osiot:
-            otsikko_match = re.search(
-                r"^{}\.?\s*(.*)".format(re.escape(osio_nro.strip('.'))),
-                sisallysluettelo, re.MULTILINE)
-            otsikko = otsikko_match.group(1) if otsikko_match else f"Osio {osio_nro}"
-
-            taso = osio_nro.count('.') + 2
-            lopputulos += f"{'#' * taso} {osio_nro} {otsikko}\n\n"
-
-            rel = data.get("relevantimmat", [])
-            v_rel = data.get("vahemman_relevantit", [])
-
-            if not rel and not v_rel:
-                lopputulos += "*Ei löytynyt jakeita tähän osioon.*\n\n"
-            if rel:
-                lopputulos += "**Relevantimmat jakeet:**\n" + "".join(f"- {j}\n" for j in rel) + "\n"
-            if v_rel:
-                lopputulos += "**Vähemmän relevantit jakeet:**\n" + "".join(f"- {j}\n" for j in v_rel) + "\n"
+            lopputulos += muotoile_osio(osio_nro, data, sisallysluettelo)
 
         st.markdown(lopputulos)
 
@@ -357,6 +553,12 @@ def main():
 
         st.download_button(
             "Lataa koko raportti", final_download_str, file_name="tutkimusraportti.txt")
+        if st.button(
+            "← Muokkaa sisällysluetteloa",
+            help="Muuttumattomien osioiden jakeet ja pisteet käytetään uudelleen."
+        ):
+            st.session_state.step = "review_plan"
+            st.rerun()
 
 
 if __name__ == "__main__":
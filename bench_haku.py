@@ -0,0 +1,92 @@
+# bench_haku.py
+"""
+Vertailee mekaanisen haun toteutuksia samalla hakusuunnitelmalla:
+vanha osiokohtainen täyshaku (jokainen avainsana käy Raamatun läpi),
+Aho–Corasick-automaatti (yksi läpikäynti kaikille osioille) ja sanaindeksi.
+Tulokset kirjoitetaan tiedostoon bench_output.txt.
+"""
+import random
+import sys
+import time
+
+from logic import etsi_jae_idt, etsi_mekaanisesti, lataa_raamattu
+from multi_pattern import etsi_osioittain
+
+TULOSTIEDOSTO = "bench_output.txt"
+OSIOITA = 15
+AVAINSANOJA_OSIOTA_KOHDEN = 4
+
+
+def luo_hakukomennot(sanaindeksi, siemen=0):
+    """Arpoo toistettavan hakusuunnitelman korpuksen sanoista."""
+    satunnainen = random.Random(siemen)
+    sanat = [sana for sana in sanaindeksi.sanasto if len(sana) >= 5]
+    return {
+        f"{i}.": satunnainen.sample(sanat, AVAINSANOJA_OSIOTA_KOHDEN)
+        for i in range(1, OSIOITA + 1)
+    }
+
+
+def mittaa(nimi, funktio, rivit):
+    alku = time.perf_counter()
+    tulos = funktio()
+    kesto = time.perf_counter() - alku
+    rivit.append(f"{nimi:<40} {kesto:8.3f} s")
+    return tulos, kesto
+
+
+def main():
+    resurssit = lataa_raamattu()
+    if not resurssit:
+        sys.exit("Raamatun lataus epäonnistui.")
+    _, _, book_name_map, book_data_map, _, _, _, jaevarasto, sanaindeksi = (
+        resurssit
+    )
+    hakukomennot = luo_hakukomennot(sanaindeksi)
+    rivit = [
+        f"Hakusuunnitelma: {OSIOITA} osiota x "
+        f"{AVAINSANOJA_OSIOTA_KOHDEN} avainsanaa, {len(jaevarasto)} jaetta",
+        "",
+    ]
+
+    vanha, vanha_kesto = mittaa(
+        "Osiokohtainen täyshaku (vanha)",
+        lambda: {
+            osio: {jaevarasto.id_viitteesta(j)
+                   for j in etsi_mekaanisesti(sanat, book_data_map,
+                                              book_name_map)}
+            for osio, sanat in hakukomennot.items()
+        },
+        rivit
+    )
+    automaatti, automaatti_kesto = mittaa(
+        "Aho–Corasick, yksi läpikäynti",
+        lambda: etsi_osioittain(hakukomennot, jaevarasto.tekstit),
+        rivit
+    )
+    indeksi, indeksi_kesto = mittaa(
+        "Sanaindeksi",
+        lambda: {
+            osio: etsi_jae_idt(sanat, sanaindeksi)
+            for osio, sanat in hakukomennot.items()
+        },
+        rivit
+    )
+
+    samat = all(
+        vanha[osio] == set(automaatti[osio]) == indeksi[osio]
+        for osio in hakukomennot
+    )
+    rivit += [
+        "",
+        f"Nopeutus (Aho–Corasick / vanha): {vanha_kesto / automaatti_kesto:.1f}x",
+        f"Nopeutus (sanaindeksi / vanha): {vanha_kesto / indeksi_kesto:.1f}x",
+        f"Tulokset identtiset: {'kyllä' if samat else 'EI'}",
+    ]
+    with open(TULOSTIEDOSTO, "w", encoding="utf-8") as f:
+        f.write("\n".join(rivit) + "\n")
+    print("\n".join(rivit))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# bm25.py
+import math
+from array import array
+from collections import Counter
+
+from word_index import tokenisoi
+
+K1 = 1.2
+B = 0.75
+ETULIITE_MINIMI = 4
+
+
+class BM25Ranker:
+    """
+    Paikallinen BM25-järjestäjä jaekorpukselle. IDF lasketaan sanaindeksin
+    postings-listoista ja jakeiden pituudet tokenisoimalla korpus kerran
+    (laiskasti ensimmäisellä käyttökerralla).
+    """
+
+    def __init__(self, sanaindeksi):
+        self.sanaindeksi = sanaindeksi
+        self._pituudet = None
+        self._keskipituus = 1.0
+
+    def _varmista_pituudet(self):
+        if self._pituudet is None:
+            pituudet = array('H')
+            for teksti in self.sanaindeksi.jaevarasto.tekstit:
+                pituudet.append(min(len(tokenisoi(teksti)), 65535))
+            self._keskipituus = (sum(pituudet) / len(pituudet)) or 1.0
+            self._pituudet = pituudet
+
+    def _termit(self, teema, avainsanat):
+        """
+        Muodostaa kyselytermit: avainsanat osamerkkijonoina (kuten
+        mekaanisessa haussa) ja teeman sanat etuliitteinä, jotta
+        taivutusmuodot osuvat samaan termiin. Palauttaa listan sanajoukkoja.
+        """
+        termit, nahdyt = [], set()
+        for sana in avainsanat:
+            for osa in tokenisoi(sana):
+                if osa not in nahdyt:
+                    nahdyt.add(osa)
+                    termit.append(set(self.sanaindeksi.sanat_joissa(osa)))
+        for osa in tokenisoi(teema):
+            if osa in nahdyt:
+                continue
+            nahdyt.add(osa)
+            if len(osa) >= ETULIITE_MINIMI:
+                termit.append(set(self.sanaindeksi.sanat_etuliitteella(osa)))
+            elif osa in self.sanaindeksi.postings:
+                termit.append({osa})
+        return [termi for termi in termit if termi]
+
+    def _idf(self, termi):
+        jakeita = set()
+        for sana in termi:
+            jakeita.update(self.sanaindeksi.postings[sana])
+        n = len(self.sanaindeksi)
+        df = len(jakeita)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def pisteyta(self, teema, avainsanat, jae_idt):
+        """Palauttaa {jae_id: BM25-pisteet} annetuille jakeille."""
+        self._varmista_pituudet()
+        termit = self._termit(teema, avainsanat)
+        idf = [self._idf(termi) for termi in termit]
+        sanan_termit = {}
+        for i, termi in enumerate(termit):
+            for sana in termi:
+                sanan_termit.setdefault(sana, []).append(i)
+
+        tekstit = self.sanaindeksi.jaevarasto.tekstit
+        pisteet = {}
+        for jae_id in jae_idt:
+            tf = Counter()
+            for sana in tokenisoi(tekstit[jae_id]):
+                for i in sanan_termit.get(sana, ()):
+                    tf[i] += 1
+            normi = K1 * (
+                1 - B + B * self._pituudet[jae_id] / self._keskipituus
+            )
+            pisteet[jae_id] = sum(
+                idf[i] * n * (K1 + 1) / (n + normi) for i, n in tf.items()
+            )
+        return pisteet
+
+    def parhaat(self, teema, avainsanat, jae_idt, k):
+        """
+        Palauttaa enintään k parasta (jae_id, pisteet)-paria laskevassa
+        järjestyksessä; tasapisteet ratkaistaan kanonisella järjestyksellä.
+        k=None palauttaa kaikki.
+        """
+        pisteet = self.pisteyta(teema, avainsanat, jae_idt)
+        jarjestys = sorted(pisteet.items(), key=lambda p: (-p[1], p[0]))
+        return jarjestys if k is None else jarjestys[:k]
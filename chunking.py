@@ -0,0 +1,58 @@
+# chunking.py
+import threading
+
+
+def jaa_budjetilla(rivit, budjetti, arvioi_tokenit):
+    """
+    Jakaa rivit peräkkäisiin paloihin niin, että kunkin palan arvioitu
+    token-määrä pysyy budjetissa. Jokaiseen palaan tulee vähintään yksi rivi.
+    """
+    palat, nykyinen, koko = [], [], 0
+    for rivi in rivit:
+        tokenit = arvioi_tokenit(rivi)
+        if nykyinen and koko + tokenit > budjetti:
+            palat.append(nykyinen)
+            nykyinen, koko = [], 0
+        nykyinen.append(rivi)
+        koko += tokenit
+    if nykyinen:
+        palat.append(nykyinen)
+    return palat
+
+
+class AdaptiveChunkBudget:
+    """
+    Itsesäätyvä palakoko (tokeneina), AIMD-periaatteella: nopea onnistunut
+    täysikokoinen pala kasvattaa budjettia vakiomäärällä, hidas pienentää
+    sitä ja virhe puolittaa sen.
+    """
+
+    def __init__(self, alku, minimi, maksimi, tavoiteaika):
+        self._lukko = threading.Lock()
+        self.budjetti = alku
+        self.minimi = minimi
+        self.maksimi = maksimi
+        self.tavoiteaika = tavoiteaika
+        self.onnistumiset = 0
+        self.virheet = 0
+
+    def nykyinen(self):
+        with self._lukko:
+            return int(self.budjetti)
+
+    def kirjaa_onnistuminen(self, kesto, koko):
+        """Kirjaa onnistuneen palan keston (s) ja koon (tokenia)."""
+        with self._lukko:
+            self.onnistumiset += 1
+            if kesto > self.tavoiteaika:
+                self.budjetti = max(self.minimi, self.budjetti * 0.8)
+            elif kesto < self.tavoiteaika / 2 and koko >= 0.8 * self.budjetti:
+                # Vain budjetin kokoinen pala kertoo, että budjetti riittää
+                self.budjetti = min(
+                    self.maksimi, self.budjetti + self.minimi / 2
+                )
+
+    def kirjaa_virhe(self):
+        with self._lukko:
+            self.virheet += 1
+            self.budjetti = max(self.minimi, self.budjetti * 0.5)
@@ -0,0 +1,111 @@
+# corpus_buffer.py
+import bisect
+import re
+
+REGEX_ETULIITE = "re:"
+VT_KIRJAT = (1, 39)
+UT_KIRJAT = (40, 66)
+TESTAMENTIT = {"vt": VT_KIRJAT, "ut": UT_KIRJAT}
+
+
+def on_regex(avainsana):
+    """Onko avainsana säännöllinen lauseke muotoa 're:<lauseke> [@rajaus]'."""
+    return avainsana.startswith(REGEX_ETULIITE)
+
+
+class CorpusBuffer:
+    """
+    Koko korpus yhtenä merkkijonona (jakeet rivinvaihdoin erotettuina) ja
+    jakeiden alkukohdat taulukkona. Lauseke ajetaan kerran koko puskurin
+    yli finditerillä, ja osumat muunnetaan jae-id:iksi bisectillä. Kirja-
+    ja testamenttirajaukset ovat pelkkiä puskurin viipaleita, koska jakeet
+    ovat kanonisessa järjestyksessä.
+    """
+
+    def __init__(self, jaevarasto):
+        self.jaevarasto = jaevarasto
+        self.alut = []
+        kohta = 0
+        for teksti in jaevarasto.tekstit:
+            self.alut.append(kohta)
+            kohta += len(teksti) + 1
+        self.puskuri = "\n".join(jaevarasto.tekstit)
+        # Kirjan ensimmäinen jae-id; kirjan jakeet ovat välillä
+        # [ensimmainen[k], seuraavan kirjan ensimmäinen)
+        self._kirjan_alku = {}
+        for jae_id, kirja in enumerate(jaevarasto.kirjat):
+            self._kirjan_alku.setdefault(kirja, jae_id)
+        self._kirjat = sorted(self._kirjan_alku)
+
+    def _jaevali(self, ensimmainen_kirja, viimeinen_kirja):
+        """Palauttaa kirjavälin jae-id-välin [alku, loppu)."""
+        kirjat = [
+            k for k in self._kirjat
+            if ensimmainen_kirja <= k <= viimeinen_kirja
+        ]
+        if not kirjat:
+            return 0, 0
+        alku = self._kirjan_alku[kirjat[0]]
+        i = self._kirjat.index(kirjat[-1]) + 1
+        loppu = (self._kirjan_alku[self._kirjat[i]]
+                 if i < len(self._kirjat) else len(self.jaevarasto))
+        return alku, loppu
+
+    def rajaus(self, rajaus):
+        """
+        Muuntaa rajauksen ('VT', 'UT', 'Joh', '1. Moos-5. Moos') jae-id-
+        väliksi [alku, loppu). Tuntematon rajaus aiheuttaa ValueErrorin.
+        """
+        avain = rajaus.strip().lower()
+        if avain in TESTAMENTIT:
+            return self._jaevali(*TESTAMENTIT[avain])
+        # Väliviiva (tai ajatusviiva) erottaa aina kirjat, myös kun
+        # jälkimmäinen alkaa numerolla ('1. Kor-2. Kor')
+        osat = [osa.strip() for osa in re.split(r'\s*[-–]\s*', rajaus)]
+        kirja_idt = [self.jaevarasto.kirja_id_nimella(osa) for osa in osat]
+        if len(osat) > 2 or None in kirja_idt:
+            raise ValueError(f"Tuntematon kirjarajaus '{rajaus}'")
+        return self._jaevali(kirja_idt[0], kirja_idt[-1])
+
+    def finditer(self, pattern, alku_id=0, loppu_id=None):
+        """
+        Tuottaa (jae_id, match)-parit annetulla jae-välillä. Lauseke ei voi
+        ylittää jakeen rajaa, jos se ei itse sovita rivinvaihtoa.
+        """
+        if loppu_id is None:
+            loppu_id = len(self.alut)
+        if alku_id >= loppu_id:
+            return
+        alku = self.alut[alku_id]
+        loppu = self.alut[loppu_id] - 1 if loppu_id < len(self.alut) else len(
+            self.puskuri
+        )
+        for match in pattern.finditer(self.puskuri, alku, loppu):
+            yield bisect.bisect_right(self.alut, match.start()) - 1, match
+
+    def hae(self, lauseke, rajaukset=(), flags=re.IGNORECASE):
+        """
+        Palauttaa jakeiden id:t, joissa lauseke osuu. Rajaukset ovat
+        kirja- tai testamenttirajauksia (ks. rajaus); useampi rajaus
+        yhdistetään.
+        """
+        pattern = re.compile(lauseke, flags)
+        valit = [self.rajaus(r) for r in rajaukset] or [(0, len(self.alut))]
+        return {
+            jae_id
+            for alku, loppu in valit
+            for jae_id, _ in self.finditer(pattern, alku, loppu)
+        }
+
+    def hae_avainsanalla(self, avainsana):
+        """
+        Suorittaa avainsanan 're:<lauseke> [@rajaus ...]', esim.
+        're:armo\\w* @UT' tai 're:paimen @Ps @Joh'.
+        """
+        runko = avainsana[len(REGEX_ETULIITE):]
+        osat = runko.split(" @")
+        return self.hae(osat[0].strip(), [r for r in osat[1:] if r.strip()])
+
+    def hae_tekstia(self, teksti):
+        """Kirjaimellinen, kirjainkoosta riippumaton osamerkkijonohaku."""
+        return self.hae(re.escape(teksti))
@@ -0,0 +1,104 @@
+# corpus_cache.py
+import hashlib
+import json
+import os
+
+import requests
+
+OLETUS_VALIMUISTI = os.path.join(
+    os.path.expanduser("~"), ".cache", "raamattu-tutkija"
+)
+LATAUS_AIKAKATKAISU = 30
+
+
+def offline_tila():
+    """Palauttaa True, jos verkkolataukset on kytketty pois ympäristöstä."""
+    return os.environ.get("RAAMATTU_OFFLINE", "").lower() in ("1", "true", "on")
+
+
+def valimuisti_kansio():
+    """Palauttaa levyvälimuistin kansion (RAAMATTU_CACHE_DIR tai oletus)."""
+    return os.environ.get("RAAMATTU_CACHE_DIR", OLETUS_VALIMUISTI)
+
+
+def _valimuisti_polku(url, kansio):
+    tunniste = hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(kansio, f"{tunniste}_{os.path.basename(url)}")
+
+
+def _lue(polku):
+    with open(polku, "rb") as f:
+        return f.read()
+
+
+def _kirjoita_atomisesti(polku, data):
+    valiaikainen = f"{polku}.{os.getpid()}.tmp"
+    with open(valiaikainen, "wb") as f:
+        f.write(data)
+    os.replace(valiaikainen, polku)
+
+
+def hae_json(lahde, kansio=None, offline=None):
+    """Palauttaa lähteen sisällön jäsennettynä JSON-datana."""
+    return json.loads(hae_tiedosto(lahde, kansio, offline))
+
+
+def hae_tiedosto(lahde, kansio=None, offline=None):
+    """
+    Palauttaa tiedoston sisällön tavuina URL-osoitteesta tai paikallisesta
+    tiedostosta.
+
+    URL-lataukset tallennetaan levylle ja validoidaan uudelleen
+    ETag/Last-Modified-otsakkeilla, joten muuttumaton tiedosto ei siirry
+    verkon yli uudestaan. Offline-tilassa luetaan välimuistia tai samannimistä
+    tiedostoa työhakemistosta. Verkkovirheessä käytetään vanhaa kopiota,
+    jos sellainen on.
+    """
+    if not lahde.startswith(("http://", "https://")):
+        return _lue(lahde)
+
+    kansio = kansio or valimuisti_kansio()
+    offline = offline_tila() if offline is None else offline
+    polku = _valimuisti_polku(lahde, kansio)
+    meta_polku = polku + ".meta.json"
+    on_valimuistissa = os.path.exists(polku)
+
+    if offline:
+        if on_valimuistissa:
+            return _lue(polku)
+        return _lue(os.path.basename(lahde))
+
+    otsakkeet = {}
+    if on_valimuistissa and os.path.exists(meta_polku):
+        meta = json.loads(_lue(meta_polku))
+        if meta.get("etag"):
+            otsakkeet["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            otsakkeet["If-Modified-Since"] = meta["last_modified"]
+
+    try:
+        vastaus = requests.get(
+            lahde, headers=otsakkeet, timeout=LATAUS_AIKAKATKAISU
+        )
+        if vastaus.status_code == 304 and on_valimuistissa:
+            print(f"Välimuistin kopio on ajan tasalla: {lahde}")
+            return _lue(polku)
+        vastaus.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        if not on_valimuistissa:
+            raise
+        print(f"VAROITUS: Lataus epäonnistui ({e}), käytetään välimuistia.")
+        return _lue(polku)
+
+    data = vastaus.content
+    try:
+        os.makedirs(kansio, exist_ok=True)
+        _kirjoita_atomisesti(polku, data)
+        _kirjoita_atomisesti(meta_polku, json.dumps({
+            "url": lahde,
+            "etag": vastaus.headers.get("ETag"),
+            "last_modified": vastaus.headers.get("Last-Modified"),
+        }).encode("utf-8"))
+    except OSError as e:
+        print(f"VAROITUS: Välimuistiin tallennus epäonnistui: {e}")
+    return data
@@ -0,0 +1,233 @@
+# corpus_snapshot.py
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections.abc import Mapping
+
+from verse_store import VerseStore
+from word_index import WordIndex
+
+SNAPSHOT_POLKU = os.environ.get("RAAMATTU_SNAPSHOT", "bible.snapshot")
+MAGIC = b"RTSNAP\0\0"
+VERSIO = 1
+_OTSAKE = struct.Struct("<8sII32s")  # magic, versio, osioiden määrä, sha256
+_OSIO = struct.Struct("<16sQQ")      # nimi, alku, pituus
+_TASAUS = 8
+
+
+def lahteen_tarkiste(lahde_bytes):
+    """Palauttaa lähdetiedoston (bible.json) SHA-256-tarkisteen."""
+    return hashlib.sha256(lahde_bytes).digest()
+
+
+def kirjoita_snapshot(polku, lahde_bytes, bible_data, sanakirja):
+    """
+    Kirjoittaa versioidun binäärisen tilannevedoksen: jaetekstit yhtenä
+    tavujonona, offset-taulukko, viitesarakkeet, kirjojen nimet ja
+    lyhenteet, sanakirja sekä sanaindeksi.
+    """
+    if array('I').itemsize != 4:
+        raise RuntimeError("array('I') ei ole 32-bittinen tällä alustalla.")
+    book_data_map = bible_data.get("book", {})
+    book_name_map = {
+        book_id: sisalto.get("info", {}).get("name", f"Kirja {book_id}")
+        for book_id, sisalto in book_data_map.items()
+    }
+    jaevarasto = VerseStore.from_book_data_map(book_data_map, book_name_map)
+    sanaindeksi = WordIndex(jaevarasto)
+
+    tekstit = bytearray()
+    teksti_offsetit = array('I', [0])
+    for teksti in jaevarasto.tekstit:
+        tekstit += teksti.encode("utf-8")
+        teksti_offsetit.append(len(tekstit))
+
+    kirjat = {}
+    for jae_id, kirja_id in enumerate(jaevarasto.kirjat):
+        alku, _ = kirjat.get(kirja_id, (jae_id, jae_id))
+        kirjat[kirja_id] = (alku, jae_id + 1)
+    kirjatiedot = {
+        book_id: {
+            "info": book_data_map[book_id].get("info", {}),
+            "alku": kirjat.get(int(book_id), (0, 0))[0],
+            "loppu": kirjat.get(int(book_id), (0, 0))[1],
+        }
+        for book_id in sorted(book_data_map, key=int)
+    }
+
+    posting_offsetit = array('I', [0])
+    postings = array('I')
+    for sana in sanaindeksi.sanasto:
+        postings.extend(sanaindeksi.postings[sana])
+        posting_offsetit.append(len(postings))
+
+    osiot = [
+        ("tekstit", bytes(tekstit)),
+        ("teksti_off", teksti_offsetit.tobytes()),
+        ("kirjat", jaevarasto.kirjat.tobytes()),
+        ("luvut", jaevarasto.luvut.tobytes()),
+        ("jakeet", jaevarasto.jakeet.tobytes()),
+        ("kirjatiedot", json.dumps(
+            kirjatiedot, ensure_ascii=False).encode("utf-8")),
+        ("sanakirja", "\n".join(sorted(sanakirja)).encode("utf-8")),
+        ("sanasto", "\n".join(sanaindeksi.sanasto).encode("utf-8")),
+        ("posting_off", posting_offsetit.tobytes()),
+        ("postings", postings.tobytes()),
+    ]
+
+    alku = _OTSAKE.size + _OSIO.size * len(osiot)
+    taulu, sijainnit = [], []
+    for nimi, data in osiot:
+        alku += -alku % _TASAUS
+        sijainnit.append(alku)
+        taulu.append(_OSIO.pack(nimi.encode("ascii"), alku, len(data)))
+        alku += len(data)
+
+    valiaikainen = f"{polku}.{os.getpid()}.tmp"
+    with open(valiaikainen, "wb") as f:
+        f.write(_OTSAKE.pack(
+            MAGIC, VERSIO, len(osiot), lahteen_tarkiste(lahde_bytes)
+        ))
+        f.write(b"".join(taulu))
+        for (_, data), sijainti in zip(osiot, sijainnit):
+            f.write(b"\0" * (sijainti - f.tell()))
+            f.write(data)
+    os.replace(valiaikainen, polku)
+    return jaevarasto, sanaindeksi
+
+
+class _TekstiLista:
+    """Jaetekstit luettuna suoraan muistiin kartoitetusta tavujonosta."""
+
+    def __init__(self, blob, offsetit):
+        self._blob = blob
+        self._offsetit = offsetit
+
+    def __len__(self):
+        return len(self._offsetit) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        return str(
+            self._blob[self._offsetit[i]:self._offsetit[i + 1]], "utf-8"
+        )
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class _PostingKartta(Mapping):
+    """Sana -> jae-id:t, viipaleina kartoitetusta postings-taulukosta."""
+
+    def __init__(self, sanasto, offsetit, postings):
+        self._sanasto = sanasto
+        self._sijainti = {sana: i for i, sana in enumerate(sanasto)}
+        self._offsetit = offsetit
+        self._postings = postings
+
+    def __getitem__(self, sana):
+        i = self._sijainti[sana]
+        return self._postings[self._offsetit[i]:self._offsetit[i + 1]]
+
+    def __iter__(self):
+        return iter(self._sanasto)
+
+    def __len__(self):
+        return len(self._sanasto)
+
+    def __contains__(self, sana):
+        return sana in self._sijainti
+
+
+class _KirjaData(Mapping):
+    """
+    Yhden kirjan sisältö bible.json-muodossa. Luvut ja jakeet
+    muodostetaan vasta, kun niitä ensimmäisen kerran pyydetään.
+    """
+
+    def __init__(self, jaevarasto, info, alku, loppu):
+        self._jaevarasto = jaevarasto
+        self._info = info
+        self._alku, self._loppu = alku, loppu
+        self._luvut = None
+
+    def __getitem__(self, avain):
+        if avain == "info":
+            return self._info
+        if avain == "chapter":
+            if self._luvut is None:
+                luvut = {}
+                varasto = self._jaevarasto
+                for i in range(self._alku, self._loppu):
+                    luku = luvut.setdefault(
+                        str(varasto.luvut[i]), {"verse": {}}
+                    )
+                    luku["verse"][str(varasto.jakeet[i])] = {
+                        "text": varasto.tekstit[i]
+                    }
+                self._luvut = luvut
+            return self._luvut
+        raise KeyError(avain)
+
+    def __iter__(self):
+        return iter(("info", "chapter"))
+
+    def __len__(self):
+        return 2
+
+
+def avaa_snapshot(polku, lahde_bytes=None):
+    """
+    Avaa tilannevedoksen mmap-kartoituksella ilman jäsentämistä.
+    Palauttaa (bible_data, sanakirja, jaevarasto, sanaindeksi) tai None,
+    jos tiedosto puuttuu, on eri versiota tai lähde on muuttunut.
+    """
+    if not os.path.exists(polku) or sys.byteorder != "little":
+        return None
+    with open(polku, "rb") as f:
+        kartta = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, versio, osioita, tarkiste = _OTSAKE.unpack_from(kartta, 0)
+    if magic != MAGIC or versio != VERSIO:
+        print(f"VAROITUS: Tilannevedos {polku} on tuntematonta versiota.")
+        return None
+    if lahde_bytes is not None and tarkiste != lahteen_tarkiste(lahde_bytes):
+        print(f"VAROITUS: Tilannevedos {polku} on vanhentunut, ohitetaan.")
+        return None
+
+    nakyma = memoryview(kartta)
+    osiot = {}
+    for i in range(osioita):
+        nimi, alku, pituus = _OSIO.unpack_from(
+            kartta, _OTSAKE.size + i * _OSIO.size
+        )
+        osiot[nimi.rstrip(b"\0").decode("ascii")] = nakyma[alku:alku + pituus]
+
+    kirjatiedot = json.loads(bytes(osiot["kirjatiedot"]))
+    jaevarasto = VerseStore(
+        _TekstiLista(osiot["tekstit"], osiot["teksti_off"].cast('I')),
+        osiot["kirjat"].cast('H'),
+        osiot["luvut"].cast('H'),
+        osiot["jakeet"].cast('H'),
+        {
+            int(book_id): tiedot["info"].get("name", f"Kirja {book_id}")
+            for book_id, tiedot in kirjatiedot.items()
+        },
+    )
+    sanasto = str(osiot["sanasto"], "utf-8").split("\n")
+    sanaindeksi = WordIndex(jaevarasto, _PostingKartta(
+        sanasto, osiot["posting_off"].cast('I'), osiot["postings"].cast('I')
+    ))
+    bible_data = {"book": {
+        book_id: _KirjaData(
+            jaevarasto, tiedot["info"], tiedot["alku"], tiedot["loppu"]
+        )
+        for book_id, tiedot in kirjatiedot.items()
+    }}
+    sanakirja = set(str(osiot["sanakirja"], "utf-8").split("\n"))
+    return bible_data, sanakirja, jaevarasto, sanaindeksi
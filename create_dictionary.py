@@ -1,17 +1,25 @@
 # create_dictionary.py
 import json
-import re
+from collections import Counter
+
+from corpus_snapshot import SNAPSHOT_POLKU, kirjoita_snapshot
+from query_planner import SANATILASTOT_POLKU
+from word_index import tokenisoi
 
 print("Aloitetaan Raamattu-sanakirjan luominen...")
 
 try:
-    with open("bible.json", "r", encoding="utf-8") as f:
-        bible_data = json.load(f)
+    with open("bible.json", "rb") as f:
+        bible_bytes = f.read()
+    bible_data = json.loads(bible_bytes)
 except FileNotFoundError:
     print("VIRHE: bible.json-tiedostoa ei löytynyt. Aja tämä skripti samassa kansiossa.")
     exit()
 
 all_words = set()
+jakeiden_maara = Counter()  # sana -> montako jaetta sisältää sanan
+esiintymat = Counter()      # sana -> esiintymiä yhteensä
+jakeita = 0
 
 # Käydään läpi koko Raamattu ja kerätään uniikit sanat
 for book_id in bible_data.get("book", {}):
@@ -21,8 +29,11 @@ for book_id in bible_data.get("book", {}):
         for jae_nro in luku_data.get("verse", {}):
             jae_teksti = luku_data["verse"][jae_nro].get("text", "")
             # Puhdistetaan ja lisätään sanat set-rakenteeseen
-            words = re.findall(r'\b\w+\b', jae_teksti.lower())
+            words = tokenisoi(jae_teksti)
             all_words.update(words)
+            jakeiden_maara.update(set(words))
+            esiintymat.update(words)
+            jakeita += 1
 
 # Tallennetaan sanat JSON-tiedostoon
 try:
@@ -32,4 +43,25 @@ try:
     print(f"Valmis! Sanakirja luotu onnistuneesti tiedostoon 'bible_dictionary.json'.")
     print(f"Löytyi {len(all_words)} uniikkia sanaa.")
 except Exception as e:
-    print(f"VIRHE tiedoston tallennuksessa: {e}")
\ No newline at end of file
+    print(f"VIRHE tiedoston tallennuksessa: {e}")
+
+# Sanatilastot hakusuunnittelijaa varten (ks. query_planner.py)
+try:
+    with open(SANATILASTOT_POLKU, "w", encoding="utf-8") as f:
+        json.dump({
+            "jakeita": jakeita,
+            "sanat": {
+                sana: [jakeiden_maara[sana], esiintymat[sana]]
+                for sana in sorted(all_words)
+            },
+        }, f, ensure_ascii=False)
+    print(f"Sanatilastot kirjoitettu tiedostoon '{SANATILASTOT_POLKU}'.")
+except Exception as e:
+    print(f"VIRHE sanatilastojen tallennuksessa: {e}")
+
+# Rakennetaan binäärinen tilannevedos nopeaa, jäsentämätöntä latausta varten
+try:
+    kirjoita_snapshot(SNAPSHOT_POLKU, bible_bytes, bible_data, all_words)
+    print(f"Tilannevedos kirjoitettu tiedostoon '{SNAPSHOT_POLKU}'.")
+except Exception as e:
+    print(f"VIRHE tilannevedoksen tallennuksessa: {e}")
@@ -0,0 +1,138 @@
+# fuzzy_match.py
+OLETUS_ETAISYYS = 2
+ETULIITTEEN_PITUUS = 8
+# Lyhyillä sanoilla kahden muokkauksen päästä löytyy jo eri sanoja
+# (kutsumus -> katumus), joten niille sallitaan vain yksi muokkaus.
+LYHYT_SANA = 8
+ERITTAIN_LYHYT_SANA = 3
+
+
+def etaisyysraja(sana):
+    """Sanan pituuteen suhteutettu suurin sallittu editointietäisyys."""
+    if len(sana) <= ERITTAIN_LYHYT_SANA:
+        return 0
+    if len(sana) <= LYHYT_SANA:
+        return 1
+    return OLETUS_ETAISYYS
+
+
+def _poistot(sana, max_etaisyys):
+    """Palauttaa sanan kaikki enintään max_etaisyys merkin poistot."""
+    tulos = {sana}
+    taso = {sana}
+    for _ in range(max_etaisyys):
+        seuraava = set()
+        for muoto in taso:
+            if len(muoto) > 1:
+                for i in range(len(muoto)):
+                    seuraava.add(muoto[:i] + muoto[i + 1:])
+        seuraava -= tulos
+        tulos |= seuraava
+        taso = seuraava
+    return tulos
+
+
+def editointietaisyys(a, b, raja):
+    """
+    Damerau-Levenshtein-etäisyys (vierekkäisten merkkien vaihto yhtenä
+    muokkauksena). Palauttaa raja + 1, jos etäisyys ylittää rajan.
+    """
+    if abs(len(a) - len(b)) > raja:
+        return raja + 1
+    # Yhteinen alku ja loppu eivät vaikuta etäisyyteen
+    alku = 0
+    while alku < len(a) and alku < len(b) and a[alku] == b[alku]:
+        alku += 1
+    a, b = a[alku:], b[alku:]
+    while a and b and a[-1] == b[-1]:
+        a, b = a[:-1], b[:-1]
+    if not a or not b:
+        return len(a) + len(b)
+    # Lasketaan vain lävistäjän ympäriltä raja-levyinen kaista
+    yli = raja + 1
+    edellinen2 = None
+    edellinen = [j if j <= raja else yli for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        nykyinen = [yli] * (len(b) + 1)
+        if i <= raja:
+            nykyinen[0] = i
+        for j in range(max(1, i - raja), min(len(b), i + raja) + 1):
+            hinta = 0 if a[i - 1] == b[j - 1] else 1
+            arvo = min(
+                edellinen[j] + 1, nykyinen[j - 1] + 1, edellinen[j - 1] + hinta
+            )
+            if (i > 1 and j > 1 and a[i - 1] == b[j - 2]
+                    and a[i - 2] == b[j - 1]):
+                arvo = min(arvo, edellinen2[j - 2] + 1)
+            nykyinen[j] = arvo
+        if min(nykyinen) > raja:
+            return yli
+        edellinen2, edellinen = edellinen, nykyinen
+    return min(edellinen[-1], yli)
+
+
+class SymSpell:
+    """
+    SymSpell-tyylinen sumea haku: jokaisen sanakirjan sanan etuliitteen
+    poistomuodot indeksoidaan etukäteen, jolloin haku vaatii vain hakusanan
+    omien poistojen hakemisen ja ehdokkaiden tarkan etäisyyden laskemisen.
+    """
+
+    def __init__(self, sanat, max_etaisyys=OLETUS_ETAISYYS, frekvenssi=None):
+        self.max_etaisyys = max_etaisyys
+        self.sanat = set(sanat)
+        self._frekvenssi = frekvenssi or (lambda sana: 0)
+        self._poistot = {}
+        # Avaimena (poistomuoto, sanan pituus), jotta haku rajautuu suoraan
+        # sopivan mittaisiin ehdokkaisiin
+        for sana in self.sanat:
+            for poisto in _poistot(sana[:ETULIITTEEN_PITUUS], max_etaisyys):
+                avain = (poisto, len(sana))
+                lista = self._poistot.get(avain)
+                if lista is None:
+                    self._poistot[avain] = sana
+                elif isinstance(lista, str):
+                    self._poistot[avain] = [lista, sana]
+                else:
+                    lista.append(sana)
+
+    def hae(self, sana, max_etaisyys=None):
+        """
+        Palauttaa lähimmät sanakirjan sanat listana (sana, etäisyys)
+        järjestettynä etäisyyden ja yleisyyden mukaan.
+        """
+        raja = self.max_etaisyys if max_etaisyys is None else min(
+            max_etaisyys, self.max_etaisyys
+        )
+        sana = sana.lower()
+        if sana in self.sanat:
+            return [(sana, 0)]
+        ehdokkaat = set()
+        pituudet = range(max(1, len(sana) - raja), len(sana) + raja + 1)
+        for poisto in _poistot(sana[:ETULIITTEEN_PITUUS], raja):
+            for pituus in pituudet:
+                osuma = self._poistot.get((poisto, pituus))
+                if osuma is None:
+                    continue
+                if isinstance(osuma, str):
+                    ehdokkaat.add(osuma)
+                else:
+                    ehdokkaat.update(osuma)
+        tulos = []
+        for ehdokas in ehdokkaat:
+            etaisyys = editointietaisyys(sana, ehdokas, raja)
+            if etaisyys <= raja:
+                tulos.append((ehdokas, etaisyys))
+        tulos.sort(key=lambda p: (p[1], -self._frekvenssi(p[0]), p[0]))
+        return tulos
+
+    def korjaa(self, sana, maara=3, max_etaisyys=None):
+        """
+        Palauttaa enintään `maara` lähintä sanaa pienimmällä löytyneellä
+        etäisyydellä, tai tyhjän listan, jos mitään ei löydy.
+        """
+        osumat = self.hae(sana, max_etaisyys)
+        if not osumat:
+            return []
+        paras = osumat[0][1]
+        return [(s, e) for s, e in osumat if e == paras][:maara]
@@ -0,0 +1,83 @@
+# json_stream.py
+import json
+
+
+class IncrementalJSONParser:
+    """
+    Jäsentää virtana saapuvaa JSON-vastausta ja palauttaa ylimmän tason
+    objektin jäsenet (avain, arvo) tai listan alkiot (indeksi, arvo) heti,
+    kun ne ovat kokonaisia. Ensimmäistä '{'- tai '['-merkkiä edeltävä
+    teksti (esim. ```json-aita) ohitetaan.
+    """
+
+    def __init__(self):
+        self.nollaa()
+
+    def nollaa(self):
+        self._puskuri = ""
+        self._kohta = 0
+        self._syvyys = 0
+        self._merkkijonossa = False
+        self._pako = False
+        self._juuri = None
+        self._alkio_alkaa = None
+        self._indeksi = 0
+
+    def syota(self, teksti):
+        """
+        Lisää tekstin ja palauttaa listan valmistuneista pareista.
+        teksti=None nollaa jäsentimen (vastaus alkaa alusta).
+        """
+        if teksti is None:
+            self.nollaa()
+            return []
+        self._puskuri += teksti
+        valmiit = []
+        puskuri = self._puskuri
+        for kohta in range(self._kohta, len(puskuri)):
+            merkki = puskuri[kohta]
+            if self._merkkijonossa:
+                if self._pako:
+                    self._pako = False
+                elif merkki == "\\":
+                    self._pako = True
+                elif merkki == '"':
+                    self._merkkijonossa = False
+                continue
+            if self._juuri is not None and self._syvyys == 0:
+                break  # juuri on jo suljettu
+            if self._juuri is None:
+                if merkki in "{[":
+                    self._juuri = merkki
+                    self._syvyys = 1
+                    self._alkio_alkaa = kohta + 1
+                continue
+            if merkki == '"':
+                self._merkkijonossa = True
+            elif merkki in "{[":
+                self._syvyys += 1
+            elif merkki in "}]":
+                self._syvyys -= 1
+                if self._syvyys == 0:
+                    valmiit.extend(self._alkio(kohta))
+                    self._alkio_alkaa = None
+            elif merkki == "," and self._syvyys == 1:
+                valmiit.extend(self._alkio(kohta))
+                self._alkio_alkaa = kohta + 1
+        self._kohta = len(puskuri)
+        return valmiit
+
+    def _alkio(self, loppu):
+        if self._alkio_alkaa is None:
+            return []
+        osa = self._puskuri[self._alkio_alkaa:loppu].strip()
+        if not osa:
+            return []
+        try:
+            if self._juuri == "{":
+                return list(json.loads("{" + osa + "}").items())
+            arvo = json.loads(osa)
+        except json.JSONDecodeError:
+            return []
+        self._indeksi += 1
+        return [(self._indeksi - 1, arvo)]
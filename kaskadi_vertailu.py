@@ -0,0 +1,179 @@
+# kaskadi_vertailu.py
+"""
+Kaskadipisteytyksen yhtäpitävyystarkistus tallennetuilla mallivastauksilla.
+
+Tallennus (vaatii API-avaimet):
+    python kaskadi_vertailu.py --tallenna pisteytys_syote.json
+ajaa pisteytyksen sekä pelkällä POWERFUL_MODELilla että kaskadina ja
+kirjoittaa syötteen ja kaikki mallivastaukset tiedostoon
+kaskadi_tallenne.json. Syötetiedoston kirjoittaa run_full_diagnostics.py.
+
+Toisto (ilman verkkoa):
+    python kaskadi_vertailu.py [--tallenne tests/fixtures/kaskadi_tallenne.json]
+toistaa molemmat ajot tallenteesta ja vertaa jakeiden lopullisia luokkia
+(relevantimmat / vahemman_relevantit / ei mukana). Paluuarvo on 1, jos
+yhtäpitävyys jää alle rajan.
+
+Kaskadi on oletuksena pois päältä (logic.KASKADIPISTEYTYS); ota se
+käyttöön RAAMATTU_KASKADI=1:llä vasta, kun tämä tarkistus on läpäisty.
+"""
+import argparse
+import json
+import os
+import sys
+from collections import Counter
+
+import google.generativeai as genai
+from dotenv import load_dotenv
+
+import logic
+from llm_cache import LLMCache
+from llm_providers import LLMVirhe
+
+TALLENNE = "kaskadi_tallenne.json"
+VAHIMMAISYHTAPITAVYYS = 0.9
+LUOKAT = ("relevantimmat", "vahemman_relevantit")
+
+
+class Tallentaja:
+    """Välittää kutsut oikealle tarjoajalle ja tallentaa vastaukset."""
+
+    def __init__(self, tarjoaja, vastaukset):
+        self.tarjoaja = tarjoaja
+        self.rajoitettu = tarjoaja.rajoitettu
+        self.vastaukset = vastaukset
+
+    def generoi(self, prompt, model_name, is_json, temperature):
+        teksti, kaytto = self.tarjoaja.generoi(
+            prompt, model_name, is_json, temperature
+        )
+        avain = LLMCache.avain(model_name, prompt, temperature, is_json)
+        self.vastaukset[avain] = teksti
+        return teksti, kaytto
+
+
+class Toistaja:
+    """Palauttaa tallennetut vastaukset; puuttuva vastaus on virhe."""
+
+    rajoitettu = False
+
+    def __init__(self, vastaukset):
+        self.vastaukset = vastaukset
+        self.puuttuvat = 0
+
+    def generoi(self, prompt, model_name, is_json, temperature):
+        avain = LLMCache.avain(model_name, prompt, temperature, is_json)
+        if avain not in self.vastaukset:
+            self.puuttuvat += 1
+            raise LLMVirhe(f"Ei tallennettua vastausta ({model_name})")
+        return self.vastaukset[avain], None
+
+
+def luokittele(jae_kartta, osio_kohtaiset_jakeet):
+    """Palauttaa {(osio, jae): luokka} kaikille pisteytetyille pareille."""
+    luokat = {}
+    for osio_nro, jakeet in osio_kohtaiset_jakeet.items():
+        data = jae_kartta.get(osio_nro, {})
+        for jae in jakeet:
+            luokat[(osio_nro, jae)] = next(
+                (luokka for luokka in LUOKAT if jae in data.get(luokka, [])),
+                "ei mukana"
+            )
+    return luokat
+
+
+def aja(syote, kaskadi):
+    tilastot = {}
+    jae_kartta = logic.pisteyta_ja_jarjestele(
+        syote["aihe"], syote["sisallysluettelo"],
+        syote["osio_kohtaiset_jakeet"], lambda usage: None,
+        monta_teemaa=True, kaskadi=kaskadi, kaskadi_callback=tilastot.update
+    )
+    return jae_kartta, tilastot
+
+
+def vertaa(syote, tarkka, kaskadi, tilastot):
+    osio_kohtaiset_jakeet = syote["osio_kohtaiset_jakeet"]
+    tarkat = luokittele(tarkka, osio_kohtaiset_jakeet)
+    kaskadin = luokittele(kaskadi, osio_kohtaiset_jakeet)
+    parit = Counter((tarkat[p], kaskadin[p]) for p in tarkat)
+    samat = sum(maara for (a, b), maara in parit.items() if a == b)
+    yhtapitavyys = samat / len(tarkat) if tarkat else 1.0
+    relevantit = [
+        {p for p, luokka in luokat.items() if luokka == LUOKAT[0]}
+        for luokat in (tarkat, kaskadin)
+    ]
+    yhdiste = relevantit[0] | relevantit[1]
+    jaccard = (len(relevantit[0] & relevantit[1]) / len(yhdiste)
+               if yhdiste else 1.0)
+
+    print(f"Jae-osio-pareja: {len(tarkat)}")
+    if tilastot:
+        print(
+            f"Eskaloitu: {tilastot['eskaloituja']} "
+            f"({100 * tilastot['eskalaatioaste']:.1f} %)"
+        )
+    print(f"Luokkien yhtäpitävyys: {100 * yhtapitavyys:.1f} %")
+    print(f"Relevantimmat, Jaccard: {jaccard:.3f}")
+    print("Ristiintaulukko (vain POWERFUL_MODEL -> kaskadi):")
+    for (a, b), maara in sorted(parit.items()):
+        print(f"  {a:<20} -> {b:<20} {maara}")
+    return yhtapitavyys
+
+
+def main():
+    jasennin = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    jasennin.add_argument(
+        "--tallenna", metavar="SYOTE",
+        help="aja mallit verkossa ja tallenna vastaukset syötteelle"
+    )
+    jasennin.add_argument("--tallenne", default=TALLENNE)
+    jasennin.add_argument(
+        "--raja", type=float, default=VAHIMMAISYHTAPITAVYYS,
+        help="vähimmäisyhtäpitävyys (0-1)"
+    )
+    argumentit = jasennin.parse_args()
+    # Vastausten on tultava tarjoajalta, ei välimuistista
+    logic.llm_valimuisti = None
+
+    if argumentit.tallenna:
+        load_dotenv()
+        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+        with open(argumentit.tallenna, "r", encoding="utf-8") as f:
+            syote = json.load(f)
+        vastaukset = {}
+        for malli in (logic.FAST_MODEL, logic.POWERFUL_MODEL):
+            logic.llm_tarjoajat.aseta(
+                Tallentaja(logic.hae_tarjoaja(malli), vastaukset), malli
+            )
+    else:
+        try:
+            with open(argumentit.tallenne, "r", encoding="utf-8") as f:
+                tallenne = json.load(f)
+        except FileNotFoundError:
+            sys.exit(
+                f"Tallennetta {argumentit.tallenne} ei löydy; aja ensin "
+                f"--tallenna tai käytä testitallennetta --tallenne "
+                f"tests/fixtures/kaskadi_tallenne.json."
+            )
+        syote, vastaukset = tallenne["syote"], tallenne["vastaukset"]
+        toistaja = Toistaja(vastaukset)
+        logic.llm_tarjoajat.aseta(toistaja)
+
+    tarkka, _ = aja(syote, kaskadi=False)
+    kaskadi, tilastot = aja(syote, kaskadi=True)
+
+    if argumentit.tallenna:
+        with open(argumentit.tallenne, "w", encoding="utf-8") as f:
+            json.dump({"syote": syote, "vastaukset": vastaukset}, f,
+                      ensure_ascii=False)
+        print(f"Tallennettu {len(vastaukset)} vastausta: {argumentit.tallenne}")
+    elif toistaja.puuttuvat:
+        print(f"VAROITUS: {toistaja.puuttuvat} vastausta puuttui tallenteesta.")
+
+    if vertaa(syote, tarkka, kaskadi, tilastot) < argumentit.raja:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
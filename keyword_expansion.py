@@ -0,0 +1,54 @@
+# keyword_expansion.py
+import bisect
+
+from keyword_validator import VARTALON_MINIMI, vartaloehdokkaat
+
+
+class PrefixExpander:
+    """
+    Etuliiteindeksi Raamattu-sanakirjan (bible_dictionary.json) sanoille
+    järjestettynä taulukkona. Laajentaa hakusanan vartalot kaikiksi
+    KR33/38:ssa esiintyviksi taivutusmuodoiksi. Frekvenssit (jakeiden
+    määrä) luetaan sanaindeksin postings-listoista.
+    """
+
+    def __init__(self, sanakirja, sanaindeksi):
+        self._sanasto = sorted(sanakirja)
+        self.sanaindeksi = sanaindeksi
+        self._valimuisti = {}
+
+    def muodot_etuliitteella(self, etuliite):
+        """Palauttaa sanakirjan sanat, jotka alkavat etuliitteellä."""
+        alku = bisect.bisect_left(self._sanasto, etuliite)
+        loppu = bisect.bisect_left(self._sanasto, etuliite + "\uffff")
+        return self._sanasto[alku:loppu]
+
+    def frekvenssi(self, muoto):
+        """Montako jaetta sisältää muodon sellaisenaan."""
+        postings = self.sanaindeksi.postings
+        return len(postings[muoto]) if muoto in postings else 0
+
+    def laajenna(self, avainsana):
+        """
+        Palauttaa avainsanan taivutusmuodot listana (muoto, frekvenssi)
+        yleisimmästä harvinaisimpaan. Moniosaisia termejä ei laajenneta.
+        """
+        sana = avainsana.lower().strip()
+        if not sana or " " in sana:
+            return []
+        if sana not in self._valimuisti:
+            muodot = set()
+            for vartalo in [sana] + vartaloehdokkaat(sana):
+                if vartalo == sana or len(vartalo) >= VARTALON_MINIMI:
+                    muodot.update(self.muodot_etuliitteella(vartalo))
+            tulos = [(muoto, self.frekvenssi(muoto)) for muoto in muodot]
+            tulos.sort(key=lambda p: (-p[1], p[0]))
+            self._valimuisti[sana] = tulos
+        return self._valimuisti[sana]
+
+    def laajenna_hakukomennot(self, hakukomennot):
+        """Palauttaa {osio: {avainsana: [(muoto, frekvenssi), ...]}}."""
+        return {
+            osio: {sana: self.laajenna(sana) for sana in avainsanat}
+            for osio, avainsanat in hakukomennot.items()
+        }
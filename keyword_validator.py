@@ -0,0 +1,141 @@
+# keyword_validator.py
+import bisect
+
+# Liitepartikkelit, omistusliitteet ja sijapäätteet pisimmästä lyhimpään.
+# Päätteet riisutaan tässä järjestyksessä: sana-kin -> sana-ni -> sana-ssa.
+LIITEPARTIKKELIT = ("kaan", "kään", "kin", "han", "hän")
+OMISTUSLIITTEET = ("mme", "nne", "nsa", "nsä", "ni", "si")
+SIJAPAATTEET = tuple(sorted((
+    "itten", "iden", "ineen", "ihin", "seen", "ien", "jen", "iin",
+    "ssa", "ssä", "sta", "stä", "lla", "llä", "lta", "ltä", "lle",
+    "ksi", "tta", "ttä", "ita", "itä", "ine", "han", "hen", "hin",
+    "hon", "hun", "hyn", "hän", "hön", "na", "nä", "ja", "jä", "in",
+    "n", "a", "ä", "t",
+), key=len, reverse=True))
+# Vartalovaihtelut, joita pelkkä päätteen poisto ei tavoita
+# (rakkaus -> rakkaude-, ihminen -> ihmise-, kaunis -> kaunii-,
+# eksytys -> eksytykse-).
+VARTALOVAIHTELUT = (
+    ("uus", "uude"), ("yys", "yyde"), ("us", "ude"), ("ys", "yde"),
+    ("us", "ut"), ("ys", "yt"), ("nen", "se"), ("is", "ii"), ("s", "kse"),
+)
+VARTALON_MINIMI = 4
+YHDYSSANAN_OSAN_MINIMI = 3
+
+
+def _riisu(sana, paatteet):
+    """Palauttaa sanan ja kaikki sen päätteettömät muodot."""
+    muodot = [sana]
+    for paate in paatteet:
+        if sana.endswith(paate) and len(sana) - len(paate) >= VARTALON_MINIMI:
+            muodot.append(sana[:-len(paate)])
+    return muodot
+
+
+def vartaloehdokkaat(sana):
+    """
+    Tuottaa sanalle mahdolliset vartalot riisumalla liitepartikkelin,
+    omistusliitteen ja sijapäätteen sekä tavallisimmat vartalovaihtelut.
+    """
+    ehdokkaat = []
+    for ilman_liitetta in _riisu(sana, LIITEPARTIKKELIT):
+        for ilman_omistusta in _riisu(ilman_liitetta, OMISTUSLIITTEET):
+            ehdokkaat.extend(_riisu(ilman_omistusta, SIJAPAATTEET))
+    for loppu, vartalo in VARTALOVAIHTELUT:
+        if sana.endswith(loppu):
+            ehdokkaat.append(sana[:-len(loppu)] + vartalo)
+    nahdyt = set()
+    return [v for v in ehdokkaat if not (v in nahdyt or nahdyt.add(v))]
+
+
+class KeywordValidator:
+    """
+    Paikallinen avainsanojen tarkistin Raamattu-sanakirjaa
+    (bible_dictionary.json) vasten. Sanakirja sisältää kaikki korpuksen
+    sanamuodot, joten sana hyväksytään, jos se tai jokin sen vartaloista
+    esiintyy KR33/38:ssa. Yhdyssanat pilkotaan osiin.
+    """
+
+    def __init__(self, sanakirja):
+        self.sanakirja = set(sanakirja)
+        self._sanasto = sorted(self.sanakirja)
+
+    def _on_etuliite(self, vartalo):
+        i = bisect.bisect_left(self._sanasto, vartalo)
+        return i < len(self._sanasto) and self._sanasto[i].startswith(vartalo)
+
+    def _tunnettu(self, sana):
+        if sana in self.sanakirja:
+            return True
+        return any(
+            len(v) >= VARTALON_MINIMI and self._on_etuliite(v)
+            for v in vartaloehdokkaat(sana)
+        )
+
+    def _yhdyssana(self, sana):
+        """
+        Etsii jakoa alkuosa + loppuosa, jossa alkuosa on sanakirjan sana tai
+        vartalo ja loppuosa tunnettu (tai itse tunnettu yhdyssana). Palauttaa
+        True (molemmat osat tunnetaan), None (vain toinen) tai False.
+        """
+        osittainen = False
+        for i in range(
+            YHDYSSANAN_OSAN_MINIMI, len(sana) - YHDYSSANAN_OSAN_MINIMI + 1
+        ):
+            alku, loppu = sana[:i], sana[i:]
+            alku_ok = alku in self.sanakirja or (
+                len(alku) >= VARTALON_MINIMI and self._on_etuliite(alku)
+            )
+            if not alku_ok:
+                continue
+            if self._tunnettu(loppu) or (
+                len(loppu) >= 2 * YHDYSSANAN_OSAN_MINIMI
+                and self._yhdyssana(loppu) is True
+            ):
+                return True
+            osittainen = osittainen or len(loppu) >= VARTALON_MINIMI
+        return None if osittainen else False
+
+    def tarkista_sana(self, sana):
+        """
+        Palauttaa True (raamatullinen), False (tyhjä) tai None (paikallinen
+        tarkistus ei osaa päättää). Sanakirjasta löytymätöntä sanaa ei
+        hylätä, koska vartalovaihtelu voi jäädä tunnistamatta; sen
+        ratkaisee tekoäly.
+        """
+        sana = sana.lower().strip()
+        if not sana:
+            return False
+        if self._tunnettu(sana):
+            return True
+        if (len(sana) >= 2 * YHDYSSANAN_OSAN_MINIMI
+                and self._yhdyssana(sana) is True):
+            return True
+        return None
+
+    def tarkista(self, avainsana):
+        """
+        Tarkistaa avainsanan. Moniosainen termi ('terve oppi') hyväksytään,
+        jos kaikki osat tunnetaan, ja muuten se jää tekoälyn ratkaistavaksi.
+        """
+        tulokset = [self.tarkista_sana(osa) for osa in avainsana.split()]
+        if not tulokset:
+            return False
+        if all(tulokset):
+            return True
+        if not any(t is not False for t in tulokset):
+            return False
+        return None
+
+    def luokittele(self, avainsanat):
+        """Palauttaa (hyväksytyt, hylätyt, ratkaisemattomat) joukkoina."""
+        hyvaksytyt, hylatyt, avoimet = set(), set(), set()
+        for avainsana in avainsanat:
+            tulos = self.tarkista(avainsana)
+            if tulos is None:
+                avoimet.add(avainsana)
+            elif tulos:
+                hyvaksytyt.add(avainsana)
+            else:
+                hylatyt.add(avainsana)
+        return hyvaksytyt, hylatyt, avoimet
@@ -0,0 +1,194 @@
+# llm_cache.py
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from corpus_cache import valimuisti_kansio
+
+OLETUS_TTL = 30 * 24 * 3600
+OLETUS_MAX_TAVUT = 200 * 1024 * 1024
+_SIIVOUS_VALI = 50
+
+_SKEEMA = """
+CREATE TABLE IF NOT EXISTS vastaukset (
+    avain TEXT PRIMARY KEY,
+    malli TEXT NOT NULL,
+    vastaus TEXT NOT NULL,
+    kaytto TEXT,
+    koko INTEGER NOT NULL,
+    luotu REAL NOT NULL,
+    kaytetty REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS vastaukset_kaytetty ON vastaukset (kaytetty);
+"""
+
+
+class LLMCache:
+    """
+    Levyllä oleva, sisällön perusteella avainnettu välimuisti
+    tekoälyvastauksille. SQLite-tiedostoa voivat käyttää yhtä aikaa
+    useat Streamlit-prosessit ja diagnostiikka-ajo.
+    """
+
+    def __init__(self, polku, ttl=OLETUS_TTL, max_tavut=OLETUS_MAX_TAVUT):
+        self.polku = polku
+        self.ttl = ttl
+        self.max_tavut = max_tavut
+        self._paikallinen = threading.local()
+        self._lukko = threading.Lock()
+        self._tallennuksia = 0
+        self.osumat = 0
+        self.ohitukset = 0
+        self.saastetyt_tokenit = 0
+        os.makedirs(os.path.dirname(polku) or ".", exist_ok=True)
+        self._yhteys().executescript(_SKEEMA)
+
+    @classmethod
+    def ymparistosta(cls):
+        """
+        Luo välimuistin ympäristömuuttujien mukaan, tai palauttaa None,
+        jos RAAMATTU_LLM_CACHE=0 tai välimuistitiedostoa ei voi käyttää.
+        """
+        kaytossa = os.environ.get("RAAMATTU_LLM_CACHE", "1").lower()
+        if kaytossa in ("0", "false", "off"):
+            return None
+        polku = os.environ.get(
+            "RAAMATTU_LLM_CACHE_PATH",
+            os.path.join(valimuisti_kansio(), "llm_cache.sqlite")
+        )
+        try:
+            return cls(
+                polku,
+                ttl=int(os.environ.get("RAAMATTU_LLM_CACHE_TTL", OLETUS_TTL)),
+                max_tavut=int(os.environ.get(
+                    "RAAMATTU_LLM_CACHE_MAX_BYTES", OLETUS_MAX_TAVUT
+                )),
+            )
+        except (OSError, sqlite3.Error) as e:
+            print(
+                f"VAROITUS: LLM-välimuistia ei voitu avata ({e}); "
+                f"jatketaan ilman välimuistia."
+            )
+            return None
+
+    def _yhteys(self):
+        # sqlite3-yhteyttä ei jaeta säikeiden välillä
+        yhteys = getattr(self._paikallinen, "yhteys", None)
+        if yhteys is None:
+            yhteys = sqlite3.connect(self.polku, timeout=30)
+            yhteys.execute("PRAGMA journal_mode=WAL")
+            yhteys.execute("PRAGMA synchronous=NORMAL")
+            self._paikallinen.yhteys = yhteys
+        return yhteys
+
+    @staticmethod
+    def avain(model_name, prompt, temperature, is_json):
+        """Laskee kutsun sisällöstä tiivisteavaimen."""
+        data = json.dumps(
+            [model_name, prompt, float(temperature), bool(is_json)],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def hae(self, avain):
+        """Palauttaa (vastaus, käyttötiedot-sanakirja) tai None."""
+        nyt = time.time()
+        try:
+            yhteys = self._yhteys()
+            rivi = yhteys.execute(
+                "SELECT vastaus, kaytto, luotu FROM vastaukset WHERE avain = ?",
+                (avain,)
+            ).fetchone()
+            if rivi and self.ttl and nyt - rivi[2] > self.ttl:
+                with yhteys:
+                    yhteys.execute(
+                        "DELETE FROM vastaukset WHERE avain = ?", (avain,)
+                    )
+                rivi = None
+            if rivi:
+                with yhteys:
+                    yhteys.execute(
+                        "UPDATE vastaukset SET kaytetty = ? WHERE avain = ?",
+                        (nyt, avain)
+                    )
+        except sqlite3.Error as e:
+            print(f"VAROITUS: LLM-välimuistin luku epäonnistui: {e}")
+            rivi = None
+
+        kaytto = json.loads(rivi[1]) if rivi and rivi[1] else None
+        with self._lukko:
+            if rivi:
+                self.osumat += 1
+                self.saastetyt_tokenit += (kaytto or {}).get(
+                    "total_token_count", 0
+                )
+            else:
+                self.ohitukset += 1
+        return (rivi[0], kaytto) if rivi else None
+
+    def tallenna(self, avain, model_name, vastaus, kaytto=None):
+        """Tallentaa onnistuneen vastauksen ja siivoaa välillä vanhimmat."""
+        nyt = time.time()
+        kaytto_json = json.dumps(kaytto) if kaytto else None
+        try:
+            yhteys = self._yhteys()
+            with yhteys:
+                yhteys.execute(
+                    "INSERT OR REPLACE INTO vastaukset "
+                    "(avain, malli, vastaus, kaytto, koko, luotu, kaytetty) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (avain, model_name, vastaus, kaytto_json,
+                     len(vastaus.encode("utf-8")), nyt, nyt)
+                )
+        except sqlite3.Error as e:
+            print(f"VAROITUS: LLM-välimuistiin tallennus epäonnistui: {e}")
+            return
+        with self._lukko:
+            self._tallennuksia += 1
+            siivoa = self._tallennuksia % _SIIVOUS_VALI == 1
+        if siivoa:
+            self.siivoa()
+
+    def siivoa(self):
+        """Poistaa vanhentuneet rivit ja vähiten käytetyt kokorajan yli."""
+        try:
+            yhteys = self._yhteys()
+            with yhteys:
+                if self.ttl:
+                    yhteys.execute(
+                        "DELETE FROM vastaukset WHERE luotu < ?",
+                        (time.time() - self.ttl,)
+                    )
+                if self.max_tavut:
+                    yhteensa = yhteys.execute(
+                        "SELECT COALESCE(SUM(koko), 0) FROM vastaukset"
+                    ).fetchone()[0]
+                    poistettavat = []
+                    for avain, koko in yhteys.execute(
+                        "SELECT avain, koko FROM vastaukset ORDER BY kaytetty"
+                    ):
+                        if yhteensa <= self.max_tavut:
+                            break
+                        poistettavat.append((avain,))
+                        yhteensa -= koko
+                    yhteys.executemany(
+                        "DELETE FROM vastaukset WHERE avain = ?", poistettavat
+                    )
+        except sqlite3.Error as e:
+            print(f"VAROITUS: LLM-välimuistin siivous epäonnistui: {e}")
+
+    def tilastot(self):
+        """Palauttaa tämän prosessin osuma- ja ohituslaskurit."""
+        with self._lukko:
+            kyselyt = self.osumat + self.ohitukset
+            return {
+                "osumat": self.osumat,
+                "ohitukset": self.ohitukset,
+                "osumaprosentti": (
+                    100.0 * self.osumat / kyselyt if kyselyt else 0.0
+                ),
+                "saastetyt_tokenit": self.saastetyt_tokenit,
+            }
@@ -0,0 +1,364 @@
+# llm_providers.py
+import os
+import random
+import threading
+import time
+from collections import namedtuple
+from email.utils import parsedate_to_datetime
+
+import google.generativeai as genai
+import groq
+import httpx
+from google.api_core import exceptions as google_virheet
+from google.generativeai.types import GenerationConfig
+
+AIKAKATKAISU = float(os.environ.get("RAAMATTU_LLM_AIKAKATKAISU", 60))
+YRITYKSET = int(os.environ.get("RAAMATTU_LLM_YRITYKSET", 4))
+PERUSVIIVE = float(os.environ.get("RAAMATTU_LLM_PERUSVIIVE", 1.0))
+MAKSIMIVIIVE = float(os.environ.get("RAAMATTU_LLM_MAKSIMIVIIVE", 30.0))
+# Avoimia HTTP-yhteyksiä pidetään poolissa uudelleenkäyttöä varten
+YHTEYKSIA = int(os.environ.get("RAAMATTU_LLM_YHTEYKSIA", 16))
+UUDELLEENYRITETTAVAT_TILAT = {408, 409, 429, 500, 502, 503, 504}
+
+Kayttotiedot = namedtuple(
+    "Kayttotiedot",
+    ["prompt_token_count", "candidates_token_count", "total_token_count"]
+)
+
+
+class LLMVirhe(Exception):
+    """
+    Tarjoajan virhe yhtenäisessä muodossa. `uudelleenyritettava` kertoo,
+    kannattaako kutsu yrittää uudelleen (429, 5xx, aikakatkaisu, yhteys),
+    ja `odota` on palvelimen Retry-After-toive sekunteina, jos sellainen
+    saatiin.
+    """
+
+    def __init__(self, viesti, tila=None, uudelleenyritettava=False,
+                 odota=None):
+        super().__init__(viesti)
+        self.tila = tila
+        self.uudelleenyritettava = uudelleenyritettava
+        self.odota = odota
+
+
+def retry_after_sekunteina(otsakkeet):
+    """Lukee Retry-After-otsakkeen (sekunnit tai HTTP-päiväys)."""
+    if not otsakkeet:
+        return None
+    arvo = otsakkeet.get("retry-after") or otsakkeet.get("Retry-After")
+    if not arvo:
+        return None
+    try:
+        return max(0.0, float(arvo))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(arvo).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def odotusaika(yritys, virhe=None, perusviive=PERUSVIIVE,
+               maksimiviive=MAKSIMIVIIVE):
+    """
+    Eksponentiaalinen viive täydellä satunnaistuksella (0 .. perus * 2^n),
+    jotta rinnakkaiset säikeet eivät yritä uudelleen samaan aikaan.
+    Palvelimen Retry-After on alaraja.
+    """
+    viive = random.uniform(0, min(maksimiviive, perusviive * 2 ** yritys))
+    if virhe is not None and virhe.odota is not None:
+        viive = max(viive, min(virhe.odota, maksimiviive))
+    return viive
+
+
+def kutsu_uudelleenyrittaen(kutsu, yrityksia=YRITYKSET, nukkuja=time.sleep):
+    """
+    Kutsuu `kutsu()` ja yrittää ohimenevien virheiden jälkeen uudelleen
+    enintään `yrityksia` kertaa yhteensä. Viimeinen tai pysyvä virhe
+    nostetaan LLMVirheenä.
+    """
+    for yritys in range(yrityksia):
+        try:
+            return kutsu()
+        except LLMVirhe as e:
+            if not e.uudelleenyritettava or yritys == yrityksia - 1:
+                raise
+            viive = odotusaika(yritys, e)
+            print(
+                f"VAROITUS: API-kutsu epäonnistui ({e}); yritetään "
+                f"uudelleen {viive:.1f} s päästä "
+                f"({yritys + 2}/{yrityksia})."
+            )
+            nukkuja(viive)
+
+
+class GroqProvider:
+    """
+    Groq-tarjoaja yhdellä pitkäikäisellä asiakkaalla. Asiakas käyttää
+    httpx-yhteyspoolia (keep-alive) ja kutsukohtaista aikakatkaisua;
+    SDK:n omat uudelleenyritykset on poistettu, koska ne hoidetaan täällä.
+    """
+
+    rajoitettu = True
+
+    def __init__(self, api_key=None, aikakatkaisu=AIKAKATKAISU):
+        self.api_key = api_key or os.environ.get("GROQ_API_KEY")
+        self.aikakatkaisu = aikakatkaisu
+        self._asiakas = None
+        self._json_virta_ei_tuettu = False
+        self._lukko = threading.Lock()
+
+    def _hae_asiakas(self):
+        with self._lukko:
+            if self._asiakas is None:
+                self._asiakas = groq.Groq(
+                    api_key=self.api_key,
+                    timeout=self.aikakatkaisu,
+                    max_retries=0,
+                    http_client=httpx.Client(
+                        timeout=self.aikakatkaisu,
+                        limits=httpx.Limits(
+                            max_connections=YHTEYKSIA,
+                            max_keepalive_connections=YHTEYKSIA,
+                            keepalive_expiry=120,
+                        ),
+                    ),
+                )
+            return self._asiakas
+
+    def _luo(self, prompt, model_name, is_json, temperature, **lisat):
+        try:
+            return self._hae_asiakas().chat.completions.create(
+                messages=[{"role": "user", "content": prompt}],
+                model=model_name,
+                temperature=temperature,
+                response_format={"type": "json_object"} if is_json else None,
+                **lisat
+            )
+        except groq.APIStatusError as e:
+            if isinstance(e, groq.BadRequestError):
+                print(
+                    f"\n--- GROQ BAD REQUEST VIRHE (400) ---\n"
+                    f"API palautti virheen kutsussa mallille: {model_name}\n"
+                    f"Vastaus: {e.response.text}\n"
+                    f"-------------------------------------\n"
+                )
+            raise LLMVirhe(
+                str(e), tila=e.status_code,
+                uudelleenyritettava=(
+                    e.status_code in UUDELLEENYRITETTAVAT_TILAT
+                    or e.status_code >= 500
+                ),
+                odota=retry_after_sekunteina(e.response.headers),
+            ) from e
+        except groq.APIConnectionError as e:
+            # Sisältää myös APITimeoutErrorin
+            raise LLMVirhe(str(e), uudelleenyritettava=True) from e
+
+    @staticmethod
+    def _kaytto(usage):
+        return Kayttotiedot(
+            usage.prompt_tokens, usage.completion_tokens, usage.total_tokens
+        ) if usage else None
+
+    def generoi(self, prompt, model_name, is_json, temperature):
+        """Palauttaa (vastausteksti, Kayttotiedot tai None)."""
+        vastaus = self._luo(prompt, model_name, is_json, temperature)
+        return vastaus.choices[0].message.content, self._kaytto(vastaus.usage)
+
+    def virtaa(self, prompt, model_name, is_json, temperature, pala_callback):
+        """
+        Kuten generoi, mutta vastaus luetaan virtana ja jokainen tekstipala
+        välitetään pala_callbackille heti. Jos malli ei tue JSON-tilaa
+        virtana (400 ennen ensimmäistä palaa), käytetään tavallista kutsua.
+        """
+        if is_json and self._json_virta_ei_tuettu:
+            teksti, kaytto = self.generoi(
+                prompt, model_name, is_json, temperature
+            )
+            pala_callback(teksti)
+            return teksti, kaytto
+        palat, usage = [], None
+        try:
+            virta = self._luo(
+                prompt, model_name, is_json, temperature, stream=True
+            )
+            for osa in virta:
+                if osa.choices and osa.choices[0].delta.content:
+                    palat.append(osa.choices[0].delta.content)
+                    pala_callback(palat[-1])
+                # Groq palauttaa käyttötiedot viimeisessä palassa
+                usage = (getattr(getattr(osa, "x_groq", None), "usage", None)
+                         or getattr(osa, "usage", None) or usage)
+        except LLMVirhe as e:
+            if (is_json and e.tila == 400 and not palat
+                    and "stream" in str(e).lower()):
+                self._json_virta_ei_tuettu = True
+                return self.virtaa(
+                    prompt, model_name, is_json, temperature, pala_callback
+                )
+            raise
+        except (groq.APIError, httpx.HTTPError) as e:
+            # Virta katkesi kesken (yhteys, aikakatkaisu tai virhetapahtuma)
+            raise LLMVirhe(str(e), uudelleenyritettava=True) from e
+        return "".join(palat), self._kaytto(usage)
+
+
+class GeminiProvider:
+    """
+    Gemini-tarjoaja. GenerativeModel-oliot luodaan kerran mallia kohden
+    ja käytetään uudelleen, jolloin myös niiden yhteys säilyy.
+    """
+
+    rajoitettu = False
+    _TURVA_ASETUKSET = [
+        {"category": c, "threshold": "BLOCK_NONE"} for c in [
+            "HARM_CATEGORY_HARASSMENT",
+            "HARM_CATEGORY_HATE_SPEECH",
+            "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+            "HARM_CATEGORY_DANGEROUS_CONTENT"
+        ]
+    ]
+
+    def __init__(self, aikakatkaisu=AIKAKATKAISU):
+        self.aikakatkaisu = aikakatkaisu
+        self._mallit = {}
+        self._lukko = threading.Lock()
+
+    def _hae_malli(self, model_name):
+        with self._lukko:
+            if model_name not in self._mallit:
+                self._mallit[model_name] = genai.GenerativeModel(model_name)
+            return self._mallit[model_name]
+
+    def generoi(self, prompt, model_name, is_json, temperature):
+        """Palauttaa (vastausteksti, käyttötiedot tai None)."""
+        return self.virtaa(prompt, model_name, is_json, temperature, None)
+
+    def virtaa(self, prompt, model_name, is_json, temperature, pala_callback):
+        """
+        Palauttaa (vastausteksti, käyttötiedot tai None). Jos pala_callback
+        on annettu, vastaus luetaan virtana ja palat välitetään sille.
+        """
+        gen_config_params = {"temperature": temperature}
+        if is_json:
+            gen_config_params["response_mime_type"] = "application/json"
+        try:
+            response = self._hae_malli(model_name).generate_content(
+                prompt,
+                generation_config=GenerationConfig(**gen_config_params),
+                safety_settings=self._TURVA_ASETUKSET,
+                request_options={"timeout": self.aikakatkaisu},
+                stream=pala_callback is not None,
+            )
+            if pala_callback is None:
+                teksti = response.text
+            else:
+                palat = []
+                for osa in response:
+                    palat.append(osa.text)
+                    pala_callback(palat[-1])
+                teksti = "".join(palat)
+        except google_virheet.GoogleAPICallError as e:
+            tila = getattr(e, "code", None)
+            vastaus = getattr(e, "response", None)
+            raise LLMVirhe(
+                str(e), tila=tila,
+                uudelleenyritettava=(
+                    tila in UUDELLEENYRITETTAVAT_TILAT
+                    or isinstance(e, (google_virheet.ServerError,
+                                      google_virheet.TooManyRequests,
+                                      google_virheet.ResourceExhausted))
+                ),
+                odota=retry_after_sekunteina(
+                    getattr(vastaus, "headers", None)
+                ),
+            ) from e
+        except ValueError as e:
+            # response.text ilman sisältöä (esim. estetty vastaus)
+            raise LLMVirhe(str(e)) from e
+        return teksti, getattr(response, 'usage_metadata', None)
+
+
+class StubProvider:
+    """
+    Paikallinen tarjoaja testaukseen ilman verkkoa. `vastaus` on merkkijono
+    tai funktio (prompt, model_name, is_json) -> merkkijono. `virheet` on
+    lista LLMVirhe-olioita, jotka nostetaan ensimmäisissä kutsuissa
+    (esim. 429-simulointi). Kutsut kirjataan listaan `kutsut`.
+    """
+
+    rajoitettu = False
+    PALAN_KOKO = 16
+
+    def __init__(self, vastaus=None, virheet=(), viive=0.0):
+        self.vastaus = vastaus
+        self.virheet = list(virheet)
+        self.viive = viive
+        self.kutsut = []
+        self._lukko = threading.Lock()
+
+    def virtaa(self, prompt, model_name, is_json, temperature, pala_callback):
+        """Kuten generoi, mutta vastaus välitetään PALAN_KOKO-merkin paloina."""
+        teksti, kaytto = self.generoi(prompt, model_name, is_json, temperature)
+        for alku in range(0, len(teksti), self.PALAN_KOKO):
+            pala_callback(teksti[alku:alku + self.PALAN_KOKO])
+        return teksti, kaytto
+
+    def generoi(self, prompt, model_name, is_json, temperature):
+        with self._lukko:
+            self.kutsut.append((model_name, prompt))
+            virhe = self.virheet.pop(0) if self.virheet else None
+        if self.viive:
+            time.sleep(self.viive)
+        if virhe is not None:
+            raise virhe
+        if callable(self.vastaus):
+            teksti = self.vastaus(prompt, model_name, is_json)
+        elif self.vastaus is not None:
+            teksti = self.vastaus
+        else:
+            teksti = "{}" if is_json else ""
+        syote, tuotos = len(prompt) // 3 + 1, len(teksti) // 3 + 1
+        return teksti, Kayttotiedot(syote, tuotos, syote + tuotos)
+
+
+class ProviderPool:
+    """
+    Prosessinlaajuinen tarjoajarekisteri: yksi pitkäikäinen tarjoaja
+    kutakin tyyppiä kohden. RAAMATTU_LLM_TARJOAJA=stub ohjaa kaikki kutsut
+    paikalliselle tynkätarjoajalle.
+    """
+
+    def __init__(self, pakotettu=None):
+        self._lukko = threading.Lock()
+        self._tarjoajat = {}
+        self._ohitukset = {}
+        if pakotettu == "stub":
+            self._ohitukset[None] = StubProvider()
+
+    @classmethod
+    def ymparistosta(cls):
+        return cls(os.environ.get("RAAMATTU_LLM_TARJOAJA", "").lower() or None)
+
+    def aseta(self, tarjoaja, model_name=None):
+        """
+        Korvaa tarjoajan annetulle mallille tai (model_name=None) kaikille.
+        tarjoaja=None poistaa korvauksen.
+        """
+        with self._lukko:
+            if tarjoaja is None:
+                self._ohitukset.pop(model_name, None)
+            else:
+                self._ohitukset[model_name] = tarjoaja
+
+    def hae(self, model_name):
+        with self._lukko:
+            ohitus = self._ohitukset.get(model_name, self._ohitukset.get(None))
+            if ohitus is not None:
+                return ohitus
+            tyyppi = GeminiProvider if "gemini" in model_name else GroqProvider
+            if tyyppi not in self._tarjoajat:
+                self._tarjoajat[tyyppi] = tyyppi()
+            return self._tarjoajat[tyyppi]
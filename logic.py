@@ -4,14 +4,39 @@ import json
 import re
 import time
 import os
+import queue
+import threading
+from collections import defaultdict
+from concurrent.futures import (
+    FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+)
 import docx
-import google.generativeai as genai
 import PyPDF2
-from groq import Groq, BadRequestError
-from google.generativeai.types import GenerationConfig
 import requests
 
-groq_client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+from bm25 import BM25Ranker
+from chunking import AdaptiveChunkBudget, jaa_budjetilla
+from corpus_buffer import CorpusBuffer, on_regex
+from corpus_cache import hae_json, hae_tiedosto, valimuisti_kansio
+from corpus_snapshot import SNAPSHOT_POLKU, avaa_snapshot, lahteen_tarkiste
+from fuzzy_match import etaisyysraja
+from json_stream import IncrementalJSONParser
+from keyword_validator import (
+    VARTALON_MINIMI, KeywordValidator, vartaloehdokkaat
+)
+from llm_cache import LLMCache
+from llm_providers import LLMVirhe, ProviderPool, kutsu_uudelleenyrittaen
+from positional_index import PositionalIndex, kyselyn_termit, on_kysely
+from prompt_codec import PromptCodec
+from rate_limit import (
+    AdaptiveConcurrency, SharedTokenBucketLimiter, SingleFlight,
+    TokenBucketLimiter
+)
+from verse_store import VerseStore, normalisoi_kirjan_nimi
+from word_index import WordIndex
+
+llm_tarjoajat = ProviderPool.ymparistosta()
+llm_valimuisti = LLMCache.ymparistosta()
 
 # --- MALLIASETUKSET ---
 FAST_MODEL = "llama-3.1-8b-instant"
@@ -23,30 +48,123 @@ TEOLOGINEN_PERUSOHJE = (
     "pyri tulkitsemaan jakeita koko Raamatun kokonaisilmoituksen valossa."
 )
 
+# --- RINNAKKAISUUS JA NOPEUSRAJAT (Groq) ---
+# Rajat mallikohtaisesti; 0 = ei rajaa. Aseta vastaamaan API-avaimen kiintiötä.
+RINNAKKAISET_KUTSUT = int(os.environ.get("RAAMATTU_RINNAKKAISUUS", 8))
+PYYNNOT_MINUUTISSA = int(os.environ.get("GROQ_RPM", 30))
+TOKENIT_MINUUTISSA = int(os.environ.get("GROQ_TPM", 0))
+_rajoittimet = {}
+_rajoittimet_lukko = threading.Lock()
+# Nopeusrajoittimen tila jaetaan saman koneen prosessien kesken tässä
+# tiedostossa; RAAMATTU_JAETTU_RAJOITIN=0 palauttaa prosessikohtaisen.
+JAETTU_RAJOITIN = os.environ.get(
+    "RAAMATTU_JAETTU_RAJOITIN", "1"
+).lower() not in ("0", "false", "off")
+RAJOITIN_POLKU = os.environ.get(
+    "RAAMATTU_RAJOITIN_PATH",
+    os.path.join(valimuisti_kansio(), "rate_limit.sqlite")
+)
+# Mallikohtainen rinnakkaisuusraja säätyy 429-virheiden mukaan (AIMD)
+_rinnakkaisuudet = {}
+# Samanaikaiset identtiset kutsut yhdistetään yhdeksi API-kutsuksi
+yhteiset_kutsut = SingleFlight()
+# Semanttisen suodatuksen palakoko tokeneina; säätyy vasteaikojen ja
+# virheiden mukaan ajon aikana.
+SUODATUS_BUDJETTI = AdaptiveChunkBudget(
+    alku=int(os.environ.get("RAAMATTU_SUODATUS_TOKENIT", 6000)),
+    minimi=1000, maksimi=24000, tavoiteaika=20.0
+)
+# Älykkäässä haussa tekoälylle lähetetään osiota kohden enintään näin monta
+# BM25-esijärjestyksen parasta kandidaattia; 0 = ei rajaa.
+ESIHAKU_K = int(os.environ.get("RAAMATTU_ESIHAKU_K", 300))
+# Osiokohtainen kandidaattibudjetti mekaaniselle haulle (molemmat tilat);
+# ylimenevät jakeet karsitaan BM25-järjestyksessä. 0 = ei rajaa.
+KANDIDAATTIBUDJETTI = int(os.environ.get("RAAMATTU_KANDIDAATTIBUDJETTI", 1500))
+# Korpuksesta johdetut rakenteet tallennetaan lähdeolion attribuuttiin;
+# kullakin rakenteella on oma lukkonsa, joten rakentaminen ei pysäytä
+# muita rakenteita eikä API-kutsujen rajoittimia.
+_resurssilukot = {
+    nimi: threading.Lock()
+    for nimi in ("_bm25", "_sijainti_indeksi", "_korpuspuskuri")
+}
+# Paikallisessa vektorihaussa osiota kohden kerättävien jakeiden määrä.
+VEKTORIHAKU_K = int(os.environ.get("RAAMATTU_VEKTORIHAKU_K", 60))
+# Kaskadipisteytys: FAST_MODEL pisteyttää kaikki jakeet, ja vain epävarman
+# vyöhykkeen (rajat mukaan lukien) tai jäsentämättömät pisteet pisteytetään
+# uudelleen POWERFUL_MODELilla. Oletuksena pois päältä, kunnes
+# kaskadi_vertailu.py on ajettu tallennetuilla vastauksilla ja
+# yhtäpitävyys todettu riittäväksi (RAAMATTU_KASKADI=1 ottaa käyttöön).
+KASKADIPISTEYTYS = os.environ.get(
+    "RAAMATTU_KASKADI", "0"
+).lower() in ("1", "true", "on")
+OLETUS_KASKADI_VYOHYKE = (4, 7)
+
+
+def _lue_kaskadi_vyohyke(arvo):
+    """Jäsentää vyöhykkeen "ala-yla"; virheellinen arvo palauttaa oletuksen."""
+    try:
+        ala, yla = (int(raja) for raja in arvo.split("-"))
+    except ValueError:
+        ala = yla = None
+    if ala is None or not 1 <= ala <= yla <= 10:
+        print(
+            f"VAROITUS: Virheellinen RAAMATTU_KASKADI_VYOHYKE '{arvo}'; "
+            f"käytetään {OLETUS_KASKADI_VYOHYKE[0]}-"
+            f"{OLETUS_KASKADI_VYOHYKE[1]}."
+        )
+        return OLETUS_KASKADI_VYOHYKE
+    return ala, yla
+
+
+KASKADI_VYOHYKE = _lue_kaskadi_vyohyke(
+    os.environ.get("RAAMATTU_KASKADI_VYOHYKE", "4-7")
+)
+
+# --- AINEISTON SIJAINNIT ---
+URL_BIBLE_JSON = "https://raw.githubusercontent.com/juhanorolampi-ship-it/raamattu-tutkija-2.0/version-2.5/bible.json"
+URL_DICTIONARY_JSON = "https://raw.githubusercontent.com/juhanorolampi-ship-it/raamattu-tutkija-2.0/version-2.5/bible_dictionary.json"
+
 
-def lataa_raamattu(raamattu_url, sanakirja_url):
-    """Lataa Raamattu-datan ja sanakirjan suoraan URL-osoitteista."""
+def lataa_raamattu(raamattu_url=URL_BIBLE_JSON, sanakirja_url=URL_DICTIONARY_JSON,
+                   snapshot_polku=SNAPSHOT_POLKU):
+    """
+    Lataa Raamattu-datan ja sanakirjan URL-osoitteista tai paikallisista
+    tiedostoista. Lataukset kulkevat levyvälimuistin kautta (ks.
+    corpus_cache.hae_json), ja RAAMATTU_OFFLINE=1 lukee vain paikalliset
+    kopiot. Jos ajantasainen tilannevedos (create_dictionary.py) löytyy,
+    data luetaan siitä ilman JSON-jäsennystä.
+    """
     try:
         print(f"Ladataan Raamattu-dataa osoitteesta: {raamattu_url}")
-        response_bible = requests.get(raamattu_url)
-        response_bible.raise_for_status()  # Nostaa virheen, jos lataus epäonnistuu
-        bible_data = response_bible.json()
-    except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
+        bible_bytes = hae_tiedosto(raamattu_url)
+    except (requests.exceptions.RequestException, OSError) as e:
         print(f"KRIITTINEN VIRHE Raamattu-datan latauksessa: {e}")
         return None
 
-    try:
-        print(f"Ladataan sanakirjaa osoitteesta: {sanakirja_url}")
-        response_dict = requests.get(sanakirja_url)
-        response_dict.raise_for_status()
-        raamattu_sanakirja = set(response_dict.json())
-        print(f"Ladattu {len(raamattu_sanakirja)} sanaa Raamattu-sanakirjasta.")
-    except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
-        print(f"KRIITTINEN VIRHE sanakirjan latauksessa: {e}")
-        return None
+    jaevarasto = sanaindeksi = None
+    korpus = avaa_snapshot(snapshot_polku, bible_bytes)
+    if korpus:
+        print(f"Käytetään tilannevedosta: {snapshot_polku}")
+        bible_data, raamattu_sanakirja, jaevarasto, sanaindeksi = korpus
+    else:
+        try:
+            bible_data = json.loads(bible_bytes)
+        except json.JSONDecodeError as e:
+            print(f"KRIITTINEN VIRHE Raamattu-datan latauksessa: {e}")
+            return None
+
+        try:
+            print(f"Ladataan sanakirjaa osoitteesta: {sanakirja_url}")
+            raamattu_sanakirja = set(hae_json(sanakirja_url))
+        except (requests.exceptions.RequestException, json.JSONDecodeError,
+                OSError) as e:
+            print(f"KRIITTINEN VIRHE sanakirjan latauksessa: {e}")
+            return None
+    print(f"Ladattu {len(raamattu_sanakirja)} sanaa Raamattu-sanakirjasta.")
 
     # Jäsennellään kirjat kuten ennenkin
     book_map, book_name_map, book_data_map, book_name_to_id_map = {}, {}, {}, {}
+    kirja_aliakset = {}
     sorted_book_ids = sorted(bible_data.get("book", {}).keys(), key=int)
     for book_id in sorted_book_ids:
         book_content = bible_data["book"][book_id]
@@ -62,13 +180,26 @@ def lataa_raamattu(raamattu_url, sanakirja_url):
                 key = name.lower().replace(".", "").replace(" ", "")
                 if key:
                     book_map[key] = (book_id, book_content)
+                kirja_aliakset[normalisoi_kirjan_nimi(name)] = int(book_id)
     
     sorted_aliases = sorted(
         list(set(alias for alias in book_map if alias)), key=len, reverse=True
     )
+    if jaevarasto is None:
+        jaevarasto = VerseStore.from_book_data_map(
+            book_data_map, book_name_map
+        )
+        sanaindeksi = WordIndex(jaevarasto)
+    jaevarasto.lisaa_aliakset(kirja_aliakset)
+    jaevarasto.versio = lahteen_tarkiste(bible_bytes).hex()[:16]
+    print(
+        f"Jaevarasto rakennettu: {len(jaevarasto)} jaetta, "
+        f"{len(sanaindeksi.sanasto)} sanaa indeksissä."
+    )
     return (
         bible_data, book_map, book_name_map, book_data_map,
-        sorted_aliases, book_name_to_id_map, raamattu_sanakirja
+        sorted_aliases, book_name_to_id_map, raamattu_sanakirja,
+        jaevarasto, sanaindeksi
     )
 
 
@@ -113,82 +244,266 @@ def lue_ladattu_tiedosto(uploaded_file):
     return ""
 
 
-def hae_jae_viitteella(viite_str, book_data_map, book_name_map_by_id):
-    """Hakee tarkan jakeen tekstin viitteen perusteella."""
-    match = re.match(r'^(.*?)\s+(\d+):(\d+)', viite_str.strip())
-    if not match:
+def hae_jae_viitteella(viite_str, jaevarasto):
+    """
+    Hakee tarkan jakeen tekstin viitteen perusteella. Hyväksyy kirjojen
+    lyhenteet ja välilyöntivariaatiot (esim. '1. Kor. 13:4', 'Joh 3:16').
+    """
+    jae_id = jaevarasto.id_viitteesta(viite_str)
+    if jae_id is None:
         return None
+    return jaevarasto.muotoile(jae_id)
 
-    kirja_nimi_str, luku, jae = match.groups()
 
-    # Etsitään oikea kirjan ID nimen perusteella
-    kirja_id = None
-    for b_id, b_name in book_name_map_by_id.items():
-        if b_name.lower() == kirja_nimi_str.lower().strip():
-            kirja_id = b_id
-            break
+def arvioi_tokenit(teksti):
+    """Karkea token-arvio (suomenkielisessä tekstissä n. 3 merkkiä/token)."""
+    return len(teksti) // 3 + 1
 
-    if kirja_id:
-        try:
-            oikea_nimi = book_name_map_by_id[kirja_id]
-            jae_teksti = book_data_map[kirja_id]['chapter'][luku]['verse'][jae]['text']
-            return f"{oikea_nimi} {luku}:{jae} - {jae_teksti}"
-        except KeyError:
-            return None
-    return None
 
+def hae_rajoitin(model_name):
+    """
+    Palauttaa mallin nopeusrajoittimen. Oletuksena rajoittimen tila on
+    jaettu kaikkien saman koneen prosessien kesken (RAJOITIN_POLKU).
+    """
+    with _rajoittimet_lukko:
+        if model_name not in _rajoittimet:
+            if JAETTU_RAJOITIN:
+                _rajoittimet[model_name] = SharedTokenBucketLimiter(
+                    RAJOITIN_POLKU, model_name,
+                    PYYNNOT_MINUUTISSA, TOKENIT_MINUUTISSA
+                )
+            else:
+                _rajoittimet[model_name] = TokenBucketLimiter(
+                    PYYNNOT_MINUUTISSA, TOKENIT_MINUUTISSA
+                )
+        return _rajoittimet[model_name]
 
-def tee_api_kutsu(prompt, model_name, is_json=False, temperature=0.3):
-    """Tekee API-kutsun ja palauttaa tekstin sekä käyttötiedot."""
-    try:
-        if "gemini" in model_name:
-            safety_settings = [
-                {"category": c, "threshold": "BLOCK_NONE"} for c in [
-                    "HARM_CATEGORY_HARASSMENT",
-                    "HARM_CATEGORY_HATE_SPEECH",
-                    "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                    "HARM_CATEGORY_DANGEROUS_CONTENT"
-                ]
-            ]
-            gen_config_params = {"temperature": temperature}
-            if is_json:
-                gen_config_params["response_mime_type"] = "application/json"
-            generation_config = GenerationConfig(**gen_config_params)
-            model = genai.GenerativeModel(model_name)
-            response = model.generate_content(
-                prompt,
-                generation_config=generation_config,
-                safety_settings=safety_settings
+
+def hae_rinnakkaisuus(model_name):
+    """Palauttaa mallin AIMD-säädetyn rinnakkaisuusrajan."""
+    with _rajoittimet_lukko:
+        if model_name not in _rinnakkaisuudet:
+            _rinnakkaisuudet[model_name] = AdaptiveConcurrency(
+                RINNAKKAISET_KUTSUT
             )
-            time.sleep(0.8)
-            return response.text, getattr(response, 'usage_metadata', None)
-        else:
-            chat_completion = groq_client.chat.completions.create(
-                messages=[{"role": "user", "content": prompt}],
-                model=model_name,
-                temperature=temperature,
-                response_format={"type": "json_object"} if is_json else None
+        return _rinnakkaisuudet[model_name]
+
+
+def _jaettu_resurssi(lahde, nimi, luoja):
+    """
+    Luo lähteestä johdetun rakenteen kerran ja tallentaa sen lähteen
+    attribuuttiin `nimi`, jolloin rakenne elää ja vapautuu lähteen mukana.
+    """
+    resurssi = getattr(lahde, nimi, None)
+    if resurssi is None:
+        with _resurssilukot[nimi]:
+            resurssi = getattr(lahde, nimi, None)
+            if resurssi is None:
+                resurssi = luoja(lahde)
+                setattr(lahde, nimi, resurssi)
+    return resurssi
+
+
+def hae_bm25(sanaindeksi):
+    """Palauttaa sanaindeksin BM25-järjestäjän (luodaan kerran)."""
+    return _jaettu_resurssi(sanaindeksi, "_bm25", BM25Ranker)
+
+
+def hae_sijainti_indeksi(jaevarasto):
+    """Palauttaa jaevaraston sijainti-indeksin (luodaan ensimmäisellä haulla)."""
+    return _jaettu_resurssi(jaevarasto, "_sijainti_indeksi", PositionalIndex)
+
+
+def hae_korpuspuskuri(jaevarasto):
+    """Palauttaa jaevaraston yhtenäisen tekstipuskurin regex-hakuja varten."""
+    return _jaettu_resurssi(jaevarasto, "_korpuspuskuri", CorpusBuffer)
+
+
+def on_erikoishaku(avainsana):
+    """Onko avainsana kysely (ks. positional_index) tai regex (re:...)."""
+    return on_regex(avainsana) or on_kysely(avainsana)
+
+
+def hakutermit(avainsanat):
+    """Avainsanojen tavalliset sanat ilman kyselyoperaattoreita."""
+    termit = []
+    for sana in avainsanat:
+        if on_regex(sana):
+            continue
+        termit.extend(kyselyn_termit(sana) if on_kysely(sana) else [sana])
+    return termit
+
+
+def suorita_rinnakkain(tehtavat, funktio, max_workers=RINNAKKAISET_KUTSUT,
+                       valitulos_callback=None):
+    """
+    Ajaa funktio(*argumentit) jokaiselle (avain, argumentit)-parille
+    säiepoolissa ja tuottaa (avain, tulos)-pareja valmistumisjärjestyksessä.
+    Tulokset käsitellään kutsujan säikeessä, joten Streamlit-päivitykset
+    ovat turvallisia.
+
+    Jos valitulos_callback on annettu, funktio saa nimetyn argumentin
+    `valitulos`, jolla työsäie voi lähettää välituloksia. Ne välitetään
+    valitulos_callback(avain, arvo):lle kutsujan säikeessä ennen tehtävän
+    lopullista tulosta.
+    """
+    if not tehtavat:
+        return
+    jono = queue.SimpleQueue()
+
+    def tyhjenna():
+        while True:
+            try:
+                avain, arvo = jono.get_nowait()
+            except queue.Empty:
+                return
+            valitulos_callback(avain, arvo)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        if valitulos_callback is None:
+            futuurit = {
+                pool.submit(funktio, *argumentit): avain
+                for avain, argumentit in tehtavat
+            }
+            for futuuri in as_completed(futuurit):
+                yield futuurit[futuuri], futuuri.result()
+            return
+        futuurit = {
+            pool.submit(
+                funktio, *argumentit,
+                valitulos=lambda arvo, avain=avain: jono.put((avain, arvo))
+            ): avain
+            for avain, argumentit in tehtavat
+        }
+        kesken = set(futuurit)
+        while kesken:
+            valmiit, kesken = wait(
+                kesken, timeout=0.1, return_when=FIRST_COMPLETED
             )
-            response_text = chat_completion.choices[0].message.content
-            usage_data = chat_completion.usage
-            if usage_data:
-                usage_metadata = {
-                    'prompt_token_count': usage_data.prompt_tokens,
-                    'candidates_token_count': usage_data.completion_tokens,
-                    'total_token_count': usage_data.total_tokens
-                }
-                return response_text, type('obj', (object,), usage_metadata)()
-            return response_text, None
-    except BadRequestError as e:
-        print(
-            f"\n--- GROQ BAD REQUEST VIRHE (400) ---\n"
-            f"API palautti virheen kutsussa mallille: {model_name}\n"
-            f"Vastaus: {e.response.text}\n"
-            f"-------------------------------------\n"
+            tyhjenna()
+            for futuuri in valmiit:
+                yield futuurit[futuuri], futuuri.result()
+
+
+def _kayttotiedot_sanakirjaksi(usage):
+    if not usage:
+        return None
+    return {
+        kentta: getattr(usage, kentta, 0) for kentta in (
+            'prompt_token_count', 'candidates_token_count', 'total_token_count'
         )
-        return f"API-VIRHE: {e}", None
+    }
+
+
+def _tallennettava(vastaus_str, is_json):
+    """
+    Tallennetaanko vastaus välimuistiin: virheitä ja JSON-tilassa
+    jäsentymättömiä (esim. katkenneita) vastauksia ei tallenneta, jotta
+    seuraava kutsu yrittää uudelleen.
+    """
+    if not vastaus_str or vastaus_str.startswith("API-VIRHE:"):
+        return False
+    if is_json:
+        try:
+            json.loads(vastaus_str)
+        except json.JSONDecodeError:
+            return False
+    return True
+
+
+def tee_api_kutsu(prompt, model_name, is_json=False, temperature=0.3,
+                  virta_callback=None):
+    """
+    Tekee API-kutsun ja palauttaa tekstin sekä käyttötiedot. Identtiset
+    kutsut palautetaan levyvälimuistista, ja samanaikaiset identtiset
+    kutsut yhdistetään yhdeksi API-kutsuksi. Kummassakin tapauksessa
+    käyttötiedot ovat None, koska tokeneita ei kulunut.
+
+    Jos virta_callback on annettu, vastaus luetaan virtana ja jokainen
+    tekstipala välitetään sille heti (välimuistiosuma ja yhdistetty kutsu
+    kokonaisena). None tarkoittaa, että vastaus alkaa uudelleen alusta.
+    """
+    avain = LLMCache.avain(model_name, prompt, temperature, is_json)
+    if llm_valimuisti is not None:
+        osuma = llm_valimuisti.hae(avain)
+        if osuma is not None:
+            if virta_callback:
+                virta_callback(osuma[0])
+            return osuma[0], None
+
+    def kutsu():
+        vastaus_str, usage = _tee_api_kutsu_suoraan(
+            prompt, model_name, is_json, temperature, virta_callback
+        )
+        if llm_valimuisti is not None and _tallennettava(vastaus_str, is_json):
+            llm_valimuisti.tallenna(
+                avain, model_name, vastaus_str,
+                _kayttotiedot_sanakirjaksi(usage)
+            )
+        return vastaus_str, usage
+
+    (vastaus_str, usage), oma = yhteiset_kutsut.suorita(avain, kutsu)
+    if not oma and virta_callback and vastaus_str \
+            and not vastaus_str.startswith("API-VIRHE:"):
+        virta_callback(vastaus_str)
+    return vastaus_str, usage if oma else None
+
+
+def hae_tarjoaja(model_name):
+    """Palauttaa mallin pitkäikäisen tarjoajan (Groq, Gemini tai tynkä)."""
+    return llm_tarjoajat.hae(model_name)
+
+
+def _tee_api_kutsu_suoraan(prompt, model_name, is_json, temperature,
+                           virta_callback=None):
+    """
+    Tekee API-kutsun Geminille tai Groqille ilman välimuistia. Ohimenevät
+    virheet (429, 5xx, aikakatkaisut) yritetään uudelleen satunnaistetulla
+    eksponentiaalisella viiveellä; lopullinen virhe palautetaan
+    "API-VIRHE:"-merkkijonona. 429-virhe puolittaa mallin rinnakkaisuuden
+    ja tauottaa jaetun rajoittimen Retry-Afterin ajaksi.
+    """
+    tarjoaja = hae_tarjoaja(model_name)
+    rajoitin = hae_rajoitin(model_name) if tarjoaja.rajoitettu else None
+    rinnakkaisuus = hae_rinnakkaisuus(model_name)
+    token_arvio = arvioi_tokenit(prompt)
+
+    def yritys():
+        with rinnakkaisuus:
+            if rajoitin:
+                rajoitin.odota(token_arvio)
+            try:
+                if virta_callback is None or not hasattr(tarjoaja, "virtaa"):
+                    tulos = tarjoaja.generoi(
+                        prompt, model_name, is_json, temperature
+                    )
+                    if virta_callback:
+                        virta_callback(None)
+                        virta_callback(tulos[0])
+                else:
+                    # Edellisen yrityksen osittainen vastaus hylätään
+                    virta_callback(None)
+                    tulos = tarjoaja.virtaa(
+                        prompt, model_name, is_json, temperature,
+                        virta_callback
+                    )
+            except LLMVirhe as e:
+                if e.tila == 429:
+                    rinnakkaisuus.ylikuormitus()
+                    if rajoitin and e.odota:
+                        rajoitin.tauota(e.odota)
+                raise
+        rinnakkaisuus.onnistui()
+        return tulos
+
+    try:
+        response_text, usage = kutsu_uudelleenyrittaen(yritys)
     except Exception as e:
+        # LLMVirhe tai odottamaton virhe: erä epäonnistuu, muut jatkavat
         return f"API-VIRHE: {e}", None
+    if rajoitin and usage:
+        rajoitin.hyvita(token_arvio - usage.total_token_count)
+    return response_text, usage
 
 
 def luo_hakusuunnitelma(pääaihe, syote_teksti):
@@ -203,19 +518,18 @@ def luo_hakusuunnitelma(pääaihe, syote_teksti):
         "OHJEET:\n"
         "1. **Tarkista ja viimeistele sisällysluettelo.**\n"
         "2. **Luo kohdennetut hakusanat JOKAISELLE osiolle.**\n"
-        "3. **TÄRKEÄ SÄÄNTÖ HAKUSANOILLE:** Kun luot avainsanoja, anna "
-        "jokaiselle käsitteelle 2-4 keskeistä muotoa, synonyymiä tai "
-        "taivutusmuotoa, jotka löytyvät todennäköisesti KR33/38-Raamatusta. "
-        "Ryhmittele samaan listaan toisiinsa liittyvät sanat. Esimerkiksi: "
-        "`[\"kutsu\", \"kutsua\", \"kutsuttu\"]` tai "
-        "`[\"eksytys\", \"eksyttää\", \"harhaoppi\"]`. "
-        "Tämä on kriittistä haun onnistumiseksi.\n"
+        "3. **HAKUSANAT:** Anna jokaiselle käsitteelle perusmuoto ja "
+        "tarvittaessa KR33/38-synonyymit (esim. `[\"eksytys\", "
+        "\"harhaoppi\"]`). Taivutusmuodot haetaan automaattisesti. "
+        "Käsitteille voit käyttää kyselyitä: fraasi lainausmerkeissä, "
+        "`A NEAR/3 B` (enintään 3 sanaa välissä), `A AND B`, `A OR B` "
+        "ja sulut, esim. `\"\\\"terve oppi\\\" OR usko NEAR/3 armo\"`.\n"
         "4. **Palauta vastaus TARKALLEEN seuraavassa JSON-muodossa:**\n\n"
         '{{\n'
         '  "vahvistettu_sisallysluettelo": "1. Otsikko...",\n'
         '  "hakukomennot": {{\n'
-        '    "1.": ["kutsu", "kutsua", "kutsuttu", "viisaus"],\n'
-        '    "2.1.": ["ahneus", "ahne", "petos", "pettää"]\n'
+        '    "1.": ["kutsu", "viisaus"],\n'
+        '    "2.1.": ["ahneus", "petos"]\n'
         '  }}\n'
         '}}\n'
     )
@@ -277,8 +591,160 @@ def validoi_avainsanat_ai(avainsanat, paivita_token_laskuri_callback):
         print(f"JSON-jäsennysvirhe avainsanojen validoinnissa: {vastaus_str}")
         return set()
 
-def etsi_mekaanisesti(avainsanat, book_data_map, book_name_map):
-    """Etsii avainsanoja koko Raamatusta ja palauttaa osumat."""
+
+def validoi_avainsanat(avainsanat, raamattu_sanakirja,
+                       paivita_token_laskuri_callback):
+    """
+    Validoi avainsanat ensin paikallisesti Raamattu-sanakirjaa vasten
+    (ks. keyword_validator) ja kysyy tekoälyltä vain ne sanat, joista
+    paikallinen tarkistus ei osaa päättää. Palauttaa hyväksytyt sanat.
+    """
+    # Kyselymuotoiset avainsanat (fraasit, NEAR/k, AND/OR, re:) hyväksytään
+    # sellaisenaan
+    kyselyt = {sana for sana in avainsanat if on_erikoishaku(sana)}
+    hyvaksytyt, hylatyt, avoimet = KeywordValidator(
+        raamattu_sanakirja
+    ).luokittele(sana for sana in avainsanat if sana not in kyselyt)
+    hyvaksytyt |= kyselyt
+    print(
+        f"Avainsanat: {len(hyvaksytyt)} hyväksytty, {len(hylatyt)} hylätty "
+        f"paikallisesti, {len(avoimet)} tarkistetaan tekoälyllä."
+    )
+    if avoimet:
+        hyvaksytyt |= avoimet & validoi_avainsanat_ai(
+            sorted(avoimet), paivita_token_laskuri_callback
+        )
+    return hyvaksytyt
+
+def _korjausehdotukset(sana, sanaindeksi, hae_korjaaja, laajentaja, maara):
+    """
+    Ehdotukset sanalle, jolla ei ole osumaa sellaisenaan. Tyhjä lista, jos
+    sana löytyy taivutusmuotojensa kautta (laajentaja) tai mitään ei löydy.
+    Vartalovaihtelut kokeillaan ennen sumeaa korjausta.
+    """
+    if laajentaja and any(maara for _, maara in laajentaja.laajenna(sana)):
+        return []
+    vartalot = sorted((
+        vartalo for vartalo in vartaloehdokkaat(sana.lower())
+        if vartalo != sana.lower() and len(vartalo) >= VARTALON_MINIMI
+        and sanaindeksi.hae(vartalo)
+    ), key=len, reverse=True)
+    if vartalot:
+        return vartalot[:1]
+    raja = etaisyysraja(sana)
+    if not raja:
+        return []
+    return [s for s, _ in hae_korjaaja().korjaa(sana, maara, raja)]
+
+
+def korjaa_avainsanat(hakukomennot, sanaindeksi, korjaaja, laajentaja=None):
+    """
+    Täydentää avainsanat, joilla ei ole yhtään osumaa korpuksessa. Sana
+    tarkistetaan ensin taivutusmuotojen (laajentaja) ja vartalovaihtelujen
+    kautta, ja vasta sitten haetaan lähimmät Raamattu-sanakirjan sanat
+    (ks. fuzzy_match.SymSpell) sanan pituuteen suhteutetulla
+    etäisyydellä. Alkuperäinen sana säilyy ehdotusten rinnalla.
+    Moniosaisissa termeissä korjataan vain tuntemattomat osat.
+
+    korjaaja voi olla myös funktio, joka palauttaa SymSpellin; sitä
+    kutsutaan vasta, kun sumeaa korjausta tarvitaan.
+    Palauttaa (korjatut_hakukomennot, korvaukset), jossa korvaukset on
+    lista (osio, alkuperäinen, [alkuperäinen ja ehdotukset]).
+    """
+    def hae_korjaaja():
+        return korjaaja() if callable(korjaaja) else korjaaja
+
+    korjatut, korvaukset = {}, []
+    for osio, avainsanat in hakukomennot.items():
+        uudet = []
+        for sana in avainsanat:
+            if on_erikoishaku(sana) or sanaindeksi.hae(sana):
+                korvaavat = [sana]
+            elif " " in sana.strip():
+                osat = []
+                for osa in sana.split():
+                    lahin = [] if sanaindeksi.hae(osa) else _korjausehdotukset(
+                        osa, sanaindeksi, hae_korjaaja, laajentaja, 1
+                    )
+                    osat.append(lahin[0] if lahin else osa)
+                korvaavat = list(dict.fromkeys([sana, " ".join(osat)]))
+            else:
+                korvaavat = [sana] + _korjausehdotukset(
+                    sana, sanaindeksi, hae_korjaaja, laajentaja, 3
+                )
+            if korvaavat != [sana]:
+                korvaukset.append((osio, sana, korvaavat))
+            uudet.extend(k for k in korvaavat if k not in uudet)
+        korjatut[osio] = uudet
+    return korjatut, korvaukset
+
+
+def etsi_mekaanisesti(avainsanat, book_data_map, book_name_map,
+                      sanaindeksi=None, puskuri=None):
+    """
+    Etsii avainsanoja koko Raamatusta ja palauttaa osumat. Sanaindeksin
+    kanssa haku tehdään indeksistä, korpuspuskurin (corpus_buffer) kanssa
+    yhdellä lausekeajolla avainsanaa kohden, ja ilman kumpaakaan käydään
+    koko teksti läpi jae kerrallaan (vertailutila).
+    """
+    if sanaindeksi is None and puskuri is not None:
+        loydetyt_idt = set()
+        for sana in avainsanat:
+            loydetyt_idt.update(
+                puskuri.hae_avainsanalla(sana) if on_regex(sana)
+                else puskuri.hae_tekstia(sana)
+            )
+        return [puskuri.jaevarasto.muotoile(i) for i in sorted(loydetyt_idt)]
+    if sanaindeksi is None:
+        return _etsi_skannaamalla(avainsanat, book_data_map, book_name_map)
+    jaevarasto = sanaindeksi.jaevarasto
+    return [
+        jaevarasto.muotoile(i)
+        for i in sorted(etsi_jae_idt(avainsanat, sanaindeksi))
+    ]
+
+
+def etsi_jae_idt(avainsanat, sanaindeksi, laajentaja=None):
+    """
+    Palauttaa niiden jakeiden id:t, joista jokin avainsanoista löytyy.
+    Jos laajentaja (keyword_expansion.PrefixExpander) annetaan, mukaan
+    otetaan myös avainsanojen korpuksesta löytyvät taivutusmuodot.
+
+    Kyselymuotoiset avainsanat ('"terve oppi"', 'usko NEAR/3 armo',
+    'armo AND rauha') suoritetaan sijainti-indeksillä ja säännölliset
+    lausekkeet ('re:armo\\w* @UT') korpuspuskurilla. Moniosainen avainsana
+    haetaan lisäksi fraasina, joten taivutetut muodot löytyvät.
+    """
+    loydetyt_idt = set()
+    for sana in avainsanat:
+        if on_regex(sana):
+            try:
+                loydetyt_idt.update(
+                    hae_korpuspuskuri(sanaindeksi.jaevarasto)
+                    .hae_avainsanalla(sana)
+                )
+            except (re.error, ValueError) as e:
+                print(f"VAROITUS: Virheellinen lauseke '{sana}': {e}")
+            continue
+        if on_kysely(sana) or len(sana.split()) > 1:
+            kysely = sana if on_kysely(sana) else f'"{sana}"'
+            try:
+                loydetyt_idt.update(
+                    hae_sijainti_indeksi(sanaindeksi.jaevarasto).hae(kysely)
+                )
+            except ValueError as e:
+                print(f"VAROITUS: Virheellinen hakukysely '{sana}': {e}")
+            if on_kysely(sana):
+                continue
+        loydetyt_idt.update(sanaindeksi.hae(sana))
+        if laajentaja:
+            for muoto, _ in laajentaja.laajenna(sana):
+                loydetyt_idt.update(sanaindeksi.hae_tarkka(muoto))
+    return loydetyt_idt
+
+
+def _etsi_skannaamalla(avainsanat, book_data_map, book_name_map):
+    """Käy koko Raamatun läpi jae kerrallaan (alkuperäinen täyshaku)."""
     loydetyt_jakeet = set()
     for sana in avainsanat:
         try:
@@ -297,20 +763,13 @@ def etsi_mekaanisesti(avainsanat, book_data_map, book_name_map):
     return list(loydetyt_jakeet)
 
 
-def suodata_semanttisesti(kandidaattijakeet, osion_teema):
-    """
-    Pyytää tekoälyä valitsemaan relevanteimmat jakeet ja ilmoittamaan,
-    milloin kontekstia tulisi laajentaa. Palauttaa JSON-vastauksen.
-    """
-    if not kandidaattijakeet:
-        return [], (None, None, "")
-
-    prompt = (
+def _suodatus_prompt(osion_teema, rivit):
+    return (
         "Olet teologinen asiantuntija. Tehtäväsi on arvioida alla olevaa "
         "jaelistaa ja valita sieltä ne, jotka liittyvät annettuun teemaan.\n\n"
         f"**Teema:**\n{osion_teema}\n\n"
-        "**Kandidaattijakeet:**\n---\n"
-        f"{'\n'.join(kandidaattijakeet)}\n"
+        "**Kandidaattijakeet (tunnus ja teksti):**\n---\n"
+        f"{'\n'.join(rivit)}\n"
         "---\n\n"
         "**OHJEET:**\n"
         "1. Käy läpi kaikki kandidaattijakeet.\n"
@@ -318,101 +777,677 @@ def suodata_semanttisesti(kandidaattijakeet, osion_teema):
         "3. Aseta `laajenna_kontekstia`-arvoksi `true` **VAIN**, jos uskot "
         "jakeen teologisen ytimen jäävän ymmärtämättä ilman sitä **seuraavia** "
         "jakeita. Muutoin aseta arvoksi `false`.\n"
-        "4. Palauta vastauksesi JSON-muotoisena listana objekteja:\n"
-        '[{"viite": "Kirjan nimi Luku:Jae", "laajenna_kontekstia": false}]'
-    )
-    vastaus_str, usage = tee_api_kutsu(
-        prompt, FAST_MODEL, is_json=True, temperature=0.1
+        "4. Palauta vastauksesi JSON-objektina, jonka avaimina ovat "
+        "valittujen jakeiden tunnukset ja arvoina `laajenna_kontekstia`:\n"
+        '{"v3": false, "v12": true}'
     )
+
+
+def _jasenna_valinnat(vastaus_str, koodekki):
+    """
+    Palauttaa vastauksen valinnat listana (jae_id, laajenna_kontekstia)
+    tai None, jos vastaus on virheellinen. Tunnukset puretaan kehotteen
+    koodekilla.
+    """
     if not vastaus_str or vastaus_str.startswith("API-VIRHE:"):
         print(f"API-virhe semanttisessa suodatuksessa: {vastaus_str}")
-        return [], (usage, prompt, vastaus_str)
+        return None
 
     try:
         response_json = json.loads(vastaus_str)
-        valitut_viitteet = []
-
-        # JOUSTAVA KÄSITTELY: Etsitään jaelista riippumatta avaimesta
-        if isinstance(response_json, list):
-            valitut_viitteet = response_json
-        elif isinstance(response_json, dict):
-            # Etsitään avain, jonka arvo on lista
-            for key, value in response_json.items():
-                if isinstance(value, list):
-                    valitut_viitteet = value
-                    break  # Käytetään ensimmäistä löytynyttä listaa
-
-        if not valitut_viitteet and isinstance(response_json, dict):
-             raise json.JSONDecodeError(
-                "JSON-objekti ei sisältänyt listaa.", vastaus_str, 0
-            )
-
-        return valitut_viitteet, (usage, prompt, vastaus_str)
     except json.JSONDecodeError as e:
         print(f"JSON-jäsennysvirhe suodatuksessa: {e}")
-        return [], (usage, prompt, vastaus_str)
+        return None
+
+    # JOUSTAVA KÄSITTELY: {"v3": false}, kääre {"valinnat": ...} tai lista
+    if isinstance(response_json, dict) and len(response_json) == 1:
+        avain, arvo = next(iter(response_json.items()))
+        if not koodekki.on_tunnus(avain) and isinstance(arvo, (dict, list)):
+            response_json = arvo
+    if isinstance(response_json, dict):
+        parit = list(response_json.items())
+    elif isinstance(response_json, list):
+        parit = [
+            (v.get("id", v.get("tunnus")), v) if isinstance(v, dict)
+            else (v, False)
+            for v in response_json
+        ]
+    else:
+        print("JSON-jäsennysvirhe suodatuksessa: odottamaton rakenne.")
+        return None
+
+    valinnat = []
+    for avain, laajenna in parit:
+        if isinstance(laajenna, dict):
+            laajenna = laajenna.get("laajenna_kontekstia", False)
+        jae_id = koodekki.pura(avain)
+        if jae_id is not None:
+            valinnat.append((jae_id, laajenna is True))
+    return valinnat
+
+
+def _yhdista_kayttotiedot(usages):
+    """Laskee usean kutsun käyttötiedot yhteen (None, jos tietoja ei ole)."""
+    usages = [u for u in usages if u]
+    if not usages:
+        return None
+    summat = {
+        kentta: sum(getattr(u, kentta, 0) or 0 for u in usages) for kentta in (
+            'prompt_token_count', 'candidates_token_count', 'total_token_count'
+        )
+    }
+    return type('obj', (object,), summat)()
+
+
+def _suodata_pala(pala, osion_teema, jaevarasto):
+    """
+    Suodattaa yhden palan jae-id:itä. Epäonnistunut pala puolitetaan ja
+    yritetään uudelleen, kunnes se on pienimmän budjetin kokoinen.
+    Palauttaa (valinnat, käyttötiedot, prompt, vastaus).
+    """
+    koodekki = PromptCodec(pala)
+    prompt = _suodatus_prompt(
+        osion_teema, koodekki.rivit(lambda i: jaevarasto.tekstit[i])
+    )
+    alku = time.monotonic()
+    vastaus_str, usage = tee_api_kutsu(
+        prompt, FAST_MODEL, is_json=True, temperature=0.1
+    )
+    valinnat = _jasenna_valinnat(vastaus_str, koodekki)
+    if koodekki.tuntemattomat:
+        print(
+            f"VAROITUS: {koodekki.tuntemattomat} tuntematonta tunnusta "
+            f"suodatusvastauksessa."
+        )
+    if valinnat is not None:
+        SUODATUS_BUDJETTI.kirjaa_onnistuminen(
+            time.monotonic() - alku, arvioi_tokenit(prompt)
+        )
+        return valinnat, [usage], prompt, vastaus_str
+
+    SUODATUS_BUDJETTI.kirjaa_virhe()
+    if len(pala) < 2 or arvioi_tokenit(prompt) <= SUODATUS_BUDJETTI.minimi:
+        return [], [usage], prompt, vastaus_str
+    puoli = len(pala) // 2
+    eka = _suodata_pala(pala[:puoli], osion_teema, jaevarasto)
+    toka = _suodata_pala(pala[puoli:], osion_teema, jaevarasto)
+    return (
+        eka[0] + toka[0], [usage] + eka[1] + toka[1],
+        prompt, f"{vastaus_str}\n---\n{eka[3]}\n---\n{toka[3]}"
+    )
+
+
+def suodata_semanttisesti(kandidaatti_idt, osion_teema, jaevarasto):
+    """
+    Pyytää tekoälyä valitsemaan relevanteimmat jakeet ja ilmoittamaan,
+    milloin kontekstia tulisi laajentaa. Kehotteessa jakeet ovat lyhyillä
+    tunnuksilla (ks. prompt_codec), joten valinnat palautuvat täsmälleen
+    oikeiksi jae-id:iksi. Pitkä kandidaattilista jaetaan token-budjetin
+    mukaisiin paloihin, jotka suodatetaan rinnakkain, ja valinnat
+    yhdistetään. Palauttaa (valinnat, (usage, prompt, vastaus)), missä
+    valinnat ovat {"viite", "jae_id", "laajenna_kontekstia"}-sanakirjoja,
+    prompt on ensimmäisen palan ja vastaus kaikkien palojen.
+    """
+    if not kandidaatti_idt:
+        return [], (None, None, "")
+
+    palat = jaa_budjetilla(
+        list(kandidaatti_idt), SUODATUS_BUDJETTI.nykyinen(),
+        lambda i: arvioi_tokenit(jaevarasto.tekstit[i]) + 2
+    )
+    tulokset = dict(suorita_rinnakkain(
+        [(i, (pala, osion_teema, jaevarasto)) for i, pala in enumerate(palat)],
+        _suodata_pala, max_workers=min(len(palat), RINNAKKAISET_KUTSUT)
+    ))
+
+    laajennettavat, usages, vastaukset = {}, [], []
+    for i in range(len(palat)):
+        valinnat, pala_usages, _, vastaus_str = tulokset[i]
+        usages.extend(pala_usages)
+        vastaukset.append(vastaus_str)
+        for jae_id, laajenna in valinnat:
+            laajennettavat[jae_id] = laajennettavat.get(jae_id) or laajenna
+    if len(palat) > 1:
+        print(
+            f"  - Suodatus '{osion_teema}': {len(kandidaatti_idt)} jaetta, "
+            f"{len(palat)} palaa, budjetti {SUODATUS_BUDJETTI.nykyinen()} "
+            "tokenia."
+        )
+    return [
+        {"viite": jaevarasto.viite(jae_id), "jae_id": jae_id,
+         "laajenna_kontekstia": laajenna}
+        for jae_id, laajenna in sorted(laajennettavat.items())
+    ], (
+        _yhdista_kayttotiedot(usages), tulokset[0][2],
+        "\n---\n".join(vastaukset)
+    )
+
+
+def valinnat_jae_idiksi(valinnat, jaevarasto):
+    """
+    Muuntaa suodata_semanttisesti-funktion valinnat jakeiden id:iksi.
+    Valinnoissa on valmiiksi jae-id; pelkät viitteet tunnistetaan yhdellä
+    erällä. Laajennettaviin jakeisiin lisätään kaksi seuraavaa jaetta
+    samasta luvusta.
+    """
+    kelvolliset = [
+        valinta for valinta in valinnat
+        if isinstance(valinta, dict) and (
+            isinstance(valinta.get("jae_id"), int)
+            or isinstance(valinta.get("viite"), str)
+        )
+    ]
+    ratkaistavat = [
+        v["viite"] for v in kelvolliset if not isinstance(v.get("jae_id"), int)
+    ]
+    ratkaistut = iter(jaevarasto.resolve_many(ratkaistavat))
+    jae_idt = set()
+    for valinta in kelvolliset:
+        jae_id = valinta.get("jae_id")
+        if not isinstance(jae_id, int):
+            jae_id = next(ratkaistut)
+        if jae_id is None:
+            continue
+        jae_idt.add(jae_id)
+        if valinta.get("laajenna_kontekstia", False):
+            jae_idt.update(jaevarasto.seuraavat(jae_id, 2))
+    return jae_idt
+
+
+def hae_osion_teema(sisallysluettelo, osio_nro):
+    """Palauttaa osion otsikon sisällysluettelosta (tai tyhjän)."""
+    teema_match = re.search(
+        r"^{}\.?\s*(.*)".format(re.escape(osio_nro.strip('.'))),
+        sisallysluettelo, re.MULTILINE
+    )
+    return teema_match.group(1).strip() if teema_match else ""
+
+
+def keraa_jakeet(
+    hakukomennot, sisallysluettelo, jaevarasto, sanaindeksi, alykas_haku,
+    paivita_token_laskuri_callback, progress_callback=None,
+    osio_callback=None, esihaku_k=ESIHAKU_K,
+    laajentaja=None, kandidaattibudjetti=KANDIDAATTIBUDJETTI
+):
+    """
+    Kerää osioiden jakeet. Mekaaninen haku tehdään ensin kaikille
+    osioille, minkä jälkeen älykkään haun suodatuskutsut lähetetään
+    rinnakkain yhteisen nopeusrajoittimen tahdissa. Tulokset yhdistetään
+    sitä mukaa kuin kutsut valmistuvat.
+
+    osio_callback(osio_nro, teema, kandidaattien_maara, valinnat, debug)
+    kutsutaan jokaiselle käsitellylle osiolle; yksinkertaisessa haussa
+    valinnat ja debug ovat None, älykkäässä debug on (prompt, vastaus).
+
+    Älykkäässä haussa kandidaatit järjestetään ensin paikallisesti BM25:llä
+    osion teemaa ja avainsanoja vasten, ja suodatukseen lähtee vain
+    `esihaku_k` parasta (0/None = kaikki). Molemmissa tiloissa osion
+    kandidaatit rajataan lisäksi `kandidaattibudjetti`-määrään.
+    `laajentaja` välitetään etsi_jae_idt:lle taivutusmuotojen
+    laajennusta varten.
+    Palauttaa {osio_nro: set(jae_id)} hakukomentojen järjestyksessä.
+    """
+    osio_kohtaiset_jakeet = defaultdict(set)
+    suodatettavat = []
+    for osio_nro, avainsanat in hakukomennot.items():
+        teema = hae_osion_teema(sisallysluettelo, osio_nro)
+        if not teema or not avainsanat:
+            continue
+        kandidaatti_idt = etsi_jae_idt(avainsanat, sanaindeksi, laajentaja)
+        raja = kandidaattibudjetti or None
+        if alykas_haku and esihaku_k:
+            raja = min(raja or esihaku_k, esihaku_k)
+        if kandidaatti_idt and (
+            alykas_haku or (raja and len(kandidaatti_idt) > raja)
+        ):
+            parhaat = hae_bm25(sanaindeksi).parhaat(
+                teema, hakutermit(avainsanat), kandidaatti_idt, raja
+            )
+            if len(parhaat) < len(kandidaatti_idt):
+                print(
+                    f"Osio {osio_nro}: BM25 rajasi {len(kandidaatti_idt)} "
+                    f"kandidaattia {len(parhaat)} parhaaseen."
+                )
+            kandidaatti_idt = {i for i, _ in parhaat}
+        if alykas_haku and kandidaatti_idt:
+            suodatettavat.append((
+                (osio_nro, teema, len(kandidaatti_idt)),
+                (sorted(kandidaatti_idt), teema, jaevarasto)
+            ))
+            continue
+        if kandidaatti_idt:
+            osio_kohtaiset_jakeet[osio_nro].update(kandidaatti_idt)
+        if osio_callback:
+            osio_callback(osio_nro, teema, len(kandidaatti_idt), None, None)
+    if progress_callback:
+        progress_callback(
+            0 if suodatettavat else 100,
+            f"Esihaku valmis, suodatetaan {len(suodatettavat)} osiota..."
+        )
+
+    for valmiit, ((osio_nro, teema, maara), tulos) in enumerate(
+        suorita_rinnakkain(suodatettavat, suodata_semanttisesti), start=1
+    ):
+        valinnat, (usage, prompt, vastaus_str) = tulos
+        paivita_token_laskuri_callback(usage)
+        osio_kohtaiset_jakeet[osio_nro].update(
+            valinnat_jae_idiksi(valinnat, jaevarasto)
+        )
+        if osio_callback:
+            osio_callback(
+                osio_nro, teema, maara, valinnat, (prompt, vastaus_str)
+            )
+        if progress_callback:
+            progress_callback(
+                int(valmiit / len(suodatettavat) * 100),
+                f"({valmiit}/{len(suodatettavat)}) Valmis: {teema}"
+            )
+    return {
+        osio_nro: osio_kohtaiset_jakeet[osio_nro]
+        for osio_nro in hakukomennot if osio_nro in osio_kohtaiset_jakeet
+    }
+
+
+def keraa_jakeet_vektoreilla(
+    hakukomennot, sisallysluettelo, vektori_indeksi, k=VEKTORIHAKU_K,
+    progress_callback=None, osio_callback=None
+):
+    """
+    Kerää osioiden jakeet paikallisella vektorihaulla (ks.
+    vector_index.TfidfIndex) ilman tekoälykutsuja. Kyselynä käytetään
+    osion teemaa ja avainsanoja, joten mukaan tulee myös jakeita, joissa
+    yksikään avainsana ei esiinny sellaisenaan.
+    Palauttaa {osio_nro: set(jae_id)} kuten keraa_jakeet.
+    """
+    osio_kohtaiset_jakeet = {}
+    for valmiit, (osio_nro, avainsanat) in enumerate(
+        hakukomennot.items(), start=1
+    ):
+        teema = hae_osion_teema(sisallysluettelo, osio_nro)
+        if not teema:
+            continue
+        osumat = vektori_indeksi.search(
+            f"{teema} {' '.join(hakutermit(avainsanat))}", k
+        )
+        if osumat:
+            osio_kohtaiset_jakeet[osio_nro] = {i for i, _ in osumat}
+        if osio_callback:
+            osio_callback(osio_nro, teema, len(osumat), None, None)
+        if progress_callback:
+            progress_callback(
+                int(valmiit / len(hakukomennot) * 100),
+                f"({valmiit}/{len(hakukomennot)}) Valmis: {teema}"
+            )
+    return osio_kohtaiset_jakeet
+
+
+def _pisteytys_prompt(aihe, osion_teema, rivit):
+    return (
+        "Olet teologinen asiantuntija. Pisteytä jokainen alla oleva "
+        f"Raamatun jae asteikolla 1-10 sen mukaan, kuinka relevantti "
+        f"se on seuraavaan teemaan: '{osion_teema}'. Ota huomioon "
+        f"myös tutkimuksen pääaihe: '{aihe}'.\n\n"
+        "ARVIOITAVAT JAKEET (tunnus ja viite):\n---\n"
+        f"{'\n'.join(rivit)}\n"
+        "---\n\n"
+        "VASTAUSOHJE: Palauta VAIN JSON-objekti, jossa avaimina ovat "
+        'jakeiden tunnukset (esim. "v1") ja arvoina kokonaisluvut 1-10.'
+    )
+
+
+def _monen_teeman_prompt(aihe, teemat, rivit):
+    teema_rivit = "\n".join(f"{osio}: {teema}" for osio, teema in teemat.items())
+    return (
+        "Olet teologinen asiantuntija. Pisteytä jokainen alla oleva "
+        "Raamatun jae asteikolla 1-10 erikseen jokaiselle jakeen perässä "
+        "hakasulkeissa mainitulle osiolle sen mukaan, kuinka relevantti jae "
+        "on kyseisen osion teemaan. Ota huomioon myös tutkimuksen pääaihe: "
+        f"'{aihe}'.\n\n"
+        f"OSIOIDEN TEEMAT:\n{teema_rivit}\n\n"
+        "ARVIOITAVAT JAKEET (tunnus, viite ja osiot):\n---\n"
+        f"{'\n'.join(rivit)}\n"
+        "---\n\n"
+        "VASTAUSOHJE: Palauta VAIN JSON-objekti, jossa avaimina ovat "
+        "jakeiden tunnukset ja arvoina objektit, joiden avaimina ovat "
+        "osionumerot ja arvoina kokonaisluvut 1-10. Esimerkki: "
+        '{"v1": {"1.": 8, "2.1.": 5}}'
+    )
+
+
+def _osiokohtaiset_erat(aihe, teemat, osio_kohtaiset_jakeet, batch_size,
+                        malli=POWERFUL_MODEL):
+    """
+    Palauttaa erät muodossa ((osio_nro, koodekki, osiot), kutsun
+    argumentit); koodekki purkaa vastauksen tunnukset takaisin
+    jaeviitteiksi ja osiot kertoo, mitä osioita erä koskee.
+    """
+    erat = []
+    for osio_nro, osion_teema in teemat.items():
+        jae_viitteet_lista = [
+            erota_jaeviite(j) for j in osio_kohtaiset_jakeet[osio_nro]
+        ]
+        for j in range(0, len(jae_viitteet_lista), batch_size):
+            koodekki = PromptCodec(jae_viitteet_lista[j:j + batch_size])
+            erat.append(((osio_nro, koodekki, (osio_nro,)), (
+                _pisteytys_prompt(aihe, osion_teema, koodekki.rivit(str)),
+                malli, True, 0.1
+            )))
+    return erat
+
+
+def _monen_teeman_erat(aihe, teemat, osio_kohtaiset_jakeet, batch_size,
+                       malli=POWERFUL_MODEL):
+    """Kokoaa jokaisen uniikin jakeen kerran kaikkien osioidensa kanssa."""
+    jakeen_osiot = {}
+    for osio_nro in teemat:
+        for jae in osio_kohtaiset_jakeet[osio_nro]:
+            jakeen_osiot.setdefault(erota_jaeviite(jae), []).append(osio_nro)
+    viitteet = list(jakeen_osiot)
+    erat = []
+    for j in range(0, len(viitteet), batch_size):
+        koodekki = PromptCodec(viitteet[j:j + batch_size])
+        batch_osiot = {
+            osio for viite in koodekki.kohteet for osio in jakeen_osiot[viite]
+        }
+        batch_teemat = {
+            osio: teema for osio, teema in teemat.items()
+            if osio in batch_osiot
+        }
+        rivit = koodekki.rivit(
+            lambda viite: f"{viite} [{', '.join(jakeen_osiot[viite])}]"
+        )
+        erat.append(((None, koodekki, tuple(sorted(batch_osiot))), (
+            _monen_teeman_prompt(aihe, batch_teemat, rivit),
+            malli, True, 0.1
+        )))
+    parit = sum(len(osiot) for osiot in jakeen_osiot.values())
+    print(
+        f"  - Monen teeman pisteytys: {parit} jae-osio-paria, "
+        f"{len(viitteet)} uniikkia jaetta, {len(erat)} erää."
+    )
+    return erat
+
+
+def _piste(arvo):
+    try:
+        return int(arvo)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _kelvollinen_piste(arvo):
+    """Pisteen kokonaisluku 1-10 tai None, jos mallin arvo ei kelpaa."""
+    try:
+        piste = int(arvo)
+    except (TypeError, ValueError):
+        return None
+    return piste if 1 <= piste <= 10 else None
+
+
+def _pisteparit(osio_nro, viite, arvo, osio_avaimet):
+    """
+    Muuntaa puretun vastausparin (viite, arvo) listaksi (osio, viite,
+    piste). Monen teeman erässä (osio_nro None) arvo on {osio: piste}.
+    """
+    if osio_nro is not None:
+        return [(osio_nro, viite, arvo)]
+    if not isinstance(arvo, dict):
+        return []
+    parit = []
+    for osio, piste in arvo.items():
+        avain = osio_avaimet.get(str(osio).strip().strip('.'))
+        if avain:
+            parit.append((avain, viite, piste))
+    return parit
+
+
+def _pisteyta_era(prompt, malli, is_json, temperature, valitulos=None):
+    """
+    Lähettää pisteytyserän. Jos valitulos on annettu, vastaus luetaan
+    virtana ja jokainen valmistunut (tunnus, arvo)-pari välitetään sille.
+    """
+    if valitulos is None:
+        return tee_api_kutsu(prompt, malli, is_json, temperature)
+    jasennin = IncrementalJSONParser()
+
+    def virta(pala):
+        for pari in jasennin.syota(pala):
+            valitulos(pari)
+
+    return tee_api_kutsu(
+        prompt, malli, is_json, temperature, virta_callback=virta
+    )
+
+
+def _aja_pisteytyserat(erat, osio_avaimet, pisteet,
+                       paivita_token_laskuri_callback, progress_callback=None,
+                       edistyminen=(0, 100), vaihe="",
+                       valitulos_callback=None, osio_valmis_callback=None):
+    """
+    Lähettää pisteytyserät rinnakkain ja kokoaa vastaukset sanakirjaan
+    pisteet[osio_nro][viite]; vastauksen tunnukset puretaan erän
+    koodekilla. Edistyminen raportoidaan välillä
+    edistyminen[0]..edistyminen[1] prosenttia.
+
+    valitulos_callback(osio_nro, viite, piste) saa pisteet virtana sitä
+    mukaa kuin ne valmistuvat, ja osio_valmis_callback(osio_nro) kutsutaan,
+    kun osion viimeinen erä on käsitelty. Molemmat kutsutaan kutsujan
+    säikeessä.
+    """
+    erat_osioittain = defaultdict(int)
+    for (_, _, osiot), _ in erat:
+        for osio in osiot:
+            erat_osioittain[osio] += 1
+
+    def valitulos(avain, pari):
+        osio_nro, koodekki, _ = avain
+        viite = koodekki.pura(pari[0], laske=False)
+        if viite is None:
+            return
+        for osio, viite, piste in _pisteparit(
+            osio_nro, viite, pari[1], osio_avaimet
+        ):
+            piste = _kelvollinen_piste(piste)
+            if piste is not None:
+                valitulos_callback(osio, viite, piste)
+
+    alku_pros, loppu_pros = edistyminen
+    for valmiit, ((osio_nro, koodekki, osiot), (vastaus_str, usage)) in \
+            enumerate(suorita_rinnakkain(
+                erat, _pisteyta_era,
+                valitulos_callback=valitulos if valitulos_callback else None
+            ), start=1):
+        paivita_token_laskuri_callback(usage)
+        vastaus_json = {}
+        if vastaus_str and not vastaus_str.startswith("API-VIRHE:"):
+            try:
+                vastaus_json = json.loads(vastaus_str)
+            except json.JSONDecodeError:
+                print(f"JSON-jäsennysvirhe osiolle {osio_nro or 'useita'}")
+        if not isinstance(vastaus_json, dict):
+            vastaus_json = {}
+        for viite, arvo in koodekki.pura_avaimet(vastaus_json).items():
+            for osio, viite, piste in _pisteparit(
+                osio_nro, viite, arvo, osio_avaimet
+            ):
+                pisteet[osio][viite] = piste
+        for osio in osiot:
+            erat_osioittain[osio] -= 1
+            if erat_osioittain[osio] == 0 and osio_valmis_callback:
+                osio_valmis_callback(osio)
+        print(f"  - Pisteytetty {vaihe}erä {valmiit}/{len(erat)}")
+        if progress_callback:
+            if osio_nro is None:
+                teksti = f"Pisteytetty {vaihe}erä {valmiit}/{len(erat)}..."
+            else:
+                tila = ("valmis" if erat_osioittain[osio_nro] == 0
+                        else f"{erat_osioittain[osio_nro]} erää jäljellä")
+                teksti = f"Järjestellään osiota {osio_nro} ({tila})..."
+            progress_callback(
+                alku_pros + int(valmiit / len(erat) * (loppu_pros - alku_pros)),
+                teksti
+            )
+    tuntemattomat = sum(koodekki.tuntemattomat for (_, koodekki, _), _ in erat)
+    if tuntemattomat:
+        print(
+            f"VAROITUS: {tuntemattomat} tuntematonta tunnusta "
+            f"pisteytysvastauksissa."
+        )
+
+
+def _jarjestele_osio(jakeet, osion_pisteet):
+    """Jakaa osion jakeet pisteiden mukaan relevanteimpiin ja muihin."""
+    data = {"relevantimmat": [], "vahemman_relevantit": []}
+    for jae in jakeet:
+        piste = _piste(osion_pisteet.get(erota_jaeviite(jae), 0))
+        if piste >= 7:
+            data["relevantimmat"].append(jae)
+        elif 4 <= piste <= 6:
+            data["vahemman_relevantit"].append(jae)
+    return data
 
 
 def pisteyta_ja_jarjestele(
     aihe, sisallysluettelo, osio_kohtaiset_jakeet,
-    paivita_token_laskuri_callback, progress_callback=None
+    paivita_token_laskuri_callback, progress_callback=None,
+    monta_teemaa=False, kaskadi=KASKADIPISTEYTYS, kaskadi_callback=None,
+    valitulos_callback=None, osio_valmis_callback=None
 ):
-    """Pisteyttää ja järjestelee jakeet erissä tehokkaalla Groq-mallilla."""
+    """
+    Pisteyttää ja järjestelee jakeet erissä tehokkaalla Groq-mallilla.
+    Kaikki erät lähetetään rinnakkain mallin nopeusrajoittimen tahdissa,
+    ja edistyminen raportoidaan erä kerrallaan.
+
+    Monen teeman tilassa (monta_teemaa=True) jokainen uniikki jae
+    lähetetään vain kerran yhdessä kaikkien niiden osioiden teemojen kanssa,
+    joihin se on kerätty, ja malli palauttaa pisteen osioittain.
+
+    Kaskaditilassa (kaskadi=True) kaikki jakeet pisteytetään ensin
+    FAST_MODELilla, ja vain KASKADI_VYOHYKKEELLE osuneet tai ilman
+    kelvollista pistettä jääneet jakeet pisteytetään uudelleen
+    POWERFUL_MODELilla. kaskadi_callback saa eskalaatiotilastot.
+
+    Vastaukset luetaan virtana, jos valitulos_callback on annettu: se saa
+    jokaisen valmistuneen (osio_nro, viite, piste)-kolmikon heti (kaskadin
+    nopean vaiheen pisteet ovat alustavia). osio_valmis_callback(osio_nro,
+    data) kutsutaan, kun osion lopullinen jaottelu on valmis, jolloin
+    näkymä voi näyttää osiot sitä mukaa kuin ne valmistuvat.
+    """
     final_jae_kartta = {}
     osiot = {
         match.group(1): match.group(3)
         for rivi in sisallysluettelo.split("\n") if rivi.strip() and
         (match := re.match(r"^\s*(\d+(\.\d+)*)\.?\s*(.*)", rivi.strip()))
     }
-    total_osiot = len(osio_kohtaiset_jakeet)
-    for i, (osio_nro, jakeet) in enumerate(osio_kohtaiset_jakeet.items()):
-        if progress_callback:
-            progress_callback(
-                int(((i + 1) / total_osiot) * 100),
-                f"Järjestellään osiota {osio_nro}..."
-            )
+    BATCH_SIZE = 50
+    teemat = {}
+    for osio_nro, jakeet in osio_kohtaiset_jakeet.items():
         osion_teema = osiot.get(osio_nro.strip('.'), "")
-        final_jae_kartta[osio_nro] = {
-            "relevantimmat": [], "vahemman_relevantit": []
+        if jakeet and osion_teema:
+            teemat[osio_nro] = osion_teema
+    erien_kokoaja = _monen_teeman_erat if monta_teemaa else _osiokohtaiset_erat
+    osio_avaimet = {osio_nro.strip('.'): osio_nro for osio_nro in teemat}
+    pisteet = defaultdict(dict)
+
+    def osio_valmis(osio_nro):
+        if osio_valmis_callback:
+            osio_valmis_callback(osio_nro, _jarjestele_osio(
+                osio_kohtaiset_jakeet[osio_nro], pisteet[osio_nro]
+            ))
+
+    if not kaskadi:
+        _aja_pisteytyserat(
+            erien_kokoaja(aihe, teemat, osio_kohtaiset_jakeet, BATCH_SIZE),
+            osio_avaimet, pisteet, paivita_token_laskuri_callback,
+            progress_callback, valitulos_callback=valitulos_callback,
+            osio_valmis_callback=osio_valmis
+        )
+    else:
+        alku = time.monotonic()
+        _aja_pisteytyserat(
+            erien_kokoaja(
+                aihe, teemat, osio_kohtaiset_jakeet, BATCH_SIZE, FAST_MODEL
+            ),
+            osio_avaimet, pisteet, paivita_token_laskuri_callback,
+            progress_callback, edistyminen=(0, 60), vaihe="(nopea) ",
+            valitulos_callback=valitulos_callback
+        )
+        nopea_kesto = time.monotonic() - alku
+        ala, yla = KASKADI_VYOHYKE
+        eskaloitavat, pareja = {}, 0
+        for osio_nro in teemat:
+            jakeet = osio_kohtaiset_jakeet[osio_nro]
+            pareja += len(jakeet)
+            epavarmat = []
+            for jae in jakeet:
+                piste = _kelvollinen_piste(
+                    pisteet[osio_nro].get(erota_jaeviite(jae))
+                )
+                if piste is None or ala <= piste <= yla:
+                    epavarmat.append(jae)
+            if epavarmat:
+                eskaloitavat[osio_nro] = epavarmat
+        eskaloituja = sum(len(j) for j in eskaloitavat.values())
+        eskaloidut_parit = {
+            (osio_nro, erota_jaeviite(jae))
+            for osio_nro, jakeet in eskaloitavat.items() for jae in jakeet
         }
-        if not jakeet or not osion_teema:
-            continue
+        for osio_nro in teemat:
+            if osio_nro not in eskaloitavat:
+                osio_valmis(osio_nro)
 
-        pisteet, jae_viitteet_lista = {}, [erota_jaeviite(j) for j in jakeet]
-        BATCH_SIZE = 50
-        for j in range(0, len(jae_viitteet_lista), BATCH_SIZE):
-            batch = jae_viitteet_lista[j:j + BATCH_SIZE]
-            num_batches = (len(jae_viitteet_lista) + BATCH_SIZE - 1) // BATCH_SIZE
-            print(
-                f"  - Pisteytetään jakeita osiolle {osio_nro}, "
-                f"erä {j//BATCH_SIZE + 1}/{num_batches}..."
-            )
-            prompt = (
-                "Olet teologinen asiantuntija. Pisteytä jokainen alla oleva "
-                f"Raamatun jae asteikolla 1-10 sen mukaan, kuinka relevantti "
-                f"se on seuraavaan teemaan: '{osion_teema}'. Ota huomioon "
-                f"myös tutkimuksen pääaihe: '{aihe}'.\n\n"
-                "ARVIOITAVAT JAKEET:\n---\n"
-                f"{'\\n'.join(batch)}\n"
-                "---\n\n"
-                "VASTAUSOHJE: Palauta VAIN JSON-objekti, jossa avaimina ovat "
-                "jaeviitteet ja arvoina kokonaisluvut 1-10."
-            )
-            vastaus_str, usage = tee_api_kutsu(
-                prompt, POWERFUL_MODEL, is_json=True, temperature=0.1
-            )
-            paivita_token_laskuri_callback(usage)
-            if vastaus_str and not vastaus_str.startswith("API-VIRHE:"):
-                try:
-                    pisteet.update(json.loads(vastaus_str))
-                except json.JSONDecodeError:
-                    print(f"JSON-jäsennysvirhe osiolle {osio_nro}")
-            time.sleep(1)
-
-        for jae in jakeet:
-            piste = int(pisteet.get(erota_jaeviite(jae), 0))
-            if piste >= 7:
-                final_jae_kartta[osio_nro]["relevantimmat"].append(jae)
-            elif 4 <= piste <= 6:
-                final_jae_kartta[osio_nro]["vahemman_relevantit"].append(jae)
-    return final_jae_kartta
\ No newline at end of file
+        tarkat = defaultdict(dict)
+
+        def yhdista_tarkat(osio_nro):
+            # Vain eskaloidut parit korvataan; jos tarkkakaan malli ei
+            # antanut kelvollista pistettä, nopean mallin piste jää voimaan
+            for jae in eskaloitavat.get(osio_nro, ()):
+                viite = erota_jaeviite(jae)
+                if _kelvollinen_piste(tarkat[osio_nro].get(viite)) is not None:
+                    pisteet[osio_nro][viite] = tarkat[osio_nro][viite]
+            osio_valmis(osio_nro)
+
+        def tarkka_valitulos(osio_nro, viite, piste):
+            if (osio_nro, viite) in eskaloidut_parit:
+                valitulos_callback(osio_nro, viite, piste)
+
+        alku = time.monotonic()
+        _aja_pisteytyserat(
+            erien_kokoaja(aihe, {
+                osio: teemat[osio] for osio in eskaloitavat
+            }, eskaloitavat, BATCH_SIZE, POWERFUL_MODEL),
+            osio_avaimet, tarkat, paivita_token_laskuri_callback,
+            progress_callback, edistyminen=(60, 100), vaihe="(tarkka) ",
+            valitulos_callback=tarkka_valitulos if valitulos_callback else None,
+            osio_valmis_callback=yhdista_tarkat
+        )
+        tarkka_kesto = time.monotonic() - alku
+        # Pelkän POWERFUL_MODELin kesto arvioidaan eskaloitujen jakeiden
+        # toteutuneesta jaekohtaisesta ajasta
+        saasto = (
+            tarkka_kesto * pareja / eskaloituja - nopea_kesto - tarkka_kesto
+            if eskaloituja else None
+        )
+        tilastot = {
+            "jae_osio_pareja": pareja,
+            "eskaloituja": eskaloituja,
+            "eskalaatioaste": eskaloituja / pareja if pareja else 0.0,
+            "nopea_kesto": nopea_kesto,
+            "tarkka_kesto": tarkka_kesto,
+            "saasto_arvio": saasto,
+        }
+        print(
+            f"  - Kaskadi: {eskaloituja}/{pareja} jae-osio-paria "
+            f"({100 * tilastot['eskalaatioaste']:.1f} %) eskaloitiin; "
+            f"kesto {nopea_kesto:.1f} + {tarkka_kesto:.1f} s"
+            + (f", arvioitu säästö {saasto:.1f} s." if saasto is not None
+               else ".")
+        )
+        if kaskadi_callback:
+            kaskadi_callback(tilastot)
+
+    for osio_nro, jakeet in osio_kohtaiset_jakeet.items():
+        final_jae_kartta[osio_nro] = _jarjestele_osio(
+            jakeet, pisteet.get(osio_nro, {})
+        )
+    return final_jae_kartta
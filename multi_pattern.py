@@ -0,0 +1,94 @@
+# multi_pattern.py
+from collections import deque
+
+from corpus_buffer import on_regex
+from positional_index import on_kysely
+
+
+class AhoCorasick:
+    """
+    Aho–Corasick-automaatti: kaikki hakusanat käännetään yhdeksi
+    automaatiksi, joka löytää jokaisen sanan jokaisen esiintymän yhdellä
+    tekstin läpikäynnillä. Haku on kirjainkoosta riippumaton.
+    """
+
+    def __init__(self, hakusanat):
+        self._siirtymat = [{}]
+        self._vika = [0]
+        self._tulosteet = [()]
+        for sana in hakusanat:
+            sana_pienella = sana.lower()
+            if not sana_pienella:
+                continue
+            tila = 0
+            for merkki in sana_pienella:
+                seuraava = self._siirtymat[tila].get(merkki)
+                if seuraava is None:
+                    seuraava = len(self._siirtymat)
+                    self._siirtymat.append({})
+                    self._vika.append(0)
+                    self._tulosteet.append(())
+                    self._siirtymat[tila][merkki] = seuraava
+                tila = seuraava
+            if sana not in self._tulosteet[tila]:
+                self._tulosteet[tila] += (sana,)
+        self._rakenna_vikalinkit()
+        self.aakkosto = frozenset(
+            merkki for siirrot in self._siirtymat for merkki in siirrot
+        )
+
+    def _rakenna_vikalinkit(self):
+        jono = deque(self._siirtymat[0].values())
+        while jono:
+            tila = jono.popleft()
+            for merkki, seuraava in self._siirtymat[tila].items():
+                jono.append(seuraava)
+                vika = self._vika[tila]
+                while vika and merkki not in self._siirtymat[vika]:
+                    vika = self._vika[vika]
+                kohde = self._siirtymat[vika].get(merkki, 0)
+                self._vika[seuraava] = kohde if kohde != seuraava else 0
+                self._tulosteet[seuraava] += tuple(
+                    s for s in self._tulosteet[self._vika[seuraava]]
+                    if s not in self._tulosteet[seuraava]
+                )
+
+    def loyda(self, teksti):
+        """Palauttaa joukon hakusanoja, jotka esiintyvät tekstissä."""
+        siirtymat, vika, tulosteet = self._siirtymat, self._vika, self._tulosteet
+        aakkosto = self.aakkosto
+        loydetyt = set()
+        tila = 0
+        for merkki in teksti.lower():
+            if merkki not in aakkosto:
+                tila = 0
+                continue
+            while tila and merkki not in siirtymat[tila]:
+                tila = vika[tila]
+            tila = siirtymat[tila].get(merkki, 0)
+            if tulosteet[tila]:
+                loydetyt.update(tulosteet[tila])
+        return loydetyt
+
+
+def etsi_osioittain(hakukomennot, tekstit):
+    """
+    Hakee kaikkien osioiden avainsanat yhdellä korpuksen läpikäynnillä.
+    Palauttaa {osio: {jae_id: set(osuneet avainsanat)}}, jolloin jokaiselle
+    jakeelle tiedetään, mikä avainsana sen toi mukaan. Kyselyt ja
+    säännölliset lausekkeet ('re:...') eivät ole kirjaimellisia
+    merkkijonoja, joten ne ohitetaan (ks. logic.etsi_jae_idt).
+    """
+    sanan_osiot = {}
+    for osio, avainsanat in hakukomennot.items():
+        for sana in avainsanat:
+            if on_regex(sana) or on_kysely(sana):
+                continue
+            sanan_osiot.setdefault(sana, []).append(osio)
+    automaatti = AhoCorasick(sanan_osiot)
+    tulos = {osio: {} for osio in hakukomennot}
+    for jae_id, teksti in enumerate(tekstit):
+        for sana in automaatti.loyda(teksti):
+            for osio in sanan_osiot[sana]:
+                tulos[osio].setdefault(jae_id, set()).add(sana)
+    return tulos
@@ -0,0 +1,185 @@
+# positional_index.py
+import bisect
+import re
+from array import array
+
+from word_index import tokenisoi
+
+# Kyselyn osat: fraasi, sulut, operaattorit ja yksittäiset termit.
+# Operaattorit kirjoitetaan isoilla, jotta esim. sana "ja" ei ole operaattori.
+KYSELY_REGEX = re.compile(
+    r'"[^"]*"|\(|\)|\bNEAR/\d+\b|\bAND\b|\bOR\b|[^\s()"]+'
+)
+OPERAATTORI_REGEX = re.compile(r'"|\(|\)|\*|\bNEAR/\d+\b|\bAND\b|\bOR\b')
+TERMI_REGEX = re.compile(r'[\w*]+')
+ETULIITE_MINIMI = 4
+
+
+def on_kysely(avainsana):
+    """
+    Onko avainsana kyselymuotoinen (fraasi, AND/OR, NEAR/k, sulut tai
+    tähti).
+    """
+    return bool(OPERAATTORI_REGEX.search(avainsana))
+
+
+def kyselyn_termit(avainsana):
+    """Palauttaa kyselyn tavalliset hakutermit ilman operaattoreita."""
+    termit = []
+    for osa in KYSELY_REGEX.findall(avainsana):
+        if osa in ("(", ")", "AND", "OR") or osa.startswith("NEAR/"):
+            continue
+        termit.extend(tokenisoi(osa))
+    return termit
+
+
+class PositionalIndex:
+    """
+    Sijainnit tallentava käänteisindeksi: sana -> (jae-id:t, sanan
+    järjestysnumerot jakeessa) rinnakkaisina taulukoina. Mahdollistaa
+    fraasi- ja läheisyyshaut (NEAR/k) sekä AND/OR-yhdistelmät.
+
+    Termi osuu sanoihin, jotka alkavat termillä (vähintään neljä merkkiä),
+    jolloin "terve oppi" löytää myös muodon "tervettä oppia". Tähti
+    lopussa ('armo*') pakottaa etuliitehaun lyhyellekin termille.
+    """
+
+    def __init__(self, jaevarasto):
+        self.jaevarasto = jaevarasto
+        sijainnit = {}
+        for jae_id, teksti in enumerate(jaevarasto.tekstit):
+            for kohta, sana in enumerate(tokenisoi(teksti)):
+                pari = sijainnit.get(sana)
+                if pari is None:
+                    pari = sijainnit[sana] = (array('I'), array('H'))
+                pari[0].append(jae_id)
+                pari[1].append(min(kohta, 65535))
+        self._sijainnit = sijainnit
+        self._sanasto = sorted(sijainnit)
+
+    def _sanat(self, termi):
+        if termi.endswith("*"):
+            etuliite, pakota = termi[:-1], True
+        else:
+            etuliite, pakota = termi, False
+        etuliite = etuliite.lower()
+        if not pakota and len(etuliite) < ETULIITE_MINIMI:
+            return [etuliite] if etuliite in self._sijainnit else []
+        alku = bisect.bisect_left(self._sanasto, etuliite)
+        loppu = bisect.bisect_left(self._sanasto, etuliite + "\uffff")
+        return self._sanasto[alku:loppu]
+
+    def termi(self, termi):
+        """Palauttaa {jae_id: [(alku, loppu), ...]} termin osumille."""
+        osumat = {}
+        for sana in self._sanat(termi):
+            jakeet, kohdat = self._sijainnit[sana]
+            for jae_id, kohta in zip(jakeet, kohdat):
+                osumat.setdefault(jae_id, []).append((kohta, kohta + 1))
+        for valit in osumat.values():
+            valit.sort()
+        return osumat
+
+    def fraasi(self, termit):
+        """Termit peräkkäin samassa jakeessa."""
+        tulos = self.termi(termit[0])
+        for termi in termit[1:]:
+            seuraava = self.termi(termi)
+            uusi = {}
+            for jae_id in tulos.keys() & seuraava.keys():
+                alut = {alku for alku, _ in seuraava[jae_id]}
+                valit = [(a, l + 1) for a, l in tulos[jae_id] if l in alut]
+                if valit:
+                    uusi[jae_id] = valit
+            tulos = uusi
+        return tulos
+
+    @staticmethod
+    def lahella(vasen, oikea, k):
+        """Osumat, joiden välissä on enintään k sanaa (kumpi tahansa ensin)."""
+        tulos = {}
+        for jae_id in vasen.keys() & oikea.keys():
+            valit = [
+                (min(a1, a2), max(l1, l2))
+                for a1, l1 in vasen[jae_id] for a2, l2 in oikea[jae_id]
+                if max(a2 - l1, a1 - l2) <= k
+            ]
+            if valit:
+                tulos[jae_id] = sorted(set(valit))
+        return tulos
+
+    def hae(self, kysely):
+        """
+        Suorittaa kyselyn ja palauttaa jae-id:iden joukon. Tuetut muodot:
+        termi, "fraasi", A NEAR/k B, A AND B (tai pelkkä välilyönti),
+        A OR B ja sulut. Virheellinen kysely aiheuttaa ValueErrorin.
+        """
+        jasennin = _Jasennin(KYSELY_REGEX.findall(kysely), self)
+        tulos = jasennin.tai()
+        if jasennin.kohta != len(jasennin.osat):
+            raise ValueError(f"Odottamaton '{jasennin.osat[jasennin.kohta]}'")
+        return set(tulos)
+
+
+class _Jasennin:
+    """Rekursiivisesti laskeutuva jäsennin; arvioi kyselyn samalla."""
+
+    def __init__(self, osat, indeksi):
+        self.osat = osat
+        self.kohta = 0
+        self.indeksi = indeksi
+
+    def _seuraava(self):
+        return self.osat[self.kohta] if self.kohta < len(self.osat) else None
+
+    def tai(self):
+        tulos = self.ja()
+        while self._seuraava() == "OR":
+            self.kohta += 1
+            oikea = self.ja()
+            if isinstance(tulos, dict) and isinstance(oikea, dict):
+                yhdistetty = {k: list(v) for k, v in tulos.items()}
+                for jae_id, valit in oikea.items():
+                    yhdistetty[jae_id] = sorted(
+                        set(yhdistetty.get(jae_id, [])) | set(valit)
+                    )
+                tulos = yhdistetty
+            else:
+                tulos = set(tulos) | set(oikea)
+        return tulos
+
+    def ja(self):
+        tulos = self.lahella()
+        while self._seuraava() not in (None, "OR", ")"):
+            if self._seuraava() == "AND":
+                self.kohta += 1
+            tulos = set(tulos) & set(self.lahella())
+        return tulos
+
+    def lahella(self):
+        tulos = self.perus()
+        while (self._seuraava() or "").startswith("NEAR/"):
+            k = int(self.osat[self.kohta][5:])
+            self.kohta += 1
+            oikea = self.perus()
+            if not (isinstance(tulos, dict) and isinstance(oikea, dict)):
+                raise ValueError("NEAR vaatii molemmille puolille termin tai fraasin")
+            tulos = PositionalIndex.lahella(tulos, oikea, k)
+        return tulos
+
+    def perus(self):
+        osa = self._seuraava()
+        if osa is None or osa in (")", "AND", "OR") or osa.startswith("NEAR/"):
+            raise ValueError(f"Kysely päättyi odottamatta kohdassa '{osa}'")
+        self.kohta += 1
+        if osa == "(":
+            tulos = self.tai()
+            if self._seuraava() != ")":
+                raise ValueError("Sulkeva sulku puuttuu")
+            self.kohta += 1
+            return tulos
+        # Fraasi tai yksittäinen termi (välimerkit ohitetaan)
+        termit = TERMI_REGEX.findall(osa)
+        if not termit:
+            raise ValueError(f"Tyhjä termi tai fraasi '{osa}'")
+        return self.indeksi.fraasi(termit)
@@ -0,0 +1,66 @@
+# prompt_codec.py
+import re
+
+TUNNUS_ETULIITE = "v"
+# Hyväksyy mallin tavalliset muunnelmat "v17", "V17", "[v17]" ja "v17:".
+# Etuliite ja koko avain vaaditaan, jotta kaikuvat viitteet ("1. Moos.
+# 1:3", "3:16") eivät osu väärään kohteeseen vaan lasketaan tuntemattomiksi.
+_TUNNUS_REGEX = re.compile(r'^\W*v(\d+)\W*$', re.IGNORECASE)
+
+
+class PromptCodec:
+    """
+    Kehotekohtaiset lyhyet tunnukset (v1, v2, ...) jakeille tai muille
+    kohteille. Kehotteeseen kirjoitetaan tunnus ja tiivis sisältö, malli
+    vastaa tunnuksilla, ja pura() palauttaa tunnusta vastaavan kohteen
+    täsmälleen, ilman viitteiden tulkintaa.
+    """
+
+    def __init__(self, kohteet):
+        self.kohteet = list(kohteet)
+        self._tunnukset = {
+            kohde: f"{TUNNUS_ETULIITE}{i}"
+            for i, kohde in enumerate(self.kohteet, start=1)
+        }
+        self.tuntemattomat = 0
+
+    def __len__(self):
+        return len(self.kohteet)
+
+    def tunnus(self, kohde):
+        return self._tunnukset[kohde]
+
+    def rivit(self, muotoilija):
+        """Kehotteen rivit muodossa '<tunnus> <muotoilija(kohde)>'."""
+        return [
+            f"{self._tunnukset[kohde]} {muotoilija(kohde)}"
+            for kohde in self.kohteet
+        ]
+
+    def on_tunnus(self, avain):
+        """Onko avain tämän kehotteen tunnus (ei kasvata laskuria)."""
+        osuma = _TUNNUS_REGEX.match(str(avain))
+        return bool(osuma) and 1 <= int(osuma.group(1)) <= len(self.kohteet)
+
+    def pura(self, avain, laske=True):
+        """
+        Palauttaa tunnusta vastaavan kohteen tai None, jos avain ei ole
+        tämän kehotteen tunnus. Tuntemattomat lasketaan (laske=True).
+        """
+        osuma = _TUNNUS_REGEX.match(str(avain))
+        if osuma:
+            numero = int(osuma.group(1))
+            if 1 <= numero <= len(self.kohteet):
+                return self.kohteet[numero - 1]
+        if laske:
+            self.tuntemattomat += 1
+        return None
+
+    def pura_avaimet(self, vastaus):
+        """Muuntaa tunnuksilla avainnetun sanakirjan {kohde: arvo}-muotoon."""
+        tulos = {}
+        for avain, arvo in vastaus.items():
+            kohde = self.pura(avain)
+            if kohde is not None:
+                tulos[kohde] = arvo
+        return tulos
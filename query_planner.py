@@ -0,0 +1,137 @@
+# query_planner.py
+import json
+import os
+
+from corpus_buffer import on_regex
+from positional_index import kyselyn_termit, on_kysely
+from word_index import tokenisoi
+
+SANATILASTOT_POLKU = os.environ.get(
+    "RAAMATTU_SANATILASTOT", "bible_word_stats.json"
+)
+# Avainsana on "laaja", jos se osuu yli tähän osuuteen jakeista, ja se
+# pudotetaan, jos osuus ylittää pudotusrajan ja osiossa on muita sanoja.
+LAAJA_OSUUS = 0.02
+PUDOTUS_OSUUS = 0.08
+
+
+def lataa_sanatilastot(polku=SANATILASTOT_POLKU):
+    """
+    Lukee create_dictionary.py:n kirjoittamat sanatilastot
+    ({"jakeita": N, "sanat": {sana: [jakeita, esiintymiä]}}) tai palauttaa
+    None, jos tiedostoa ei ole.
+    """
+    try:
+        with open(polku, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"VAROITUS: Sanatilastoja ei voitu lukea ({polku}): {e}")
+        return None
+
+
+class QueryPlanner:
+    """
+    Arvioi avainsanojen osumamäärät ennen hakua sanakohtaisista
+    jaefrekvensseistä. Tilastot luetaan sanatilastotiedostosta; jos sitä ei
+    ole tai se on eri korpuksesta, frekvenssit otetaan sanaindeksistä.
+    """
+
+    def __init__(self, sanaindeksi, tilastot=None):
+        self.sanaindeksi = sanaindeksi
+        self.jakeita = len(sanaindeksi)
+        self._frekvenssit = None
+        if tilastot and tilastot.get("jakeita") == self.jakeita:
+            self._frekvenssit = {
+                sana: arvot[0] for sana, arvot in tilastot["sanat"].items()
+            }
+        elif tilastot:
+            print("VAROITUS: Sanatilastot ovat eri korpuksesta; "
+                  "käytetään sanaindeksiä.")
+
+    def frekvenssi(self, sana):
+        """Montako jaetta sisältää sanan sellaisenaan."""
+        if self._frekvenssit is not None:
+            return self._frekvenssit.get(sana, 0)
+        postings = self.sanaindeksi.postings
+        return len(postings[sana]) if sana in postings else 0
+
+    def _termin_arvio(self, termi):
+        # Osamerkkijonohaku osuu kaikkiin sanoihin, joissa termi esiintyy;
+        # summa on yläraja jakeiden määrälle
+        return min(self.jakeita, sum(
+            self.frekvenssi(sana)
+            for sana in self.sanaindeksi.sanat_joissa(termi)
+        ))
+
+    def arvioi(self, avainsana):
+        """
+        Arvioi avainsanan osumien (jakeiden) määrän. Palauttaa None, jos
+        arviota ei voi tehdä (säännölliset lausekkeet).
+        """
+        if on_regex(avainsana):
+            return None
+        if on_kysely(avainsana):
+            termit = kyselyn_termit(avainsana)
+        else:
+            termit = tokenisoi(avainsana)
+        if not termit:
+            return None
+        arviot = [self._termin_arvio(termi) for termi in termit]
+        if on_kysely(avainsana) and " OR " in avainsana:
+            return min(self.jakeita, sum(arviot))
+        # Kaikkien osien täytyy osua: harvinaisin osa rajaa tuloksen
+        return min(arviot)
+
+    def suunnittele(self, hakukomennot, budjetti=None):
+        """
+        Palauttaa osioittain {osio: {"arviot": [(avainsana, arvio, tila)],
+        "pudotetut": [...], "yhteensa": arvio, "yli_budjetin": bool}}.
+        Tila on "ok", "laaja" (varoitus) tai "pudotettu". Avainsanat
+        järjestetään valikoivimmasta laajimpaan. Pudotukset tehdään
+        laajimmasta alkaen, joten osioon jää aina vähintään sen
+        valikoivin avainsana.
+        """
+        suunnitelma = {}
+        for osio, avainsanat in hakukomennot.items():
+            arviot = [(sana, self.arvioi(sana)) for sana in avainsanat]
+            arviot.sort(key=lambda p: (p[1] is None, p[1] or 0))
+            pudotetut = []
+            for sana, arvio in reversed(arviot):
+                osuus = (arvio or 0) / max(self.jakeita, 1)
+                if osuus > PUDOTUS_OSUUS and len(arviot) - len(pudotetut) > 1:
+                    pudotetut.append(sana)
+            pudotetut.reverse()
+            rivit = []
+            for sana, arvio in arviot:
+                osuus = (arvio or 0) / max(self.jakeita, 1)
+                if sana in pudotetut:
+                    tila = "pudotettu"
+                elif osuus > LAAJA_OSUUS:
+                    tila = "laaja"
+                else:
+                    tila = "ok"
+                rivit.append((sana, arvio, tila))
+            yhteensa = min(self.jakeita, sum(
+                arvio for sana, arvio, tila in rivit
+                if arvio is not None and tila != "pudotettu"
+            ))
+            suunnitelma[osio] = {
+                "arviot": rivit,
+                "pudotetut": pudotetut,
+                "yhteensa": yhteensa,
+                "yli_budjetin": bool(budjetti) and yhteensa > budjetti,
+            }
+        return suunnitelma
+
+    @staticmethod
+    def sovella(hakukomennot, suunnitelma):
+        """Palauttaa hakukomennot ilman pudotettuja avainsanoja."""
+        return {
+            osio: [
+                sana for sana in avainsanat
+                if sana not in suunnitelma.get(osio, {}).get("pudotetut", ())
+            ]
+            for osio, avainsanat in hakukomennot.items()
+        }
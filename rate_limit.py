@@ -0,0 +1,329 @@
+# rate_limit.py
+import os
+import sqlite3
+import threading
+import time
+
+_SKEEMA = """
+CREATE TABLE IF NOT EXISTS amparit (
+    avain TEXT PRIMARY KEY,
+    pyynnot REAL NOT NULL,
+    tokenit REAL NOT NULL,
+    paivitetty REAL NOT NULL
+);
+"""
+
+
+def _taytetyt(kapasiteetit, tasot, kulunut):
+    """Palauttaa tasot, kun ämpäreitä on täytetty `kulunut` sekuntia."""
+    return [
+        min(kapasiteetti, taso + kulunut * kapasiteetti / 60)
+        if kapasiteetti else taso
+        for kapasiteetti, taso in zip(kapasiteetit, tasot)
+    ]
+
+
+def _odotus(kapasiteetit, tasot, tarve):
+    """Montako sekuntia on odotettava, ennen kuin tarve mahtuu ämpäreihin."""
+    odotus = 0.0
+    for kapasiteetti, taso, maara in zip(kapasiteetit, tasot, tarve):
+        if kapasiteetti and taso < maara:
+            odotus = max(odotus, (maara - taso) * 60 / kapasiteetti)
+    return odotus
+
+
+def _tarve(kapasiteetit, tokenit):
+    # Kapasiteettia suurempi pyyntö odottaa täyttä ämpäriä
+    return [
+        min(maara, kapasiteetti) for maara, kapasiteetti
+        in zip((1.0, float(tokenit)), kapasiteetit)
+    ]
+
+
+class TokenBucketLimiter:
+    """
+    Säiepohjainen token bucket -rajoitin, joka rajoittaa sekä pyyntöjä
+    että tokeneita minuutissa. Raja None tai 0 tarkoittaa rajoittamatonta.
+    """
+
+    def __init__(self, pyynnot_minuutissa=None, tokenit_minuutissa=None):
+        self._lukko = threading.Lock()
+        self._kapasiteetit = (
+            float(pyynnot_minuutissa or 0), float(tokenit_minuutissa or 0)
+        )
+        self._tasot = list(self._kapasiteetit)
+        self._paivitetty = time.monotonic()
+
+    def _tayta(self):
+        nyt = time.monotonic()
+        self._tasot = _taytetyt(
+            self._kapasiteetit, self._tasot, nyt - self._paivitetty
+        )
+        self._paivitetty = nyt
+
+    def odota(self, tokenit=0):
+        """
+        Odottaa, kunnes yksi pyyntö ja `tokenit` tokenia mahtuvat rajoihin,
+        ja varaa ne. Palauttaa odotukseen kuluneen ajan sekunteina.
+        """
+        alku = time.monotonic()
+        tarve = _tarve(self._kapasiteetit, tokenit)
+        while True:
+            with self._lukko:
+                self._tayta()
+                odotus = _odotus(self._kapasiteetit, self._tasot, tarve)
+                if odotus == 0.0:
+                    for i, kapasiteetti in enumerate(self._kapasiteetit):
+                        if kapasiteetti:
+                            self._tasot[i] -= tarve[i]
+                    return time.monotonic() - alku
+            time.sleep(odotus)
+
+    def hyvita(self, tokenit):
+        """Korjaa varausta, kun toteutunut tokenmäärä tiedetään."""
+        if not self._kapasiteetit[1]:
+            return
+        with self._lukko:
+            self._tayta()
+            self._tasot[1] = min(
+                self._kapasiteetit[1], self._tasot[1] + tokenit
+            )
+
+    def tauota(self, sekunnit):
+        """Tyhjentää pyyntöämpärin niin, että seuraava pyyntö odottaa."""
+        if not self._kapasiteetit[0]:
+            return
+        with self._lukko:
+            self._tayta()
+            self._tasot[0] = min(
+                self._tasot[0], 1.0 - sekunnit * self._kapasiteetit[0] / 60
+            )
+
+
+class SharedTokenBucketLimiter:
+    """
+    Token bucket, jonka tila on SQLite-tiedostossa, jolloin saman koneen
+    kaikki Streamlit-prosessit ja diagnostiikka-ajot jakavat API-avaimen
+    kiintiön. Varaus tehdään BEGIN IMMEDIATE -transaktiossa; odotus
+    tapahtuu lukon ulkopuolella. Jos tiedostoa ei voi käyttää, rajoitin
+    jatkaa prosessikohtaisena.
+    """
+
+    def __init__(self, polku, avain, pyynnot_minuutissa=None,
+                 tokenit_minuutissa=None):
+        self.polku = polku
+        self.avain = avain
+        self._kapasiteetit = (
+            float(pyynnot_minuutissa or 0), float(tokenit_minuutissa or 0)
+        )
+        self._paikallinen = threading.local()
+        self._varalla = None
+        try:
+            os.makedirs(os.path.dirname(polku) or ".", exist_ok=True)
+            self._yhteys().executescript(_SKEEMA)
+        except (OSError, sqlite3.Error) as e:
+            self._siirry_varalle(e)
+
+    def _siirry_varalle(self, virhe):
+        print(
+            f"VAROITUS: Jaettu nopeusrajoitin ei käytettävissä ({virhe}); "
+            f"käytetään prosessikohtaista."
+        )
+        self._varalla = TokenBucketLimiter(*self._kapasiteetit)
+
+    def _yhteys(self):
+        yhteys = getattr(self._paikallinen, "yhteys", None)
+        if yhteys is None:
+            yhteys = sqlite3.connect(
+                self.polku, timeout=30, isolation_level=None
+            )
+            yhteys.execute("PRAGMA journal_mode=WAL")
+            self._paikallinen.yhteys = yhteys
+        return yhteys
+
+    def _muokkaa(self, muutos):
+        """
+        Lukee ämpärin tilan, täyttää sen kuluneella ajalla ja tallentaa
+        muutos(tasot) -> tulos -funktion muokkaamat tasot atomisesti.
+        """
+        yhteys = self._yhteys()
+        yhteys.execute("BEGIN IMMEDIATE")
+        try:
+            nyt = time.time()
+            rivi = yhteys.execute(
+                "SELECT pyynnot, tokenit, paivitetty FROM amparit "
+                "WHERE avain = ?", (self.avain,)
+            ).fetchone()
+            if rivi is None:
+                tasot = list(self._kapasiteetit)
+            else:
+                tasot = _taytetyt(
+                    self._kapasiteetit, [rivi[0], rivi[1]],
+                    max(0.0, nyt - rivi[2])
+                )
+            tulos = muutos(tasot)
+            yhteys.execute(
+                "INSERT OR REPLACE INTO amparit "
+                "(avain, pyynnot, tokenit, paivitetty) VALUES (?, ?, ?, ?)",
+                (self.avain, tasot[0], tasot[1], nyt)
+            )
+            yhteys.execute("COMMIT")
+        except BaseException:
+            yhteys.execute("ROLLBACK")
+            raise
+        return tulos
+
+    def odota(self, tokenit=0):
+        """Kuten TokenBucketLimiter.odota, mutta prosessien yhteisellä tilalla."""
+        if self._varalla:
+            return self._varalla.odota(tokenit)
+        alku = time.monotonic()
+        tarve = _tarve(self._kapasiteetit, tokenit)
+
+        def varaa(tasot):
+            odotus = _odotus(self._kapasiteetit, tasot, tarve)
+            if odotus == 0.0:
+                for i, kapasiteetti in enumerate(self._kapasiteetit):
+                    if kapasiteetti:
+                        tasot[i] -= tarve[i]
+            return odotus
+
+        while True:
+            try:
+                odotus = self._muokkaa(varaa)
+            except sqlite3.Error as e:
+                self._siirry_varalle(e)
+                return self._varalla.odota(tokenit)
+            if odotus == 0.0:
+                return time.monotonic() - alku
+            time.sleep(odotus)
+
+    def hyvita(self, tokenit):
+        """Korjaa varausta, kun toteutunut tokenmäärä tiedetään."""
+        if self._varalla:
+            return self._varalla.hyvita(tokenit)
+        if not self._kapasiteetit[1]:
+            return
+
+        def lisaa(tasot):
+            tasot[1] = min(self._kapasiteetit[1], tasot[1] + tokenit)
+
+        try:
+            self._muokkaa(lisaa)
+        except sqlite3.Error as e:
+            print(f"VAROITUS: Rajoittimen hyvitys epäonnistui: {e}")
+
+    def tauota(self, sekunnit):
+        """Pysäyttää kaikkien prosessien pyynnöt `sekunnit` ajaksi."""
+        if self._varalla:
+            return self._varalla.tauota(sekunnit)
+        if not self._kapasiteetit[0]:
+            return
+
+        def tyhjenna(tasot):
+            tasot[0] = min(
+                tasot[0], 1.0 - sekunnit * self._kapasiteetit[0] / 60
+            )
+
+        try:
+            self._muokkaa(tyhjenna)
+        except sqlite3.Error as e:
+            print(f"VAROITUS: Rajoittimen tauotus epäonnistui: {e}")
+
+
+class _Lento:
+    def __init__(self):
+        self.valmis = threading.Event()
+        self.tulos = None
+        self.virhe = None
+
+
+class SingleFlight:
+    """
+    Yhdistää samanaikaiset identtiset kutsut: ensimmäinen avaimen kutsuja
+    suorittaa funktion, ja muut saman avaimen kutsujat odottavat ja saavat
+    saman tuloksen. Valmistuneita tuloksia ei säilytetä (ks. LLMCache).
+    """
+
+    def __init__(self):
+        self._lukko = threading.Lock()
+        self._kesken = {}
+        self.yhdistetyt = 0
+
+    def suorita(self, avain, funktio):
+        """
+        Palauttaa (tulos, oma), missä oma on False, jos tulos saatiin
+        toisen säikeen jo käynnissä olleesta kutsusta.
+        """
+        with self._lukko:
+            lento = self._kesken.get(avain)
+            oma = lento is None
+            if oma:
+                lento = self._kesken[avain] = _Lento()
+            else:
+                self.yhdistetyt += 1
+        if not oma:
+            lento.valmis.wait()
+            if lento.virhe is not None:
+                raise lento.virhe
+            return lento.tulos, False
+        try:
+            lento.tulos = funktio()
+        except BaseException as e:
+            lento.virhe = e
+            raise
+        finally:
+            with self._lukko:
+                del self._kesken[avain]
+            lento.valmis.set()
+        return lento.tulos, True
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD-säädetty rinnakkaisuusraja: jokainen onnistunut kutsu kasvattaa
+    rajaa 1/raja:lla (noin +1 per täysi kierros), ja ylikuormitus (429)
+    puolittaa sen. Saman purskeen 429-virheet puolittavat rajan vain kerran
+    (viilennysaika).
+    """
+
+    def __init__(self, alku, minimi=1, maksimi=None, kerroin=0.5,
+                 viilennys=5.0):
+        self._ehto = threading.Condition()
+        self.maksimi = float(maksimi or alku)
+        self.minimi = float(minimi)
+        self.raja = min(self.maksimi, max(self.minimi, float(alku)))
+        self.kerroin = kerroin
+        self.viilennys = viilennys
+        self._aktiiviset = 0
+        self._vahennetty = float("-inf")
+        self.vahennyksia = 0
+
+    def __enter__(self):
+        with self._ehto:
+            while self._aktiiviset >= int(self.raja):
+                self._ehto.wait()
+            self._aktiiviset += 1
+        return self
+
+    def __exit__(self, *virhe):
+        with self._ehto:
+            self._aktiiviset -= 1
+            self._ehto.notify()
+        return False
+
+    def onnistui(self):
+        with self._ehto:
+            vanha = int(self.raja)
+            self.raja = min(self.maksimi, self.raja + 1.0 / self.raja)
+            if int(self.raja) > vanha:
+                self._ehto.notify()
+
+    def ylikuormitus(self):
+        with self._ehto:
+            nyt = time.monotonic()
+            if nyt - self._vahennetty < self.viilennys:
+                return
+            self._vahennetty = nyt
+            self.raja = max(self.minimi, self.raja * self.kerroin)
+            self.vahennyksia += 1
@@ -3,18 +3,22 @@ import os
 import logging
 import time
 import json
-import re
-from collections import defaultdict
+from collections import Counter
 from dotenv import load_dotenv
 import google.generativeai as genai
 
+from fuzzy_match import SymSpell
+from keyword_expansion import PrefixExpander
 from logic import (
-    lataa_raamattu, luo_kanoninen_avain, luo_hakusuunnitelma,
-    validoi_avainsanat_ai, etsi_mekaanisesti, suodata_semanttisesti,
-    pisteyta_ja_jarjestele
+    llm_valimuisti, lataa_raamattu, luo_hakusuunnitelma, validoi_avainsanat,
+    korjaa_avainsanat, keraa_jakeet, pisteyta_ja_jarjestele,
+    yhteiset_kutsut, KANDIDAATTIBUDJETTI, etsi_jae_idt, on_erikoishaku
 )
+from multi_pattern import etsi_osioittain
+from query_planner import QueryPlanner, lataa_sanatilastot
 
 LOG_FILENAME = 'full_diagnostics_report_v2.5.txt'
+PISTEYTYS_SYOTE = 'pisteytys_syote.json'
 if os.path.exists(LOG_FILENAME):
     os.remove(LOG_FILENAME)
 logging.basicConfig(
@@ -61,58 +65,6 @@ def laske_kustannus_arvio(token_counts):
     return f"~${total_cost:.4f} (Groq + Gemini)"
 
 
-def onko_sana_hyvaksyttava(sana, sanakirja):
-    """
-    Tarkistaa, onko sana tai sen osa raamatullinen.
-    Sallii moniosaiset termit, jos yksikin osa löytyy.
-    """
-    clean_sana = sana.lower().strip()
-    if not clean_sana:
-        return False
-
-    osat = clean_sana.split()
-    for osa in osat:
-        # Poistetaan yleisimmät taivutuspäätteet karkeasti
-        # ja tarkistetaan, josko perusmuoto löytyisi
-        if osa in sanakirja:
-            return True
-        if len(osa) > 6 and osa.endswith(('n', 'ä', 'a')):  # Genetiivi, partitiivi
-            if osa[:-1] in sanakirja:
-                return True
-        if len(osa) > 7 and osa.endswith(('ssa', 'ssä')):  # Inessiivi
-            if osa[:-3] in sanakirja:
-                return True
-        if len(osa) > 7 and osa.endswith(('sta', 'stä')):  # Elatiivi
-            if osa[:-3] in sanakirja:
-                return True
-    return False
-
-
-def hae_jae_viitteella(viite_str, book_data_map, book_name_map_by_id):
-    """Hakee tarkan jakeen tekstin viitteen perusteella."""
-    match = re.match(r'^(.*?)\s+(\d+):(\d+)', viite_str.strip())
-    if not match:
-        return None
-
-    kirja_nimi_str, luku, jae = match.groups()
-
-    # Etsitään oikea kirjan ID nimen perusteella
-    kirja_id = None
-    for b_id, b_name in book_name_map_by_id.items():
-        if b_name.lower() == kirja_nimi_str.lower().strip():
-            kirja_id = b_id
-            break
-
-    if kirja_id:
-        try:
-            oikea_nimi = book_name_map_by_id[kirja_id]
-            jae_teksti = book_data_map[kirja_id]['chapter'][luku]['verse'][jae]['text']
-            return f"{oikea_nimi} {luku}:{jae} - {jae_teksti}"
-        except KeyError:
-            return None
-    return None
-
-
 def run_diagnostics():
     """Suorittaa koko diagnostiikka-ajon."""
     total_start_time = time.perf_counter()
@@ -123,8 +75,7 @@ def run_diagnostics():
     if not raamattu_resurssit:
         return
     (
-        _, _, book_name_map_by_id, book_data_map, _,
-        book_name_to_id_map, raamattu_sanakirja
+        _, _, _, _, _, _, raamattu_sanakirja, jaevarasto, sanaindeksi
     ) = raamattu_resurssit
 
     try:
@@ -150,15 +101,53 @@ def run_diagnostics():
     logging.info("--- Alkuperäinen hakusuunnitelma ---")
     logging.info(json.dumps(suunnitelma, indent=2, ensure_ascii=False))
 
-    # Vaihe 1.5: Älykäs avainsanojen validointi tekoälyllä
-    logging.info("\n--- Avainsanojen validointi tekoälyllä (Groq) ---")
+    # Sumea korjaus avainsanoille, joita ei löydy korpuksesta; SymSpell
+    # rakennetaan vain, jos sitä tarvitaan
+    postings = sanaindeksi.postings
+    laajentaja = PrefixExpander(raamattu_sanakirja, sanaindeksi)
+    suunnitelma["hakukomennot"], korvaukset = korjaa_avainsanat(
+        suunnitelma["hakukomennot"], sanaindeksi,
+        lambda: SymSpell(
+            raamattu_sanakirja,
+            frekvenssi=lambda sana: (
+                len(postings[sana]) if sana in postings else 0
+            )
+        ),
+        laajentaja=laajentaja
+    )
+    logging.info("\n--- Avainsanojen sumea korjaus ---")
+    for osio, sana, korvaavat in korvaukset:
+        logging.info(f"Osio {osio}: {sana} -> {', '.join(korvaavat)}")
+    if not korvaukset:
+        logging.info("Kaikki avainsanat löytyivät korpuksesta.")
+
+    # Hakusuunnittelija: osumamääräarviot ja liian laajojen sanojen pudotus
+    logging.info("\n--- Avainsanojen osumamääräarviot ---")
+    arviot = QueryPlanner(sanaindeksi, lataa_sanatilastot()).suunnittele(
+        suunnitelma["hakukomennot"], KANDIDAATTIBUDJETTI
+    )
+    for osio, arvio in arviot.items():
+        logging.info(
+            f"Osio {osio} (~{arvio['yhteensa']} jaetta"
+            f"{', yli budjetin' if arvio['yli_budjetin'] else ''}): "
+            + ", ".join(
+                f"{sana} ~{maara} [{tila}]"
+                for sana, maara, tila in arvio["arviot"]
+            )
+        )
+    suunnitelma["hakukomennot"] = QueryPlanner.sovella(
+        suunnitelma["hakukomennot"], arviot
+    )
+
+    # Vaihe 1.5: Avainsanojen validointi sanakirjalla, epäselvät tekoälyllä
+    logging.info("\n--- Avainsanojen validointi (sanakirja + Groq) ---")
     start_time_val = time.perf_counter()
     kaikki_avainsanat = list(set(
         sana for avainsanalista in suunnitelma["hakukomennot"].values()
         for sana in avainsanalista
     ))
-    hyvaksytyt_sanat_setti = validoi_avainsanat_ai(
-        kaikki_avainsanat, paivita_token_laskuri
+    hyvaksytyt_sanat_setti = validoi_avainsanat(
+        kaikki_avainsanat, raamattu_sanakirja, paivita_token_laskuri
     )
 
     puhdistetut_komennot = {}
@@ -179,69 +168,29 @@ def run_diagnostics():
 
     log_header("VAIHE 2: JAKEIDEN KERÄYS (ESIHAKU + ÄLYKÄS VALINTA)")
     start_time = time.perf_counter()
-    osio_kohtaiset_jakeet = defaultdict(set)
     hakukomennot = suunnitelma["hakukomennot"]
 
-    for i, (osio_nro, avainsanat) in enumerate(hakukomennot.items()):
-        teema_match = re.search(
-            r"^{}\.?\s*(.*)".format(re.escape(osio_nro.strip('.'))),
-            suunnitelma["vahvistettu_sisallysluettelo"], re.MULTILINE
-        )
-        teema = teema_match.group(1).strip() if teema_match else ""
-        if not teema or not avainsanat:
-            continue
-
-        logging.info(
-            f"\n  ({i+1}/{len(hakukomennot)}) Käsitellään osiota {osio_nro}: "
-            f"{teema}..."
-        )
-        kandidaatit = etsi_mekaanisesti(
-            avainsanat, book_data_map, book_name_map_by_id
-        )
-        logging.info(f"    - Löytyi {len(kandidaatit)} kandidaattijaetta.")
-
-        if kandidaatit:
-            valinnat, (usage, prompt, resp) = suodata_semanttisesti(
-                kandidaatit, teema
+    def osio_logger(osio_nro, teema, kandidaatteja, valinnat, debug):
+        logging.info(f"\n  Osio {osio_nro}: {teema}")
+        logging.info(f"    - Löytyi {kandidaatteja} kandidaattijaetta.")
+        if valinnat is None:
+            return
+        logging.info(f"    - AI valitsi {len(valinnat)} jaeviitettä.")
+        if len(valinnat) < 5 and kandidaatteja > 0:
+            logging.warning(
+                "    - Vähän tuloksia. Debug-loki:"
+            )
+            prompt, resp = debug
+            logging.info(
+                f"      PROMPT:\n{prompt}\n      VASTAUS:\n{resp}"
             )
-            paivita_token_laskuri(usage)
-            logging.info(f"    - AI valitsi {len(valinnat)} jaeviitettä.")
-            if len(valinnat) < 5 and len(kandidaatit) > 0:
-                logging.warning(
-                    "    - Vähän tuloksia. Debug-loki:"
-                )
-                logging.info(
-                    f"      PROMPT:\n{prompt}\n      VASTAUS:\n{resp}"
-                )
-
-            for valinta in valinnat:
-                if not isinstance(valinta, dict):
-                    continue
-                viite_str = valinta.get("viite")
-                laajenna = valinta.get("laajenna_kontekstia", False)
 
-                if not viite_str:
-                    continue
-                jae = hae_jae_viitteella(
-                    viite_str, book_data_map, book_name_map_by_id
-                )
-                if jae:
-                    osio_kohtaiset_jakeet[osio_nro].add(jae)
-                    if laajenna:
-                        match = re.match(r'^(.*?)\s+(\d+):(\d+)', jae)
-                        if not match:
-                            continue
-                        b_name, ch, v_num = match.groups()
-                        for j in range(1, 3):
-                            seuraava_jae = hae_jae_viitteella(
-                                f"{b_name} {ch}:{int(v_num) + j}",
-                                book_data_map, book_name_map_by_id
-                            )
-                            if seuraava_jae:
-                                osio_kohtaiset_jakeet[osio_nro].add(
-                                    seuraava_jae
-                                )
-        time.sleep(1.5)
+    osio_kohtaiset_jakeet = keraa_jakeet(
+        hakukomennot, suunnitelma["vahvistettu_sisallysluettelo"],
+        jaevarasto, sanaindeksi, True, paivita_token_laskuri,
+        osio_callback=osio_logger,
+        laajentaja=laajentaja
+    )
 
     kaikki_jakeet = set().union(*osio_kohtaiset_jakeet.values())
     logging.info(
@@ -250,22 +199,91 @@ def run_diagnostics():
     )
     logging.info(f"Kerättyjä uniikkeja jakeita: {len(kaikki_jakeet)} kpl.")
 
+    # Selitettävyys: mikä avainsana toi kunkin osion kandidaatit
+    logging.info("\n--- Avainsanojen osumat osioittain (yksi läpikäynti) ---")
+    for osio, osumat in etsi_osioittain(
+        hakukomennot, jaevarasto.tekstit
+    ).items():
+        laskurit = Counter(s for sanat in osumat.values() for s in sanat)
+        # Kyselyt ja lausekkeet lasketaan omilla hakimillaan
+        for sana in hakukomennot[osio]:
+            if on_erikoishaku(sana):
+                laskurit[sana] = len(etsi_jae_idt([sana], sanaindeksi))
+        logging.info(f"Osio {osio}: " + ", ".join(
+            f"{sana} ({laskurit[sana]})" for sana in hakukomennot[osio]
+        ))
+
     log_header("VAIHE 3: JAKEIDEN JÄRJESTELY JA PISTEYTYS (GROQ)")
     start_time = time.perf_counter()
     def progress_logger(percent, text):
         logging.info(f"  - Edistyminen: {percent}% - {text}")
 
+    pisteytettavat = {
+        k: [jaevarasto.muotoile(i) for i in sorted(v)]
+        for k, v in osio_kohtaiset_jakeet.items()
+    }
+    # Syöte talteen kaskadipisteytyksen yhtäpitävyystarkistusta varten
+    # (ks. kaskadi_vertailu.py)
+    with open(PISTEYTYS_SYOTE, "w", encoding="utf-8") as f:
+        json.dump({
+            "aihe": pääaihe,
+            "sisallysluettelo": suunnitelma["vahvistettu_sisallysluettelo"],
+            "osio_kohtaiset_jakeet": pisteytettavat,
+        }, f, ensure_ascii=False)
+
+    def kaskadi_logger(tilastot):
+        saasto = tilastot["saasto_arvio"]
+        logging.info(
+            f"\nKASKADIPISTEYTYS:\n"
+            f"  - Eskaloitu POWERFUL_MODELille: {tilastot['eskaloituja']}/"
+            f"{tilastot['jae_osio_pareja']} jae-osio-paria "
+            f"({100 * tilastot['eskalaatioaste']:.1f} %)\n"
+            f"  - Kesto: nopea {tilastot['nopea_kesto']:.1f} s, "
+            f"tarkka {tilastot['tarkka_kesto']:.1f} s\n"
+            f"  - Arvioitu aikasäästö: "
+            + (f"{saasto:.1f} s" if saasto is not None else "ei arvioitavissa")
+        )
+
+    ensimmaiset = {}
+
+    def valitulos_logger(osio_nro, viite, piste):
+        if "piste" not in ensimmaiset:
+            ensimmaiset["piste"] = time.perf_counter() - start_time
+            logging.info(
+                f"  - Ensimmäinen piste virrasta {ensimmaiset['piste']:.2f} s "
+                f"jälkeen ({osio_nro} {viite}: {piste})"
+            )
+
+    def osio_valmis_logger(osio_nro, data):
+        kesto = time.perf_counter() - start_time
+        if "osio" not in ensimmaiset:
+            ensimmaiset["osio"] = kesto
+        logging.info(
+            f"  - Osio {osio_nro} valmis {kesto:.2f} s: "
+            f"{len(data['relevantimmat'])} relevanteinta, "
+            f"{len(data['vahemman_relevantit'])} vähemmän relevanttia"
+        )
+
     jae_kartta = pisteyta_ja_jarjestele(
         pääaihe,
         suunnitelma["vahvistettu_sisallysluettelo"],
-        {k: list(v) for k, v in osio_kohtaiset_jakeet.items()},
+        pisteytettavat,
         paivita_token_laskuri,
-        progress_callback=progress_logger
+        progress_callback=progress_logger,
+        monta_teemaa=True,
+        kaskadi_callback=kaskadi_logger,
+        valitulos_callback=valitulos_logger,
+        osio_valmis_callback=osio_valmis_logger
     )
     logging.info(
         f"Järjestely valmis. Aikaa kului: "
         f"{time.perf_counter() - start_time:.2f} sekuntia."
     )
+    if "osio" in ensimmaiset:
+        logging.info(
+            f"Aika ensimmäiseen valmiiseen osioon: "
+            f"{ensimmaiset['osio']:.2f} sekuntia."
+        )
 
     log_header("LOPULLISET TULOKSET")
     total_end_time = time.perf_counter()
@@ -291,6 +309,16 @@ def run_diagnostics():
         f"  - Yhteensä: {TOKEN_COUNT['total']:,} tokenia"
     )
     logging.info(f"  - Kustannusarvio: {laske_kustannus_arvio(TOKEN_COUNT)}")
+    if llm_valimuisti:
+        tilastot = llm_valimuisti.tilastot()
+        logging.info(
+            f"\nVASTAUSVÄLIMUISTI:\n  - Osumat: {tilastot['osumat']}\n"
+            f"  - Ohitukset: {tilastot['ohitukset']}\n"
+            f"  - Säästetyt tokenit: {tilastot['saastetyt_tokenit']:,}"
+        )
+    logging.info(
+        f"  - Yhdistetyt samanaikaiset kutsut: {yhteiset_kutsut.yhdistetyt}"
+    )
 
     log_header("YKSITYISKOHTAINEN JAEJAOTTELU")
     if jae_kartta:
@@ -309,17 +337,13 @@ def run_diagnostics():
                 continue
             if rel:
                 logging.info(f"  --- Relevantimmat ({len(rel)} jaetta) ---")
-                for jae in sorted(
-                    rel, key=lambda j: luo_kanoninen_avain(j, book_name_to_id_map)
-                ):
+                for jae in sorted(rel, key=jaevarasto.jarjestysavain):
                     logging.info(f"    - {jae}")
             if v_rel:
                 logging.info(
                     f"  --- Vähemmän relevantit ({len(v_rel)} jaetta) ---"
                 )
-                for jae in sorted(
-                    v_rel, key=lambda j: luo_kanoninen_avain(j, book_name_to_id_map)
-                ):
+                for jae in sorted(v_rel, key=jaevarasto.jarjestysavain):
                     logging.info(f"    - {jae}")
 
 
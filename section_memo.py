@@ -0,0 +1,95 @@
+# section_memo.py
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+OLETUS_MAX_KOHTEET = 2000
+
+
+def _jsoniksi(arvo):
+    # Joukot järjestetään, jotta sama sisältö antaa aina saman avaimen
+    if isinstance(arvo, (set, frozenset)):
+        return sorted(arvo, key=str)
+    raise TypeError(f"Ei avainnettavissa: {type(arvo).__name__}")
+
+
+class OsioMuisti:
+    """
+    Osiokohtainen muisti putken välituloksille (avainsanojen validointi,
+    jakeiden keräys, pisteytys). Avain lasketaan osion syötteistä, joten
+    kun käyttäjä muokkaa sisällysluetteloa, vain muuttuneet osiot lasketaan
+    uudelleen ja muiden tulokset käytetään sellaisenaan. Muisti on
+    prosessin sisäinen ja rajattu OLETUS_MAX_KOHTEET-määrään (LRU).
+    """
+
+    def __init__(self, max_kohteet=OLETUS_MAX_KOHTEET):
+        self.max_kohteet = max_kohteet
+        self._kohteet = OrderedDict()
+        self._lukko = threading.Lock()
+        self.osumat = 0
+        self.ohitukset = 0
+
+    @staticmethod
+    def avain(*osat):
+        """Laskee osien (merkkijonot, luvut, listat, joukot) tiivisteavaimen."""
+        data = json.dumps(osat, ensure_ascii=False, default=_jsoniksi)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def hae(self, vaihe, avain):
+        """Palauttaa tallennetun arvon tai None."""
+        with self._lukko:
+            arvo = self._kohteet.get((vaihe, avain))
+            if arvo is None:
+                self.ohitukset += 1
+                return None
+            self._kohteet.move_to_end((vaihe, avain))
+            self.osumat += 1
+            return arvo
+
+    def tallenna(self, vaihe, avain, arvo):
+        with self._lukko:
+            self._kohteet[(vaihe, avain)] = arvo
+            self._kohteet.move_to_end((vaihe, avain))
+            while len(self._kohteet) > self.max_kohteet:
+                self._kohteet.popitem(last=False)
+
+    def laske(self, vaihe, avaimet, laskija, valmis_callback=None,
+              tallennettava=None):
+        """
+        Palauttaa ({nimi: arvo}, lasketut) avaimet-sanakirjan {nimi: avain}
+        järjestyksessä. Muistista löytyneet arvot välitetään heti
+        valmis_callback(nimi, arvo):lle, ja loput lasketaan yhdellä
+        laskija(puuttuvat_nimet) -> {nimi: arvo} -kutsulla. Uusi arvo
+        tallennetaan vain, jos tallennettava(arvo) on tosi (oletus: aina);
+        näin esim. API-virheen aiheuttamaa tyhjää tulosta ei muisteta.
+        """
+        tulokset, puuttuvat = {}, []
+        for nimi, avain in avaimet.items():
+            arvo = self.hae(vaihe, avain)
+            if arvo is None:
+                puuttuvat.append(nimi)
+                continue
+            tulokset[nimi] = arvo
+            if valmis_callback:
+                valmis_callback(nimi, arvo)
+        if puuttuvat:
+            uudet = laskija(puuttuvat)
+            for nimi in puuttuvat:
+                if nimi not in uudet:
+                    continue
+                tulokset[nimi] = uudet[nimi]
+                if tallennettava is None or tallennettava(uudet[nimi]):
+                    self.tallenna(vaihe, avaimet[nimi], uudet[nimi])
+        return (
+            {nimi: tulokset[nimi] for nimi in avaimet if nimi in tulokset},
+            puuttuvat
+        )
+
+    def tilastot(self):
+        with self._lukko:
+            return {
+                "kohteet": len(self._kohteet),
+                "osumat": self.osumat,
+                "ohitukset": self.ohitukset,
+            }
@@ -0,0 +1,30 @@
+# tests/conftest.py
+import os
+import sys
+from array import array
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Testit eivät kirjoita käyttäjän välimuisteihin eivätkä kutsu verkkoa
+os.environ.setdefault("RAAMATTU_LLM_CACHE", "0")
+os.environ.setdefault("RAAMATTU_JAETTU_RAJOITIN", "0")
+os.environ.setdefault("RAAMATTU_LLM_TARJOAJA", "stub")
+
+from verse_store import VerseStore  # noqa: E402
+from word_index import WordIndex  # noqa: E402
+
+
+def rakenna_korpus(tekstit, kirjan_nimet=None):
+    """Pieni jaevarasto ja sanaindeksi: kaikki jakeet 1. kirjan 1. luvussa."""
+    maara = len(tekstit)
+    jaevarasto = VerseStore(
+        list(tekstit), array('H', [1] * maara), array('H', [1] * maara),
+        array('H', range(1, maara + 1)), kirjan_nimet or {1: "1. Mooseksen kirja"}
+    )
+    return jaevarasto, WordIndex(jaevarasto)
+
+
+@pytest.fixture
+def korpus():
+    return rakenna_korpus
@@ -0,0 +1,47 @@
+# tests/test_corpus_buffer.py
+from array import array
+
+import pytest
+
+from corpus_buffer import CorpusBuffer
+from verse_store import VerseStore
+
+KIRJAT = {
+    1: "1. Mooseksen kirja", 2: "2. Mooseksen kirja",
+    3: "3. Mooseksen kirja", 4: "4. Mooseksen kirja",
+    5: "5. Mooseksen kirja", 6: "Joosuan kirja",
+    46: "1. Korinttilaisille", 47: "2. Korinttilaisille",
+    48: "Galatalaisille",
+}
+
+
+@pytest.fixture
+def puskuri():
+    # Kaksi jaetta kutakin kirjaa: id:t 0-1 = 1. Moos, 2-3 = 2. Moos, ...
+    kirjat = [kirja for kirja in KIRJAT for _ in range(2)]
+    maara = len(kirjat)
+    jaevarasto = VerseStore(
+        [f"jae {i}" for i in range(maara)], array('H', kirjat),
+        array('H', [1] * maara), array('H', [1, 2] * (maara // 2)), KIRJAT
+    )
+    return CorpusBuffer(jaevarasto)
+
+
+@pytest.mark.parametrize("rajaus", [
+    "1. Moos-5. Moos", "1. Moos - 5. Moos", "1. Moos–5. Moos",
+])
+def test_numerolla_alkavat_kirjavalit(puskuri, rajaus):
+    assert puskuri.rajaus(rajaus) == (0, 10)
+
+
+@pytest.mark.parametrize("rajaus", ["1. Kor-2. Kor", "1. Kor – 2. Kor"])
+def test_korinttilaiskirjeet(puskuri, rajaus):
+    assert puskuri.rajaus(rajaus) == (12, 16)
+
+
+def test_yksi_kirja_ja_tuntematon(puskuri):
+    assert puskuri.rajaus("Joos") == (10, 12)
+    with pytest.raises(ValueError):
+        puskuri.rajaus("1. Moos-2. Moos-3. Moos")
+    with pytest.raises(ValueError):
+        puskuri.rajaus("Tuntematon")
@@ -0,0 +1,50 @@
+# tests/test_kaskadi_vertailu.py
+"""
+Kaskadipisteytyksen yhtäpitävyystarkistus tallenteesta ilman verkkoa.
+
+fixtures/kaskadi_tallenne.json on kirjoitettu kaskadi_vertailu.Tallentajalla
+deterministisestä StubProviderista (FAST_MODEL poikkeaa POWERFUL_MODELista
+osassa pareja), ei oikeista mallivastauksista. Se lukitsee tallennus- ja
+toistomuodon sekä yhtäpitävyysmittarin.
+"""
+import json
+import os
+
+import pytest
+
+import kaskadi_vertailu
+import logic
+
+TALLENNE = os.path.join(
+    os.path.dirname(__file__), "fixtures", "kaskadi_tallenne.json"
+)
+
+
+@pytest.fixture
+def toistaja(monkeypatch):
+    with open(TALLENNE, "r", encoding="utf-8") as f:
+        tallenne = json.load(f)
+    toistaja = kaskadi_vertailu.Toistaja(tallenne["vastaukset"])
+    monkeypatch.setattr(logic, "llm_valimuisti", None)
+    monkeypatch.setattr(logic, "hae_tarjoaja", lambda model_name: toistaja)
+    return tallenne["syote"], toistaja
+
+
+def test_kaskadin_yhtapitavyys_tallenteesta(toistaja):
+    syote, toistaja = toistaja
+    tarkka, _ = kaskadi_vertailu.aja(syote, kaskadi=False)
+    kaskadi, tilastot = kaskadi_vertailu.aja(syote, kaskadi=True)
+    yhtapitavyys = kaskadi_vertailu.vertaa(syote, tarkka, kaskadi, tilastot)
+
+    assert toistaja.puuttuvat == 0
+    assert tilastot["jae_osio_pareja"] == 72
+    assert tilastot["eskaloituja"] == 29
+    assert yhtapitavyys == pytest.approx(69 / 72)
+    assert yhtapitavyys >= kaskadi_vertailu.VAHIMMAISYHTAPITAVYYS
+
+
+def test_puuttuva_vastaus_havaitaan(toistaja):
+    syote, toistaja = toistaja
+    syote = dict(syote, aihe="Toinen aihe")
+    kaskadi_vertailu.aja(syote, kaskadi=False)
+    assert toistaja.puuttuvat > 0
@@ -0,0 +1,62 @@
+# tests/test_keyword_correction.py
+import pytest
+
+from fuzzy_match import SymSpell, etaisyysraja
+from keyword_expansion import PrefixExpander
+from logic import korjaa_avainsanat
+
+TEKSTIT = [
+    "ja he tekivät katumus ja parannus",
+    "te olette kutsumat ja kutsunut olen",
+    "pysykää kutsumuksenne ja kutsumukseen",
+    "varokaa eksytyksen henkeä",
+    "eksytykseen ei saa langeta",
+    "lammas on eksynyt ja eksyt itsekin",
+]
+
+
+@pytest.fixture
+def hakuaineisto(korpus):
+    _, sanaindeksi = korpus(TEKSTIT)
+    sanakirja = set(sanaindeksi.postings)
+    return sanaindeksi, sanakirja
+
+
+def _ei_sumeaa():
+    raise AssertionError("SymSpelliä ei pitänyt rakentaa")
+
+
+def test_taivutusmuodot_loytyvat_laajentajalla(hakuaineisto):
+    sanaindeksi, sanakirja = hakuaineisto
+    korjatut, korvaukset = korjaa_avainsanat(
+        {"1.": ["kutsumus", "eksytys"]}, sanaindeksi, _ei_sumeaa,
+        laajentaja=PrefixExpander(sanakirja, sanaindeksi)
+    )
+    assert korjatut == {"1.": ["kutsumus", "eksytys"]}
+    assert korvaukset == []
+
+
+def test_vartalovaihtelu_ennen_sumeaa_korjausta(hakuaineisto):
+    sanaindeksi, _ = hakuaineisto
+    korjatut, korvaukset = korjaa_avainsanat(
+        {"1.": ["kutsumus", "eksytys"]}, sanaindeksi, _ei_sumeaa
+    )
+    assert korjatut == {
+        "1.": ["kutsumus", "kutsumukse", "eksytys", "eksytykse"]
+    }
+    assert [k[1] for k in korvaukset] == ["kutsumus", "eksytys"]
+
+
+def test_sumea_korjaus_sailyttaa_alkuperaisen(hakuaineisto):
+    sanaindeksi, sanakirja = hakuaineisto
+    korjatut, korvaukset = korjaa_avainsanat(
+        {"1.": ["katumuss", "xyz"]}, sanaindeksi, lambda: SymSpell(sanakirja)
+    )
+    assert korjatut == {"1.": ["katumuss", "katumus", "xyz"]}
+    assert korvaukset == [("1.", "katumuss", ["katumuss", "katumus"])]
+
+
+def test_etaisyysraja_lyhyille_sanoille():
+    assert etaisyysraja("abc") == 0
+    assert etaisyysraja("kutsumus") == 1
+    assert etaisyysraja("vanhurskaus") == 2
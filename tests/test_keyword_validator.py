@@ -0,0 +1,31 @@
+# tests/test_keyword_validator.py
+from keyword_validator import KeywordValidator, vartaloehdokkaat
+
+SANAKIRJA = {
+    "eksytyksen", "eksytykseen", "kutsumuksen", "kutsumukseen",
+    "rakkauden", "ihmisen", "usko",
+}
+
+
+def test_s_kse_vartalovaihtelu():
+    assert "eksytykse" in vartaloehdokkaat("eksytys")
+    assert "kutsumukse" in vartaloehdokkaat("kutsumus")
+
+
+def test_tunnetut_vartalot_hyvaksytaan():
+    validoija = KeywordValidator(SANAKIRJA)
+    for sana in ("eksytys", "kutsumus", "rakkaus", "ihminen", "usko"):
+        assert validoija.tarkista_sana(sana) is True, sana
+
+
+def test_loytymaton_sana_jaa_tekoalylle():
+    validoija = KeywordValidator(SANAKIRJA)
+    assert validoija.tarkista_sana("xyz") is None
+    assert validoija.tarkista_sana("kvanttifysiikka") is None
+    assert validoija.tarkista_sana("") is False
+    hyvaksytyt, hylatyt, avoimet = validoija.luokittele(
+        ["eksytys", "kvanttifysiikka", "usko xyz"]
+    )
+    assert hyvaksytyt == {"eksytys"}
+    assert hylatyt == set()
+    assert avoimet == {"kvanttifysiikka", "usko xyz"}
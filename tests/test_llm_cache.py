@@ -0,0 +1,47 @@
+# tests/test_llm_cache.py
+import pytest
+
+import logic
+from llm_cache import LLMCache
+from llm_providers import StubProvider
+
+
+@pytest.fixture
+def valimuisti(tmp_path, monkeypatch):
+    valimuisti = LLMCache(str(tmp_path / "llm_cache.sqlite"))
+    monkeypatch.setattr(logic, "llm_valimuisti", valimuisti)
+    return valimuisti
+
+
+def _tarjoaja(monkeypatch, vastaus):
+    tarjoaja = StubProvider(vastaus)
+    monkeypatch.setattr(logic, "hae_tarjoaja", lambda model_name: tarjoaja)
+    return tarjoaja
+
+
+def test_jasentyva_json_tallennetaan(valimuisti, monkeypatch):
+    tarjoaja = _tarjoaja(monkeypatch, '{"v1": 8}')
+    for _ in range(2):
+        vastaus, _ = logic.tee_api_kutsu("kehote", "malli", is_json=True)
+        assert vastaus == '{"v1": 8}'
+    assert len(tarjoaja.kutsut) == 1
+    assert valimuisti.osumat == 1
+
+
+def test_jasentymatonta_jsonia_ei_tallenneta(valimuisti, monkeypatch):
+    tarjoaja = _tarjoaja(monkeypatch, '{"v1": 8, "v2"')
+    for _ in range(2):
+        logic.tee_api_kutsu("kehote", "malli", is_json=True)
+    assert len(tarjoaja.kutsut) == 2
+    assert valimuisti.osumat == 0
+    avain = LLMCache.avain("malli", "kehote", 0.3, True)
+    assert valimuisti.hae(avain) is None
+
+
+def test_tekstivastaus_tallennetaan_ilman_json_tarkistusta(
+    valimuisti, monkeypatch
+):
+    tarjoaja = _tarjoaja(monkeypatch, "vapaata tekstiä {")
+    for _ in range(2):
+        logic.tee_api_kutsu("kehote", "malli")
+    assert len(tarjoaja.kutsut) == 1
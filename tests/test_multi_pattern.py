@@ -0,0 +1,11 @@
+# tests/test_multi_pattern.py
+from multi_pattern import etsi_osioittain
+
+
+def test_erikoishaut_ohitetaan():
+    hakukomennot = {
+        "1.": ["armo", r"re:arm\w+", '"armo ja"', "usko AND armo"],
+        "2.": ["usko"],
+    }
+    tulos = etsi_osioittain(hakukomennot, ["Armo ja rauha", "usko"])
+    assert tulos == {"1.": {0: {"armo"}}, "2.": {1: {"usko"}}}
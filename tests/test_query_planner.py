@@ -0,0 +1,27 @@
+# tests/test_query_planner.py
+from query_planner import QueryPlanner
+
+
+def test_laajimmasta_pudotetaan_ja_valikoivin_jaa(korpus):
+    # 'ja' 90 %:ssa ja 'oli' 40 %:ssa jakeista: molemmat ylittävät
+    # pudotusrajan, mutta valikoivampi 'oli' säilyy
+    tekstit = ["herra ja oli"] * 4 + ["herra ja sana"] * 5 + ["sana"]
+    _, sanaindeksi = korpus(tekstit)
+    suunnitelma = QueryPlanner(sanaindeksi).suunnittele({"1.": ["ja", "oli"]})
+
+    assert suunnitelma["1."]["pudotetut"] == ["ja"]
+    assert QueryPlanner.sovella({"1.": ["ja", "oli"]}, suunnitelma) == {
+        "1.": ["oli"]
+    }
+
+
+def test_valikoivat_avainsanat_sailyvat(korpus):
+    tekstit = ["herra ja oli"] * 4 + ["herra ja sana"] * 5 + ["sana"]
+    tekstit += ["muuta tekstiä"] * 90
+    _, sanaindeksi = korpus(tekstit)
+    suunnitelma = QueryPlanner(sanaindeksi).suunnittele(
+        {"1.": ["ja", "oli", "herra"]}
+    )
+    assert suunnitelma["1."]["pudotetut"] == ["ja", "herra"]
+    tilat = {sana: tila for sana, _, tila in suunnitelma["1."]["arviot"]}
+    assert tilat["oli"] == "laaja"
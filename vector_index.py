@@ -0,0 +1,111 @@
+# vector_index.py
+import numpy as np
+from scipy import sparse
+
+from word_index import tokenisoi
+
+NGRAMMIT = (3, 4)
+SANAN_PAINO = 2.0
+
+
+def _ngrammit(sana):
+    """Palauttaa sanan merkki-n-grammit rajamerkkeineen ('<sana>')."""
+    rajattu = f"<{sana}>"
+    return [
+        rajattu[i:i + n]
+        for n in NGRAMMIT for i in range(len(rajattu) - n + 1)
+    ]
+
+
+class TfidfIndex:
+    """
+    Paikallinen TF-IDF-vektori-indeksi koko korpukselle. Jokainen jae on
+    harva vektori sanoista ja niiden merkki-n-grammeista, joten saman sanan
+    taivutusmuodot ovat lähellä toisiaan. Haku on yksi matriisi-vektori-
+    tulo kaikkia jakeita vastaan.
+    """
+
+    def __init__(self, sanaindeksi):
+        self.jaevarasto = sanaindeksi.jaevarasto
+        sanasto = sanaindeksi.sanasto
+        self._piirteet = {}
+
+        # Sana -> piirteet (sana itse ja sen n-grammit)
+        rivit, sarakkeet, arvot = [], [], []
+        for sana_nro, sana in enumerate(sanasto):
+            piirteet = {self._piirre("w:" + sana, True): SANAN_PAINO}
+            for ngrammi in _ngrammit(sana):
+                sarake = self._piirre(ngrammi, True)
+                piirteet[sarake] = piirteet.get(sarake, 0.0) + 1.0
+            rivit.extend([sana_nro] * len(piirteet))
+            sarakkeet.extend(piirteet)
+            arvot.extend(piirteet.values())
+        sana_piirteet = sparse.csr_matrix(
+            (np.asarray(arvot, dtype=np.float32), (rivit, sarakkeet)),
+            shape=(len(sanasto), len(self._piirteet))
+        )
+
+        # Jae -> sanat suoraan sanaindeksin postings-listoista
+        postings = sanaindeksi.postings
+        jae_idt = [np.frombuffer(postings[sana], dtype=np.uint32)
+                   for sana in sanasto]
+        pituudet = np.fromiter((len(p) for p in jae_idt), dtype=np.int64,
+                               count=len(jae_idt))
+        jae_sanat = sparse.csr_matrix(
+            (np.ones(int(pituudet.sum()), dtype=np.float32),
+             (np.concatenate(jae_idt) if jae_idt else [],
+              np.repeat(np.arange(len(sanasto)), pituudet))),
+            shape=(len(self.jaevarasto), len(sanasto))
+        )
+
+        matriisi = (jae_sanat @ sana_piirteet).tocsr()
+        np.log1p(matriisi.data, out=matriisi.data)
+        df = np.bincount(matriisi.indices, minlength=matriisi.shape[1])
+        self._idf = (
+            np.log((1 + matriisi.shape[0]) / (1 + df)) + 1
+        ).astype(np.float32)
+        matriisi = matriisi @ sparse.diags(self._idf)
+        normit = np.sqrt(matriisi.multiply(matriisi).sum(axis=1)).A1
+        normit[normit == 0] = 1.0
+        self.matriisi = sparse.diags(1 / normit).astype(np.float32) @ matriisi
+        self.matriisi = self.matriisi.tocsr()
+
+    def _piirre(self, avain, lisaa=False):
+        sarake = self._piirteet.get(avain)
+        if sarake is None and lisaa:
+            sarake = self._piirteet[avain] = len(self._piirteet)
+        return sarake
+
+    def __len__(self):
+        return self.matriisi.shape[0]
+
+    def kyselyvektori(self, teksti):
+        """Muuntaa vapaan tekstin normalisoiduksi kyselyvektoriksi."""
+        vektori = np.zeros(len(self._idf), dtype=np.float32)
+        for sana in tokenisoi(teksti):
+            sarake = self._piirre("w:" + sana)
+            if sarake is not None:
+                vektori[sarake] += SANAN_PAINO
+            for ngrammi in _ngrammit(sana):
+                sarake = self._piirre(ngrammi)
+                if sarake is not None:
+                    vektori[sarake] += 1.0
+        np.log1p(vektori, out=vektori)
+        vektori *= self._idf
+        normi = np.linalg.norm(vektori)
+        return vektori / normi if normi else vektori
+
+    def search(self, teema, k=100):
+        """
+        Palauttaa k teemaa lähintä jaetta listana (jae_id, pisteet)
+        laskevassa järjestyksessä. Nollapisteiset jakeet jätetään pois.
+        """
+        pisteet = self.matriisi @ self.kyselyvektori(teema)
+        k = min(k, len(pisteet))
+        if k <= 0:
+            return []
+        parhaat = np.argpartition(-pisteet, k - 1)[:k]
+        parhaat = parhaat[np.lexsort((parhaat, -pisteet[parhaat]))]
+        return [
+            (int(i), float(pisteet[i])) for i in parhaat if pisteet[i] > 0
+        ]
@@ -0,0 +1,161 @@
+# verse_store.py
+import bisect
+import re
+from array import array
+
+VIITE_REGEX = re.compile(r'^\s*(.*?\D)\s*(\d+)\s*[:,]\s*(\d+)')
+ROOMALAINEN_REGEX = re.compile(r'^(iii|ii|i)(?=[\s.])')
+ROOMALAISET = {"i": "1", "ii": "2", "iii": "3"}
+
+
+def normalisoi_kirjan_nimi(nimi):
+    """
+    Normalisoi kirjan nimen tai lyhenteen hakuavaimeksi samalla tavalla
+    kuin lataa_raamattu rakentaa book_map-avaimet ("1. Kor." -> "1kor").
+    """
+    nimi = nimi.strip().lower()
+    nimi = ROOMALAINEN_REGEX.sub(lambda m: ROOMALAISET[m.group(1)], nimi)
+    return nimi.replace(".", "").replace(" ", "")
+
+
+class VerseStore:
+    """
+    Tiivis jaevarasto: jakeiden tekstit yhdessä listassa ja viitteet
+    rinnakkaisissa array('H')-sarakkeissa. Jakeen id on sen indeksi
+    kanonisessa järjestyksessä, joten id-järjestys on Raamatun järjestys.
+    `versio` on lähdeaineiston tarkiste (asettaa lataa_raamattu), jolla
+    korpuksesta johdetut välitulokset avainnetaan.
+    """
+
+    def __init__(self, tekstit, kirjat, luvut, jakeet, kirjan_nimet):
+        self.versio = None
+        self.tekstit = tekstit
+        self.kirjat = kirjat
+        self.luvut = luvut
+        self.jakeet = jakeet
+        self.kirjan_nimet = kirjan_nimet
+        self._aliakset = {}
+        self._jarjestetyt_aliakset = []
+        self.lisaa_aliakset({
+            normalisoi_kirjan_nimi(nimi): kirja_id
+            for kirja_id, nimi in kirjan_nimet.items()
+        })
+        self._id_kartta = {
+            self._avain(kirjat[i], luvut[i], jakeet[i]): i
+            for i in range(len(tekstit))
+        }
+
+    @classmethod
+    def from_book_data_map(cls, book_data_map, book_name_map):
+        """Rakentaa varaston lataa_raamattu-funktion karttojen pohjalta."""
+        tekstit = []
+        kirjat, luvut, jakeet = array('H'), array('H'), array('H')
+        for book_id in sorted(book_data_map, key=int):
+            luku_kartta = book_data_map[book_id].get("chapter", {})
+            for luku_nro in sorted(luku_kartta, key=int):
+                jae_kartta = luku_kartta[luku_nro].get("verse", {})
+                for jae_nro in sorted(jae_kartta, key=int):
+                    tekstit.append(jae_kartta[jae_nro].get("text", ""))
+                    kirjat.append(int(book_id))
+                    luvut.append(int(luku_nro))
+                    jakeet.append(int(jae_nro))
+        kirjan_nimet = {
+            int(book_id): nimi for book_id, nimi in book_name_map.items()
+        }
+        return cls(tekstit, kirjat, luvut, jakeet, kirjan_nimet)
+
+    @staticmethod
+    def _avain(kirja, luku, jae):
+        return (kirja << 32) | (luku << 16) | jae
+
+    def __len__(self):
+        return len(self.tekstit)
+
+    def hae_id(self, kirja_id, luku, jae):
+        """Palauttaa jakeen id:n tai None, jos jaetta ei ole."""
+        return self._id_kartta.get(
+            self._avain(int(kirja_id), int(luku), int(jae))
+        )
+
+    def lisaa_aliakset(self, aliakset):
+        """
+        Lisää kirjojen vaihtoehtoisia nimiä viitteiden tunnistukseen.
+        Avaimina normalisoidut nimet (ks. normalisoi_kirjan_nimi), arvoina
+        kirjan id:t.
+        """
+        for alias, kirja_id in aliakset.items():
+            if alias:
+                self._aliakset[alias] = int(kirja_id)
+        self._jarjestetyt_aliakset = sorted(self._aliakset)
+
+    def kirja_id_nimella(self, nimi):
+        """
+        Palauttaa kirjan id:n nimen tai lyhenteen perusteella. Tuntematon
+        lyhenne hyväksytään, jos se on yksiselitteisesti jonkin kirjan
+        nimen alku.
+        """
+        avain = normalisoi_kirjan_nimi(nimi)
+        kirja_id = self._aliakset.get(avain)
+        if kirja_id is not None or len(avain) < 3:
+            return kirja_id
+        alku = bisect.bisect_left(self._jarjestetyt_aliakset, avain)
+        loppu = bisect.bisect_left(self._jarjestetyt_aliakset, avain + "\uffff")
+        ehdokkaat = {
+            self._aliakset[alias]
+            for alias in self._jarjestetyt_aliakset[alku:loppu]
+        }
+        return ehdokkaat.pop() if len(ehdokkaat) == 1 else None
+
+    def id_viitteesta(self, viite_str, _kirja_muisti=None):
+        """
+        Muuntaa viitteen ('Joh. 3:16', '1. Kor 13,4', 'Kirja 3:16 - teksti')
+        jakeen id:ksi tai None, jos jaetta ei tunnisteta.
+        """
+        match = VIITE_REGEX.match(viite_str)
+        if not match:
+            return None
+        kirja_nimi, luku, jae = match.groups()
+        if _kirja_muisti is None:
+            kirja_id = self.kirja_id_nimella(kirja_nimi)
+        else:
+            if kirja_nimi not in _kirja_muisti:
+                _kirja_muisti[kirja_nimi] = self.kirja_id_nimella(kirja_nimi)
+            kirja_id = _kirja_muisti[kirja_nimi]
+        if kirja_id is None:
+            return None
+        return self.hae_id(kirja_id, luku, jae)
+
+    def resolve_many(self, viitteet):
+        """
+        Muuntaa listan viitteitä jakeiden id:iksi samassa järjestyksessä
+        (None tunnistamattomille). Kirjan nimet selvitetään kerran.
+        """
+        kirja_muisti = {}
+        return [self.id_viitteesta(v, kirja_muisti) for v in viitteet]
+
+    def viite(self, jae_id):
+        """Palauttaa jakeen viitteen muodossa 'Kirja Luku:Jae'."""
+        nimi = self.kirjan_nimet.get(self.kirjat[jae_id], "")
+        return f"{nimi} {self.luvut[jae_id]}:{self.jakeet[jae_id]}"
+
+    def muotoile(self, jae_id):
+        """Palauttaa jakeen muodossa 'Kirja Luku:Jae - teksti'."""
+        return f"{self.viite(jae_id)} - {self.tekstit[jae_id]}"
+
+    def seuraavat(self, jae_id, maara):
+        """Palauttaa enintään `maara` seuraavaa jaetta samasta luvusta."""
+        tulos = []
+        for seuraava in range(jae_id + 1, min(jae_id + 1 + maara, len(self))):
+            if (self.kirjat[seuraava] != self.kirjat[jae_id] or
+                    self.luvut[seuraava] != self.luvut[jae_id]):
+                break
+            tulos.append(seuraava)
+        return tulos
+
+    def jarjestysavain(self, jae_str):
+        """
+        Järjestysavain muotoillulle jaeriville: jakeen id tai len(self),
+        jos riviä ei tunnisteta (tuntemattomat rivit viimeiseksi).
+        """
+        jae_id = self.id_viitteesta(jae_str)
+        return len(self) if jae_id is None else jae_id
@@ -0,0 +1,109 @@
+# word_index.py
+import bisect
+import re
+from array import array
+
+SANA_REGEX = re.compile(r'\b\w+\b')
+
+
+def tokenisoi(teksti):
+    """Pilkkoo tekstin pienin kirjaimin kirjoitetuiksi sanoiksi."""
+    return SANA_REGEX.findall(teksti.lower())
+
+
+class WordIndex:
+    """
+    Käänteinen sanaindeksi: sana -> lista jae-id:itä kanonisessa
+    järjestyksessä. Rakennetaan kerran latauksen yhteydessä, tai
+    valmiista postings-kartasta (ks. corpus_snapshot).
+    """
+
+    def __init__(self, jaevarasto, postings=None):
+        self.jaevarasto = jaevarasto
+        if postings is None:
+            postings = {}
+            for jae_id, teksti in enumerate(jaevarasto.tekstit):
+                for sana in set(tokenisoi(teksti)):
+                    lista = postings.get(sana)
+                    if lista is None:
+                        lista = postings[sana] = array('I')
+                    lista.append(jae_id)
+        self.postings = postings
+        self.sanasto = sorted(postings)
+        # Koko sanasto yhtenä merkkijonona osamerkkijonohakua varten
+        self._sanasto_blob = "\n".join(self.sanasto)
+        self._sana_alut = []
+        kohta = 0
+        for sana in self.sanasto:
+            self._sana_alut.append(kohta)
+            kohta += len(sana) + 1
+        self._osa_valimuisti = {}
+
+    def __len__(self):
+        return len(self.jaevarasto)
+
+    def hae_tarkka(self, sana):
+        """Palauttaa jakeet, joissa sana esiintyy sellaisenaan."""
+        return set(self.postings.get(sana.lower(), ()))
+
+    def sanat_etuliitteella(self, etuliite):
+        """Palauttaa sanaston sanat, jotka alkavat annetulla etuliitteellä."""
+        etuliite = etuliite.lower()
+        alku = bisect.bisect_left(self.sanasto, etuliite)
+        loppu = bisect.bisect_left(self.sanasto, etuliite + "\uffff")
+        return self.sanasto[alku:loppu]
+
+    def sanat_joissa(self, osa):
+        """Palauttaa sanaston sanat, jotka sisältävät annetun merkkijonon."""
+        osa = osa.lower()
+        if osa in self._osa_valimuisti:
+            return self._osa_valimuisti[osa]
+        loydetyt = []
+        edellinen = -1
+        kohta = self._sanasto_blob.find(osa)
+        while kohta != -1:
+            i = bisect.bisect_right(self._sana_alut, kohta) - 1
+            if i != edellinen:
+                loydetyt.append(self.sanasto[i])
+                edellinen = i
+            kohta = self._sanasto_blob.find(osa, kohta + 1)
+        self._osa_valimuisti[osa] = loydetyt
+        return loydetyt
+
+    def _jakeet_sanoille(self, sanat):
+        tulos = set()
+        for sana in sanat:
+            tulos.update(self.postings[sana])
+        return tulos
+
+    def hae(self, hakusana):
+        """
+        Palauttaa jae-id:t, joiden tekstissä hakusana esiintyy
+        osamerkkijonona (kirjainkoosta riippumatta), kuten vanhassa
+        täyshaussa.
+        """
+        osat = tokenisoi(hakusana)
+        pattern = re.compile(re.escape(hakusana), re.IGNORECASE)
+        tekstit = self.jaevarasto.tekstit
+        if not osat:
+            # Ei sanamerkkejä: indeksistä ei ole apua, käydään jakeet läpi
+            return {
+                i for i, teksti in enumerate(tekstit) if pattern.search(teksti)
+            }
+        if len(osat) == 1 and osat[0] == hakusana.lower():
+            return self._jakeet_sanoille(self.sanat_joissa(osat[0]))
+
+        # Moniosainen haku: jokaisen osan täytyy löytyä jonkin sanan sisältä,
+        # minkä jälkeen ehdokkaat tarkistetaan alkuperäisellä haulla.
+        # Leikkaus aloitetaan valikoivimmasta osasta (pienin postings-summa).
+        osien_sanat = sorted(
+            (self.sanat_joissa(osa) for osa in set(osat)),
+            key=lambda sanat: sum(len(self.postings[s]) for s in sanat)
+        )
+        ehdokkaat = None
+        for sanat in osien_sanat:
+            osumat = self._jakeet_sanoille(sanat)
+            ehdokkaat = osumat if ehdokkaat is None else ehdokkaat & osumat
+            if not ehdokkaat:
+                return set()
+        return {i for i in ehdokkaat if pattern.search(tekstit[i])}